@@ -0,0 +1,90 @@
+'''
+code-switch augmentation while batching: the base corpus is loaded (and cached) once, and every batch gets a fresh
+draw of seed-dictionary substitutions and Language= tags, instead of one pre-generated file per variant
+'''
+import random
+from torchtext import data
+from scripts import transform
+
+
+def _escape(word):
+    # the CSV loader's escaping; examples hold words as it left them
+    return word.replace('"', '<qt>').replace(',', '<cm>')
+
+
+class CodeSwitch:
+    '''
+    table: seed dictionary, word -> translation (transform.load_seeds; both directions by default)
+    p: chance that a word with an entry is swapped
+    languages: (language of the corpus, language of the translations); when set, MISC becomes Language=<either>
+        for every word, so the tags follow the swaps
+    '''
+    def __init__(self, table, p=0.5, languages=None, seed=1337):
+        self.table = {_escape(source): _escape(target) for source, target in table.items()}
+        self.p = p
+        self.languages = languages
+        self.seed = seed
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        return cls(transform.load_seeds(path), **kwargs)
+
+    def rng(self, epoch, batch):
+        # the draw for a batch depends on the seed and its position only, so reruns augment the same way
+        return random.Random("{}:{}:{}".format(self.seed, epoch, batch))
+
+    def __call__(self, example, rng):
+        # a copy; the base corpus is never touched
+        new = data.Example()
+        new.__dict__.update(example.__dict__)
+        new.form = list(example.form)
+        swapped = [False] * len(new.form)
+        for n, word in enumerate(new.form):
+            if word in self.table and rng.random() < self.p:
+                new.form[n], swapped[n] = self.table[word], True
+
+        if hasattr(example, 'char'):
+            new.char = [list(word) if swap else chars for word, chars, swap in zip(new.form, example.char, swapped)]
+        if self.languages and hasattr(example, 'misc'):
+            new.misc = ["Language={}".format(self.languages[swap]) for swap in swapped]
+        return new
+
+    def vocab_source(self, field_tuples):
+        '''
+        a one-example dataset of everything an augmented batch can hold that the corpus may not: the translations
+        and the Language= tags; build the vocabs over it along with train so none of them is <unk>
+        '''
+        names = dict(field_tuples)
+        example = data.Example()
+        for name in names:
+            setattr(example, name, [])
+        example.form = sorted(set(self.table.values()))
+        if 'char' in names:
+            example.char = [list(word) for word in example.form]
+        if self.languages and 'misc' in names:
+            example.misc = ["Language={}".format(language) for language in self.languages]
+        return data.Dataset([example], field_tuples)
+
+
+class AugmentingIterator(data.Iterator):
+    '''
+    a data.Iterator whose batches are built from augmented copies of the examples
+    the draws follow the training epoch set_epoch was last given (Trainer sets it), not how often the batches were
+    rebuilt: init_epoch runs more than once an epoch, and a resumed run starts from its checkpoint's epoch
+    '''
+    def __init__(self, dataset, augment, *args, **kwargs):
+        super().__init__(dataset, *args, **kwargs)
+        self.augment = augment
+        self.augment_epoch = 0
+
+    def set_epoch(self, epoch):
+        self.augment_epoch = epoch
+
+    def create_batches(self):
+        super().create_batches()
+        self.batches = self._augmented(self.batches, self.augment_epoch)
+
+    def _augmented(self, batches, epoch):
+        for n, minibatch in enumerate(batches):
+            rng = self.augment.rng(epoch, n)
+            yield [self.augment(example, rng) for example in minibatch]
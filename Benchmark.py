@@ -0,0 +1,406 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import argparse
+import contextlib
+import subprocess
+import multiprocessing
+import numpy as np
+import torch
+from torch.autograd import Variable
+import Config
+import Loader
+from scripts import cle
+from Modules import ShorterBiaffine, LongerBiaffine
+from Runnables import Analyser, Tagger, Parser, CLTagger, TagAndParse
+
+MODELS = ['analyser', 'tagger', 'parser', 'cltagger', 'tagandparse']
+# sentence length buckets for latency, upper bounds inclusive
+BUCKETS = [10, 20, 40, 80, 10 ** 6]
+UPOS = ['NOUN', 'VERB', 'ADJ', 'ADP', 'DET', 'PRON', 'PUNCT', 'PROPN', 'ADV', 'AUX']
+DEPRELS = ['nsubj', 'obj', 'amod', 'case', 'det', 'nmod', 'obl', 'punct', 'advmod', 'aux', 'conj']
+FEATS = ['_', 'Number=Sing', 'Number=Plur', 'Tense=Past', 'Definite=Def|PronType=Art']
+# imports suite: the modules timed on their own, and Runner.py's subcommands, whose --help is timed
+IMPORTS = ['Config', 'Scheduler', 'Runnables', 'Loader', 'Trainer', 'Pipeline', 'Runner']
+COMMANDS = [[], ['train'], ['eval'], ['predict'], ['tokenise']]
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_runnable(model, sizes, args, vocab, config):
+    # the embedding setup a --load'ed model was trained with
+    embed = Config.embed_params(config)
+    tag_dims = dict(Config.tagger_params(config['tagger']), **embed)
+    parse_dims = dict(Config.parser_params(config['parser']), **embed)
+
+    if model == 'analyser':
+        return Analyser(sizes, args, vocab, **embed)
+    elif model == 'tagger':
+        return Tagger(sizes, args, vocab, **tag_dims)
+    elif model == 'cltagger':
+        # same treebank on both sides: only the shared/split encoder cost matters here
+        return CLTagger(args, sizes, sizes, vocab[0], vocab[0], **embed)
+    elif model == 'parser':
+        return Parser(sizes, args, vocab, embeddings=vocab[0], **parse_dims)
+    return TagAndParse(sizes, args, vocab, embeddings=vocab[0], **parse_dims)
+
+
+def forward_fn(model, runnable):
+    # one inference pass over a batch, whatever the model's forward signature is
+    if model in ('analyser', 'tagger'):
+        return lambda batch: runnable(batch.form[0], batch.form[1])
+    elif model == 'cltagger':
+        return lambda batch: runnable(batch.form[0], batch.form[1], "main")
+    return lambda batch: runnable(batch.form[0], batch.upos, batch.form[1], None, None)
+
+
+def synthetic_treebank(path, sentences, min_len=3, max_len=60, vocab_size=5000, seed=1337):
+    '''
+    random but well-formed CoNLL-U: every token gets a head in the same sentence, so any model can train on it
+    '''
+    rng = random.Random(seed)
+    words = ["w{}".format(i) for i in range(vocab_size)]
+    with open(path, "w") as f:
+        for n in range(sentences):
+            length = rng.randint(min_len, max_len)
+            root = rng.randint(1, length)
+            f.write("# sent_id = synthetic-{}\n".format(n))
+            for i in range(1, length + 1):
+                head = 0 if i == root else rng.choice([j for j in range(1, length + 1) if j != i])
+                deprel = 'root' if i == root else rng.choice(DEPRELS)
+                form = rng.choice(words)
+                f.write("\t".join([str(i), form, form, rng.choice(UPOS), '_', rng.choice(FEATS), str(head), deprel,
+                                   '_', '_']) + "\n")
+            f.write("\n")
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.array(values)
+    return {'n': len(values), 'p50': float(np.percentile(values, 50)), 'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)), 'mean': float(values.mean())}
+
+
+def bucket_of(length):
+    for bound in BUCKETS:
+        if length <= bound:
+            return bound
+
+
+def bucket_name(bound):
+    previous = [0] + BUCKETS
+    low = previous[BUCKETS.index(bound)] + 1
+    return "{}+".format(low) if bound == BUCKETS[-1] else "{}-{}".format(low, bound)
+
+
+def peak_rss_mb():
+    # linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_model(model, args, config, iterators):
+    (train_loader, dev_loader, _), sizes, vocab = iterators
+    runnable = build_runnable(model, sizes, args, vocab, config)
+    train_sentences = len(train_loader.dataset)
+    train_tokens = sum(len(example.form) + 1 for example in train_loader.dataset)
+
+    # MetricsLogger prints a loss/throughput line every log interval; keep it out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.time()
+        if model == 'cltagger':
+            runnable.train_(0, train_loader, type_task="main")
+        else:
+            runnable.train_(0, train_loader)
+        train_seconds = time.time() - start
+
+    runnable.eval()
+    forward = forward_fn(model, runnable)
+    latencies = {bound: [] for bound in BUCKETS}
+    inference_tokens, inference_seconds = 0, 0
+    for batch in dev_loader:
+        length = int(batch.form[1].sum())
+        start = time.time()
+        forward(batch)
+        seconds = time.time() - start
+        latencies[bucket_of(length)].append(seconds * 1000)
+        inference_tokens += length
+        inference_seconds += seconds
+
+    return {
+        'train': {'sentences_per_sec': train_sentences / train_seconds, 'tokens_per_sec': train_tokens / train_seconds,
+                  'seconds': train_seconds},
+        'inference': {'sentences_per_sec': len(dev_loader.dataset) / inference_seconds,
+                      'tokens_per_sec': inference_tokens / inference_seconds, 'seconds': inference_seconds,
+                      'latency_ms': {bucket_name(b): percentiles(v) for b, v in latencies.items() if v}},
+        'parameters': sum(p.numel() for p in runnable.parameters()),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_mst(iterators, seed=1337):
+    (_, dev_loader, _), _, _ = iterators
+    rng = np.random.RandomState(seed)
+    latencies = {bound: [] for bound in BUCKETS}
+    sentences, tokens, total = 0, 0, 0
+    for example in dev_loader.dataset:
+        # cle.mst takes a softmaxed score matrix, root included
+        length = len(example.form) + 1
+        scores = rng.rand(length, length)
+        scores /= scores.sum(axis=1, keepdims=True)
+        start = time.time()
+        cle.mst(scores)
+        seconds = time.time() - start
+        latencies[bucket_of(length)].append(seconds * 1000)
+        sentences, tokens, total = sentences + 1, tokens + length, total + seconds
+
+    return {'inference': {'sentences_per_sec': sentences / total, 'tokens_per_sec': tokens / total, 'seconds': total,
+                          'latency_ms': {bucket_name(b): percentiles(v) for b, v in latencies.items() if v}},
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def _isolated(fn, *fn_args):
+    # one forked process per model so peak RSS is that model's, not the high-water mark of everything before it
+    results = multiprocessing.Queue()
+
+    def target():
+        torch.manual_seed(1337)
+        results.put(fn(*fn_args))
+
+    worker = multiprocessing.Process(target=target)
+    worker.start()
+    result = results.get()
+    worker.join()
+    return result
+
+
+def bench_precision(runnable, loader):
+    '''
+    evaluate the same weights in fp32 and under bf16 autocast: throughput and metric deltas
+    '''
+    if not hasattr(torch, 'autocast'):
+        raise SystemExit("precision suite: torch {} has no autocast, there is no bf16 run to compare"
+                         .format(torch.__version__))
+
+    tokens = sum(int(batch.form[1].sum()) for batch in loader)
+    results = {}
+    for name, bf16 in [('fp32', False), ('bf16', True)]:
+        runnable.bf16 = bf16
+        start = time.time()
+        runnable.evaluate_(loader)
+        seconds = time.time() - start
+        results[name] = dict(runnable.scores, seconds=seconds, tokens_per_sec=tokens / seconds)
+
+    runnable.bf16 = False
+    results['delta'] = {k: results['bf16'][k] - results['fp32'][k] for k in runnable.scores}
+    results['speedup'] = results['fp32']['seconds'] / results['bf16']['seconds']
+    return results
+
+
+def measure(runnable, loader):
+    '''
+    one evaluate_ pass: its scores, how long it took and the model's size
+    '''
+    tokens = sum(int(batch.form[1].sum()) for batch in loader)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.time()
+        runnable.evaluate_(loader)
+        seconds = time.time() - start
+
+    return dict(runnable.scores, seconds=seconds, tokens_per_sec=tokens / seconds,
+                parameters=sum(p.numel() for p in runnable.parameters()))
+
+
+def concat_shorter_biaffine(module, input1, input2):
+    # ShorterBiaffine.forward as it was, with the ones concatenated onto input1; the reference for bench_biaffine
+    batch_size, len1, dim1 = input1.size()
+    ones = torch.ones(batch_size, len1, 1)
+    if input1.is_cuda:
+        ones = ones.cuda()
+    input1 = torch.cat((input1, Variable(ones)), dim=2)
+    dim1 += 1
+
+    input1 = input1.contiguous().view(batch_size * len1, dim1)
+    W = module.weight.transpose(1, 2).contiguous().view(dim1, dim1 - 1)
+    affine = (input1 @ W).view(batch_size, len1, dim1 - 1)
+    return (affine @ input2.transpose(1, 2)).view(batch_size, len1, 1, len1).transpose(2, 3).squeeze(3)
+
+
+def concat_longer_biaffine(module, input1, input2):
+    # LongerBiaffine.forward as it was
+    batch_size, len1, dim1 = input1.size()
+    batch_size, len2, dim2 = input2.size()
+    ones = torch.ones(batch_size, len1, 1)
+    if input1.is_cuda:
+        ones = ones.cuda()
+    input1 = torch.cat((input1, Variable(ones)), dim=2)
+    input2 = torch.cat((input2, Variable(ones)), dim=2)
+    dim1 += 1
+    dim2 += 1
+    input1 = input1.view(batch_size * len1, dim1)
+    weight = module.weight.transpose(1, 2).contiguous().view(dim1, module.dep_labels * dim2)
+    affine = (input1 @ weight).view(batch_size, len1 * module.dep_labels, dim2)
+    biaffine = (affine @ input2.transpose(1, 2)).view(batch_size, len1, module.dep_labels, len2).transpose(2, 3)
+    biaffine += module.bias.expand_as(biaffine)
+    return biaffine
+
+
+def _time(fn, repeats, backward):
+    timings = []
+    for _ in range(repeats):
+        start = time.time()
+        out = fn()
+        if backward:
+            out.sum().backward()
+        timings.append((time.time() - start) * 1000)
+    return percentiles(timings)
+
+
+def bench_biaffine(config, batch_size, length, labels=40, repeats=50, seed=1337):
+    '''
+    the fused arc and label biaffines against the ones-concatenating versions they replaced,
+    at the parser's REDUCE_DIM_ARC / REDUCE_DIM_LABEL, forward alone and forward + backward
+    '''
+    torch.manual_seed(seed)
+    arc_dim, label_dim = int(config['parser']['REDUCE_DIM_ARC']), int(config['parser']['REDUCE_DIM_LABEL'])
+    layers = {'arc': (ShorterBiaffine(arc_dim), arc_dim, concat_shorter_biaffine),
+              'label': (LongerBiaffine(label_dim, label_dim, labels), label_dim, concat_longer_biaffine)}
+
+    results = {}
+    for name, (module, dim, reference) in layers.items():
+        input1 = Variable(torch.randn(batch_size, length, dim), requires_grad=True)
+        input2 = Variable(torch.randn(batch_size, length, dim), requires_grad=True)
+        fused, concat = lambda: module(input1, input2), lambda: reference(module, input1, input2)
+
+        result = {'dim': dim, 'max_abs_diff': float((fused() - concat()).data.abs().max())}
+        for mode, backward in [('forward', False), ('backward', True)]:
+            result[mode] = {'fused_ms': _time(fused, repeats, backward), 'concat_ms': _time(concat, repeats, backward)}
+            result[mode]['speedup'] = result[mode]['concat_ms']['p50'] / result[mode]['fused_ms']['p50']
+        results[name] = result
+
+    return results
+
+
+def _seconds(command, repeats):
+    # median wall time of fresh interpreters running command, from this directory so the modules resolve
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable] + command, stdout=subprocess.DEVNULL, cwd=HERE)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def bench_imports(repeats=5):
+    '''
+    start-up cost: seconds to import each module in a fresh interpreter (over a bare interpreter's start), and
+    the wall time of Runner.py's help screens
+    '''
+    bare = _seconds(['-c', 'pass'], repeats)
+    results = {'interpreter': bare, 'imports': {}, 'help': {}}
+    for module in IMPORTS:
+        results['imports'][module] = _seconds(['-c', 'import ' + module], repeats) - bare
+    for command in COMMANDS:
+        results['help'][" ".join(['Runner.py'] + command)] = _seconds(['Runner.py'] + command + ['--help'], repeats)
+    return results
+
+
+def environment(args):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit, 'torch': torch.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'threads': torch.get_num_threads(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': args.config}
+
+
+def write_report(report, path=None):
+    # closed (and so flushed) when it's a file; stdout is left open
+    with contextlib.ExitStack() as stack:
+        out = stack.enter_context(open(path, "w")) if path else sys.stdout
+        json.dump(report, out, indent=2)
+        out.write("\n")
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('suite', choices=['throughput', 'precision', 'biaffine', 'imports'])
+    arg_parser.add_argument('--models', default=",".join(MODELS + ['mst']))
+    arg_parser.add_argument('--model', choices=MODELS, default='parser', help="precision suite only")
+    arg_parser.add_argument('--config', default='./config.ini')
+    arg_parser.add_argument('--load', action='store', help="precision suite only")
+    # the bundled treebanks only ship dev/test, so training reuses dev unless --train is given
+    arg_parser.add_argument('--train', action='store')
+    arg_parser.add_argument('--dev', default='./data/UD_English/en-ud-dev.conllu')
+    arg_parser.add_argument('--synthetic', type=int, default=0, help="benchmark on this many random sentences instead")
+    arg_parser.add_argument('--threads', type=int, default=0)
+    arg_parser.add_argument('--embed', action='store')
+    arg_parser.add_argument('--out', action='store')
+    # biaffine suite: shape of the random inputs
+    arg_parser.add_argument('--batch-size', type=int, default=32)
+    arg_parser.add_argument('--length', type=int, default=40)
+    # imports suite: fresh interpreters per measurement
+    arg_parser.add_argument('--repeats', type=int, default=5)
+    args = arg_parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    config = Config.read(args.config)
+
+    if args.suite == 'imports':
+        report = {'suite': args.suite, 'environment': environment(args), 'results': bench_imports(args.repeats)}
+        write_report(report, args.out)
+        return
+
+    if args.suite == 'biaffine':
+        # no treebank needed
+        report = {'suite': args.suite, 'shape': [args.batch_size, args.length], 'environment': environment(args),
+                  'results': bench_biaffine(config, args.batch_size, args.length)}
+        write_report(report, args.out)
+        return
+
+    if args.synthetic:
+        if not os.path.exists(".tmp"):
+            os.makedirs(".tmp")
+        args.train = args.dev = os.path.join(".tmp", "synthetic.conllu")
+        synthetic_treebank(args.dev, args.synthetic)
+
+    # what Loader and the runnables expect to find on args
+    args.train = args.train or args.dev
+    args.test = args.dev
+    args.use_chars, args.use_cuda, args.semtag, args.save = False, False, False, None
+
+    # with the vocab caps of the config, so a --load'ed model's embedding rows line up
+    iterators = Loader.get_iterators(args, int(config['parser']['BATCH_SIZE']), **Config.vocab_params(config))
+
+    report = {'suite': args.suite, 'data': 'synthetic-{}'.format(args.synthetic) if args.synthetic else args.dev,
+              'environment': environment(args), 'results': {}}
+
+    if args.suite == 'precision':
+        (_, dev_loader, _), sizes, vocab = iterators
+        runnable = build_runnable(args.model, sizes, args, vocab, config)
+        if args.load:
+            with open(args.load, "rb") as f:
+                runnable.load_state_dict(torch.load(f, map_location=lambda storage, loc: storage))
+        report['results'][args.model] = bench_precision(runnable, dev_loader)
+
+    else:
+        for model in args.models.split(","):
+            print("Benchmarking {}".format(model), file=sys.stderr)
+            if model == 'mst':
+                report['results'][model] = _isolated(bench_mst, iterators)
+            else:
+                report['results'][model] = _isolated(bench_model, model, args, config, iterators)
+
+    write_report(report, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,39 @@
-import sys
-import configparser
 import argparse
 import torch
-import Loader
-import torch.nn.functional as F
+import Config
+import Telemetry
 from torch.autograd import Variable
-from Runner import build_data
-from Helpers import process_batch
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', action='store_true')
-parser.add_argument('--cuda', action='store_true')
-parser.add_argument('--config', default='./config.ini')
-parser.add_argument('--train', action='append')
-parser.add_argument('--dev', action='append')
-parser.add_argument('--test', action='append')
-parser.add_argument('--embed', action='append')
-args = parser.parse_args()
-
-config = configparser.ConfigParser()
-config.read(args.config)
-
-BATCH_SIZE = int(config['tagger']['BATCH_SIZE'])
-EMBED_DIM = int(config['tagger']['EMBED_DIM'])
-LSTM_DIM = int(config['tagger']['LSTM_DIM'])
-LSTM_LAYERS = int(config['tagger']['LSTM_LAYERS'])
-MLP_DIM = int(config['tagger']['MLP_DIM'])
-LEARNING_RATE = float(config['tagger']['LEARNING_RATE'])
-EPOCHS = int(config['tagger']['EPOCHS'])
+from Scheduler import Scheduler
 
 
 class CLTagger(torch.nn.Module):
-    def __init__(self, main_loader, aux_loader):
+    def __init__(self, main_loader, aux_loader, embed_dim=300, lstm_dim=400, lstm_layers=1, mlp_dim=400,
+                 learning_rate=2e-3):
         super().__init__()
+        self.metrics = Telemetry.MetricsLogger()
 
         self.main_loader = main_loader
         self.aux_loader = aux_loader
         #Load pretrained embeds
-        self.embeds_main = torch.nn.Embedding(main_loader['sizes']['vocab'], EMBED_DIM)
+        self.embeds_main = torch.nn.Embedding(main_loader['sizes']['vocab'], embed_dim)
         self.embeds_main.weight.data.copy_(main_loader['vocab'].vectors)
-        self.embeds_aux = torch.nn.Embedding(aux_loader['sizes']['vocab'], EMBED_DIM)
+        self.embeds_aux = torch.nn.Embedding(aux_loader['sizes']['vocab'], embed_dim)
         self.embeds_aux.weight.data.copy_(aux_loader['vocab'].vectors)
         #Pass through shared then individual LSTMs
-        self.lstm_shared = torch.nn.LSTM(EMBED_DIM, LSTM_DIM, LSTM_LAYERS, batch_first=True, bidirectional=True, dropout=0.5)
-        self.lstm_main = torch.nn.LSTM(LSTM_DIM * 2, LSTM_DIM, LSTM_LAYERS, batch_first=True, bidirectional=True, dropout=0.5)
-        self.lstm_aux = torch.nn.LSTM(LSTM_DIM * 2, LSTM_DIM, LSTM_LAYERS, batch_first=True, bidirectional=True, dropout=0.5)
+        self.lstm_shared = torch.nn.LSTM(embed_dim, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.5)
+        self.lstm_main = torch.nn.LSTM(lstm_dim * 2, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.5)
+        self.lstm_aux = torch.nn.LSTM(lstm_dim * 2, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.5)
         #Pass through individual MLPs
         self.relu = torch.nn.ReLU()
-        self.mlp_main = torch.nn.Linear(LSTM_DIM * 2, MLP_DIM)
-        self.mlp_aux = torch.nn.Linear(LSTM_DIM * 2, MLP_DIM)
+        self.mlp_main = torch.nn.Linear(lstm_dim * 2, mlp_dim)
+        self.mlp_aux = torch.nn.Linear(lstm_dim * 2, mlp_dim)
         #Outs
-        self.out_main = torch.nn.Linear(MLP_DIM, main_loader['sizes']['postags'])
-        self.out_aux = torch.nn.Linear(MLP_DIM, aux_loader['sizes']['postags'])
+        self.out_main = torch.nn.Linear(mlp_dim, main_loader['sizes']['postags'])
+        self.out_aux = torch.nn.Linear(mlp_dim, aux_loader['sizes']['postags'])
         #Losses
         self.criterion_main = torch.nn.CrossEntropyLoss(ignore_index=-1)
         self.criterion_aux = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimizer = torch.optim.Adam(self.parameters(), lr=LEARNING_RATE, betas=(0.9, 0.9))
+        self.optimizer = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
         self.dropout = torch.nn.Dropout(p=0.5)
 
     def forward_main(self, forms, pack):
@@ -90,46 +68,43 @@ class CLTagger(torch.nn.Module):
         # reduce to dim no_of_tags
         return self.out_aux(mlp_out)
 
-def train(model, epoch, train_loaders):
+def train(model, epoch, scheduler):
     model.train()
 
-    def get_loss(train_loader, type_task="main"):
-        train_loader["train"].init_epoch()
-        for i, batch in enumerate(train_loader["train"]):
-            (x_forms, pack), x_tags, y_heads, y_deprels = batch.form, batch.upos, batch.head, batch.deprel
+    def get_loss(batch, type_task="main"):
+        (x_forms, pack), x_tags = batch.form, batch.upos
 
-            mask = torch.zeros(pack.size()[0], max(pack)).type(torch.LongTensor)
-            for n, size in enumerate(pack):
-                mask[n, 0:size] = 1
+        if type_task == "aux":
+            y_pred = model.forward_aux(x_forms, pack)
+        else:
+            y_pred = model.forward_main(x_forms, pack)
+        # reshape for cross-entropy
+        batch_size, longest_sentence_in_batch = x_forms.size()
 
-            if type_task == "aux":
-                y_pred = model.forward_aux(x_forms, pack)
-            else:
-                y_pred = model.forward_main(x_forms, pack)                
-            # reshape for cross-entropy
-            batch_size, longest_sentence_in_batch = x_forms.size()
+        # predictions: (B x S x T) => (B * S, T)
+        # heads: (B x S) => (B * S)
+        y_pred = y_pred.view(batch_size * longest_sentence_in_batch, -1)
+        x_tags = x_tags.contiguous().view(batch_size * longest_sentence_in_batch)
 
-            # predictions: (B x S x T) => (B * S, T)
-            # heads: (B x S) => (B * S)
-            y_pred = y_pred.view(batch_size * longest_sentence_in_batch, -1)
-            x_tags = x_tags.contiguous().view(batch_size * longest_sentence_in_batch)
+        criterion = model.criterion_aux if type_task == "aux" else model.criterion_main
+        return criterion(y_pred, x_tags), pack.tolist()
 
-            if type_task == "aux":
-                train_loss = model.criterion_aux(y_pred, x_tags)
-            else:
-                train_loss = model.criterion_main(y_pred, x_tags)
+    print("Training main and aux tasks...")
+    scheduler.init_epoch()
+    for step in scheduler:
+        train_loss, lengths = 0, []
+        for task, batch in step:
+            loss, pack = get_loss(batch, task)
+            train_loss = train_loss + scheduler.weights[task] * loss
+            lengths += pack
 
-            model.zero_grad()
-            train_loss.backward()
-            model.optimizer.step()
+        model.zero_grad()
+        train_loss.backward()
+        model.optimizer.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(
-                epoch, (i + 1) * len(x_forms), len(train_loader["train"].dataset), train_loss.data))
+        model.metrics.log(epoch, train_loss, lengths)
 
-    print("Training main task...")
-    print("Training aux task...")
-    get_loss(train_loaders[0], type_task="main")
-    get_loss(train_loaders[1], type_task="aux")
+    model.metrics.end_epoch(epoch)
 
 def evaluate(model, test_loader, type_task="main"):
     correct, total = 0, 0
@@ -155,18 +130,39 @@ def evaluate(model, test_loader, type_task="main"):
 
     print("Accuracy = {}/{} = {}".format(correct, total, (correct / total)))
 
-def main():
-
-    loaders = Loader.get_iterators_cl(args, BATCH_SIZE)
-
-    tagger = CLTagger(loaders[0], loaders[1])
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--debug', action='store_true')
+    arg_parser.add_argument('--cuda', action='store_true')
+    arg_parser.add_argument('--config', default='./config.ini')
+    # the main task's treebank, then the aux task's
+    arg_parser.add_argument('--train', nargs=2, required=True)
+    arg_parser.add_argument('--dev', nargs=2, required=True)
+    arg_parser.add_argument('--test', nargs=2, required=True)
+    arg_parser.add_argument('--embed', required=True)
+    args = arg_parser.parse_args(argv)
+    # what Loader reads off args
+    args.use_cuda, args.use_chars = args.cuda, False
+
+    config = Config.read(args.config)
+    batch_size = int(config['tagger']['BATCH_SIZE'])
+
+    import Loader
+    loaders = [Loader.task_iterators(args, (args.train[n], args.dev[n], args.test[n]), batch_size,
+                                     **Config.vocab_params(config)) for n in range(2)]
+
+    tagger = CLTagger(loaders[0], loaders[1], **Config.tagger_params(config['tagger']))
     if args.cuda:
         tagger.cuda()
 
+    # the tasks' batches interleaved, so the shared LSTM isn't dragged a whole epoch each way
+    scheduler = Scheduler({"main": loaders[0]["train"], "aux": loaders[1]["train"]},
+                          **Config.multitask_params(config))
+
     # training
     print("Training")
-    for epoch in range(EPOCHS):
-        train(tagger, epoch, loaders)
+    for epoch in range(int(config['tagger']['EPOCHS'])):
+        train(tagger, epoch, scheduler)
         print("Main task dev acc.:")
         evaluate(tagger, loaders[0]["dev"], type_task="main")
         print("Aux task dev acc.:")
@@ -176,5 +172,6 @@ def main():
     print("Eval")
     evaluate(tagger, loaders[0]["test"], type_task="main")
 
+
 if __name__ == '__main__':
     main()
@@ -1,79 +1,50 @@
 import torch
-import argparse
-import configparser
 import Helpers
+import Telemetry
 from torch.autograd import Variable
-from Modules import ShorterBiaffine, LongerBiaffine
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', action='store_true')
-parser.add_argument('--cuda', action='store_true')
-parser.add_argument('--code_switch', action='store_true')
-parser.add_argument('--config', default='./config.ini')
-parser.add_argument('--train', default='./data/sv-ud-train.conllu')
-parser.add_argument('--dev', default='./data/sv-ud-dev.conllu')
-parser.add_argument('--test', default='./data/sv-ud-test.conllu')
-args = parser.parse_args()
-
-config = configparser.ConfigParser()
-config.read(args.config)
-
-BATCH_SIZE = int(config['parser']['BATCH_SIZE'])
-EMBED_DIM = int(config['parser']['EMBED_DIM'])
-LSTM_DIM = int(config['parser']['LSTM_DIM'])
-LSTM_LAYERS = int(config['parser']['LSTM_LAYERS'])
-REDUCE_DIM_ARC = int(config['parser']['REDUCE_DIM_ARC'])
-REDUCE_DIM_LABEL = int(config['parser']['REDUCE_DIM_LABEL'])
-LEARNING_RATE = float(config['parser']['LEARNING_RATE'])
-EPOCHS = int(config['parser']['EPOCHS'])
-
-
-class CSParser(torch.nn.Module):
-    def __init__(self, sizes, args):
+from Modules import ShorterBiaffine, LongerBiaffine, AuxHeads
+
+
+class CSParser(torch.nn.Module, AuxHeads):
+    def __init__(self, sizes, args, embed_dim=300, lstm_dim=500, lstm_layers=3, reduce_dim_arc=400, reduce_dim_label=100,
+                 learning_rate=1e-3):
         super().__init__()
+        self.metrics = Telemetry.MetricsLogger()
 
         self.use_cuda = args.cuda
         self.debug = args.debug
 
-        # self.embeddings_chars = CharEmbedding(sizes, EMBED_DIM)
-        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], EMBED_DIM)
-        self.embeddings_tags = torch.nn.Embedding(sizes['postags'], EMBED_DIM)
-        self.embeddings_langs = torch.nn.Embedding(sizes['langs'], EMBED_DIM)
-        self.lstm = torch.nn.LSTM(2 * EMBED_DIM, LSTM_DIM, LSTM_LAYERS,
+        # self.embeddings_chars = CharEmbedding(sizes, embed_dim)
+        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], embed_dim)
+        self.embeddings_tags = torch.nn.Embedding(sizes['postags'], embed_dim)
+        self.embeddings_langs = torch.nn.Embedding(sizes['langs'], embed_dim)
+        self.lstm = torch.nn.LSTM(2 * embed_dim, lstm_dim, lstm_layers,
                                   batch_first=True, bidirectional=True, dropout=0.33)
-        self.mlp_head = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_ARC)
-        self.mlp_dep = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_ARC)
-        self.mlp_deprel_head = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_LABEL)
-        self.mlp_deprel_dep = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_LABEL)
+        self.mlp_head = torch.nn.Linear(2 * lstm_dim, reduce_dim_arc)
+        self.mlp_dep = torch.nn.Linear(2 * lstm_dim, reduce_dim_arc)
+        self.mlp_deprel_head = torch.nn.Linear(2 * lstm_dim, reduce_dim_label)
+        self.mlp_deprel_dep = torch.nn.Linear(2 * lstm_dim, reduce_dim_label)
         self.relu = torch.nn.ReLU()
         self.dropout = torch.nn.Dropout(p=0.33)
-        # self.biaffine = Biaffine(REDUCE_DIM_ARC + 1, REDUCE_DIM_ARC, BATCH_SIZE)
-        self.biaffine = ShorterBiaffine(REDUCE_DIM_ARC)
-        self.label_biaffine = LongerBiaffine(REDUCE_DIM_LABEL, REDUCE_DIM_LABEL, sizes['deprels'])
+        # self.biaffine = Biaffine(reduce_dim_arc + 1, reduce_dim_arc, batch_size)
+        self.biaffine = ShorterBiaffine(reduce_dim_arc)
+        self.label_biaffine = LongerBiaffine(reduce_dim_label, reduce_dim_label, sizes['deprels'])
         self.criterion = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimiser = torch.optim.Adam(self.parameters(), lr=LEARNING_RATE, betas=(0.9, 0.9))
+        self.optimiser = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
 
         # langid stuffs
-        self.langid_mlp = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_ARC)
-        self.langid_out = torch.nn.Linear(REDUCE_DIM_ARC, sizes['langs'])
+        self.langid_mlp = torch.nn.Linear(2 * lstm_dim, reduce_dim_arc)
+        self.langid_out = torch.nn.Linear(reduce_dim_arc, sizes['langs'])
+
+        # token-level heads trained off the same encoder pass as the parser (see Modules.AuxHeads);
+        # the langid loss is subtracted, as it always was
+        self.aux_heads = {'langid': ('misc', -1.0)}
 
         if self.use_cuda:
             self.biaffine.cuda()
             self.label_biaffine.cuda()
 
-    def langid_fwd(self, forms, tags, pack):
-        form_embeds = self.dropout(self.embeddings_forms(forms))
-        tag_embeds = self.dropout(self.embeddings_tags(tags))
-
-        embeds = torch.cat([form_embeds, tag_embeds], dim=2)
-        embeds = torch.nn.utils.rnn.pack_padded_sequence(embeds, pack.tolist(), batch_first=True)
-        lstm_out, _ = self.lstm(embeds)
-        lstm_out, _ = torch.nn.utils.rnn.pad_packed_sequence(lstm_out, batch_first=True)
-
-        mlp_out = self.dropout(self.relu(self.langid_mlp(lstm_out)))
-        return self.langid_out(mlp_out)
-
-    def forward(self, forms, tags, pack):
+    def encode(self, forms, tags, pack):
         # embed and dropout forms and tags; concat
         # TODO: same mask embedding
         # char_embeds = self.embeddings_chars(chars, pack)
@@ -86,6 +57,18 @@ class CSParser(torch.nn.Module):
         embeds = torch.nn.utils.rnn.pack_padded_sequence(embeds, pack.tolist(), batch_first=True)
         output, _ = self.lstm(embeds)
         output, _ = torch.nn.utils.rnn.pad_packed_sequence(output, batch_first=True)
+        return output
+
+    def langid_head(self, output):
+        mlp_out = self.dropout(self.relu(self.langid_mlp(output)))
+        return self.langid_out(mlp_out)
+
+    def langid_fwd(self, forms, tags, pack):
+        return self.langid_head(self.encode(forms, tags, pack))
+
+    def forward(self, forms, tags, pack, aux=False):
+        # aux: also return {name: logits} of the aux heads, computed off the same encoder output
+        output = self.encode(forms, tags, pack)
 
         # predict heads
         reduced_head_head = self.dropout(self.relu(self.mlp_head(output)))
@@ -93,19 +76,21 @@ class CSParser(torch.nn.Module):
         y_pred_head = self.biaffine(reduced_head_head, reduced_head_dep)
 
         if self.debug:
-            return y_pred_head, Variable(torch.rand(y_pred_head.size()))
-
-        # predict deprels using heads
-        reduced_deprel_head = self.dropout(self.relu(self.mlp_deprel_head(output)))
-        reduced_deprel_dep = self.dropout(self.relu(self.mlp_deprel_dep(output)))
-        predicted_labels = y_pred_head.max(2)[1]
-        selected_heads = torch.stack([torch.index_select(reduced_deprel_head[n], 0, predicted_labels[n])
-                                      for n, _ in enumerate(predicted_labels)])
-        y_pred_label = self.label_biaffine(selected_heads, reduced_deprel_dep)
-        y_pred_label = Helpers.extract_best_label_logits(predicted_labels, y_pred_label, pack)
-        if self.use_cuda:
-            y_pred_label = y_pred_label.cuda()
+            y_pred_label = Variable(torch.rand(y_pred_head.size()))
+        else:
+            # predict deprels using heads
+            reduced_deprel_head = self.dropout(self.relu(self.mlp_deprel_head(output)))
+            reduced_deprel_dep = self.dropout(self.relu(self.mlp_deprel_dep(output)))
+            predicted_labels = y_pred_head.max(2)[1]
+            selected_heads = torch.stack([torch.index_select(reduced_deprel_head[n], 0, predicted_labels[n])
+                                          for n, _ in enumerate(predicted_labels)])
+            y_pred_label = self.label_biaffine(selected_heads, reduced_deprel_dep)
+            y_pred_label = Helpers.extract_best_label_logits(predicted_labels, y_pred_label, pack)
+            if self.use_cuda:
+                y_pred_label = y_pred_label.cuda()
 
+        if aux:
+            return y_pred_head, y_pred_label, self.aux_outputs(output)
         return y_pred_head, y_pred_label
 
     def train_(self, epoch, train_loader):
@@ -113,15 +98,10 @@ class CSParser(torch.nn.Module):
         train_loader.init_epoch()
 
         for i, batch in enumerate(train_loader):
-            (x_forms, pack), x_tags, y_heads, y_deprels, y_langs = \
-                batch.form, batch.upos, batch.head, batch.deprel, batch.misc
-
-            mask = torch.zeros(pack.size()[0], max(pack)).type(torch.LongTensor)
-            for n, size in enumerate(pack):
-                mask[n, 0:size] = 1
+            (x_forms, pack), x_tags, y_heads, y_deprels = batch.form, batch.upos, batch.head, batch.deprel
 
-            y_pred_head, y_pred_deprel = self(x_forms, x_tags, pack)
-            y_pred_langs = self.langid_fwd(x_forms, x_tags, pack)
+            # one encoder pass for the parser and the aux heads
+            y_pred_head, y_pred_deprel, y_pred_aux = self(x_forms, x_tags, pack, aux=True)
 
             # reshape for cross-entropy
             batch_size, longest_sentence_in_batch = y_heads.size()
@@ -135,21 +115,19 @@ class CSParser(torch.nn.Module):
             # heads: (B x S) => (B * S)
             y_pred_deprel = y_pred_deprel.view(batch_size * longest_sentence_in_batch, -1)
             y_deprels = y_deprels.contiguous().view(batch_size * longest_sentence_in_batch)
-            
-            # langid
-            y_pred_langs = y_pred_langs.view(batch_size * longest_sentence_in_batch, -1)
-            y_langs = y_langs.contiguous().view(batch_size * longest_sentence_in_batch)
 
             train_loss = self.criterion(y_pred_head, y_heads)
             if not self.debug:
                 train_loss += self.criterion(y_pred_deprel, y_deprels)
-                train_loss -= self.criterion(y_pred_langs, y_langs)
+                train_loss += self.aux_loss(y_pred_aux, self.aux_gold(batch))
 
             self.zero_grad()
             train_loss.backward()
             self.optimiser.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
+            self.metrics.log(epoch, train_loss, pack.tolist())
+
+        self.metrics.end_epoch(epoch)
 
     def evaluate_(self, test_loader):
         las_correct, uas_correct, total = 0, 0, 0
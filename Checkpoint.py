@@ -0,0 +1,101 @@
+import os
+import random
+import torch
+import numpy as np
+
+
+class Tracker:
+    '''
+    keeps the best dev score seen so far and counts epochs without improvement
+    patience = 0 never stops early
+    '''
+    def __init__(self, patience=0):
+        self.patience = patience
+        self.best = None
+        self.best_epoch = -1
+        self.bad_epochs = 0
+
+    def update(self, epoch, score):
+        if self.best is None or score > self.best:
+            self.best, self.best_epoch, self.bad_epochs = score, epoch, 0
+            return True
+
+        self.bad_epochs += 1
+        return False
+
+    def should_stop(self):
+        return self.patience > 0 and self.bad_epochs >= self.patience
+
+    def state_dict(self):
+        return {'best': self.best, 'best_epoch': self.best_epoch, 'bad_epochs': self.bad_epochs}
+
+    def load_state_dict(self, state):
+        self.best, self.best_epoch, self.bad_epochs = state['best'], state['best_epoch'], state['bad_epochs']
+
+
+def optimiser_of(runnable):
+    # the taggers call it optimizer, the parsers optimiser
+    if hasattr(runnable, 'optimiser'):
+        return runnable.optimiser
+    return runnable.optimizer
+
+
+def snapshot(runnable):
+    return {k: v.cpu().clone() for k, v in runnable.state_dict().items()}
+
+
+def _write(path, state):
+    # write then rename, so a crash mid-save never leaves a truncated checkpoint behind
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with open(path + '.tmp', "wb") as f:
+        torch.save(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def save_model(path, state_dict):
+    _write(path, state_dict)
+
+
+def save(path, runnable, epoch, train_loader, tracker):
+    state = {
+        'epoch': epoch,
+        'model': runnable.state_dict(),
+        'optimiser': optimiser_of(runnable).state_dict(),
+        'tracker': tracker.state_dict(),
+        # the shuffler state at the end of the epoch decides the order of the next one
+        'iterator': train_loader.random_shuffler.random_state,
+        'rng': {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()},
+    }
+    if torch.cuda.is_available():
+        state['rng']['cuda'] = torch.cuda.get_rng_state()
+
+    _write(path, state)
+
+
+def load(path, runnable, train_loader, tracker):
+    '''
+    restore everything written by save; returns the epoch to carry on from
+    '''
+    with open(path, "rb") as f:
+        state = torch.load(f, map_location=lambda storage, loc: storage)
+
+    runnable.load_state_dict(state['model'])
+    optimiser_of(runnable).load_state_dict(state['optimiser'])
+    tracker.load_state_dict(state['tracker'])
+    train_loader.random_shuffler.random_state = state['iterator']
+
+    random.setstate(state['rng']['python'])
+    np.random.set_state(state['rng']['numpy'])
+    torch.set_rng_state(state['rng']['torch'])
+    if 'cuda' in state['rng'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state['rng']['cuda'])
+
+    return state['epoch'] + 1
+
+
+def load_model(path):
+    with open(path, "rb") as f:
+        return torch.load(f, map_location=lambda storage, loc: storage)
@@ -0,0 +1,90 @@
+'''
+config.ini sections as keyword arguments for the model constructors; nothing here is read at import time, so the
+models can be built in pool workers or servers from whatever config object they are handed
+    config = Config.read('./config.ini')
+    parser = Parser(sizes, args, vocab, embeddings=vocab, **Config.parser_params(config['parser']),
+                    **Config.embed_params(config))
+'''
+import configparser
+
+
+def read(path):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def runtime(config):
+    # bfloat16 autocast for the forward passes, and training steps per metrics line
+    bf16 = config.getboolean('runtime', 'BF16', fallback=False)
+    log_interval = int(config['runtime'].get('LOG_INTERVAL', 50)) if config.has_section('runtime') else 50
+    return bf16, log_interval
+
+
+def tagger_params(section):
+    return dict(embed_dim=int(section['EMBED_DIM']), lstm_dim=int(section['LSTM_DIM']),
+                lstm_layers=int(section['LSTM_LAYERS']), mlp_dim=int(section['MLP_DIM']),
+                learning_rate=float(section['LEARNING_RATE']))
+
+
+def parser_params(section):
+    return dict(embed_dim=int(section['EMBED_DIM']), lstm_dim=int(section['LSTM_DIM']),
+                lstm_layers=int(section['LSTM_LAYERS']), reduce_dim_arc=int(section['REDUCE_DIM_ARC']),
+                reduce_dim_label=int(section['REDUCE_DIM_LABEL']), learning_rate=float(section['LEARNING_RATE']))
+
+
+def segmenter_params(config):
+    if not config.has_section('segmenter'):
+        return {}
+    section = config['segmenter']
+    return dict(embed_dim=int(section.get('EMBED_DIM', 100)), lstm_dim=int(section.get('LSTM_DIM', 100)),
+                lstm_layers=int(section.get('LSTM_LAYERS', 2)), learning_rate=float(section.get('LEARNING_RATE', 1e-3)))
+
+
+def embed_params(config):
+    if not config.has_section('embeddings'):
+        return {}
+    section = config['embeddings']
+    return dict(hash_buckets=int(section.get('HASH_BUCKETS', 0)), hash_functions=int(section.get('HASH_FUNCTIONS', 2)),
+                embed_mode=section.get('MODE', 'train'))
+
+
+def vocab_params(config):
+    # keyword arguments of Loader.get_iterators
+    if not config.has_section('embeddings'):
+        return {}
+    section = config['embeddings']
+    return dict(max_vocab=int(section.get('MAX_VOCAB', 0)) or None, min_freq=int(section.get('MIN_FREQ', 1)),
+                max_extra=int(section.get('MAX_EXTRA', 0)) or None)
+
+
+def multitask_params(config):
+    # keyword arguments of Scheduler for the main/aux tagging tasks
+    if not config.has_section('multitask'):
+        return {}
+    section = config['multitask']
+    return dict(temperature=float(section.get('TEMPERATURE', 1.0)),
+                weights={'main': float(section.get('WEIGHT_MAIN', 1.0)), 'aux': float(section.get('WEIGHT_AUX', 1.0))},
+                combined=config.getboolean('multitask', 'COMBINED_STEP', fallback=False))
+
+
+def multiling_params(config):
+    # keyword arguments of Loader.multi_iterators; PROPORTIONS reads English:2,Dutch:1,...
+    if not config.has_section('multiling'):
+        return {}
+    section = config['multiling']
+    params = dict(temperature=float(section.get('TEMPERATURE', 1.0)))
+    if section.get('PROPORTIONS', ''):
+        params['proportions'] = {lang.strip(): float(share) for lang, share in
+                                 (pair.split(':') for pair in section['PROPORTIONS'].split(','))}
+    return params
+
+
+def augment_params(config):
+    # keyword arguments of Augment.CodeSwitch.from_file, path first; None when there is no seed dictionary
+    if not config.has_section('augment') or not config['augment'].get('SEEDS'):
+        return None
+    section = config['augment']
+    languages = section.get('LANGUAGES', '')
+    return dict(path=section['SEEDS'], p=float(section.get('P', 0.5)),
+                languages=tuple(languages.split(',')) if languages else None, seed=int(section.get('SEED', 1337)))
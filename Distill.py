@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import pickle
+import argparse
+import numpy as np
+import torch
+from torch.autograd import Variable
+import Loader
+import Benchmark
+import Trainer
+import Checkpoint
+import Telemetry
+import Pretrained
+import Config
+import Helpers
+from Config import parser_params, embed_params
+from Runnables import Parser, TagAndParse
+
+
+def teacher_pass(teacher, forms, tags, pack, chars, char_pack):
+    # arc and label logits without building a graph: no_grad, or on torch 0.3 a volatile input, which is enough
+    # to make the whole pass volatile
+    with Helpers.no_grad():
+        if not hasattr(torch, 'no_grad'):
+            forms = Variable(forms.data, volatile=True)
+        return teacher(forms, tags, pack, chars, char_pack)[:2]
+
+
+class TeacherTargets:
+    '''
+    soft targets computed on the fly: one teacher forward (eval mode, so no dropout) per student micro-batch
+    '''
+    def __init__(self, teacher):
+        self.teacher = teacher
+        teacher.eval()
+
+    def __call__(self, forms, tags, pack, chars, char_pack):
+        y_pred_head, y_pred_deprel = teacher_pass(self.teacher, forms, tags, pack, chars, char_pack)
+        # fresh leaves: nothing flows back into the teacher
+        return Variable(y_pred_head.data.float()), Variable(y_pred_deprel.data.float())
+
+
+class CachedTargets:
+    '''
+    the teacher's arc and label logits for every training sentence, computed once and pickled as float16
+    keyed by the sentence's form and tag ids, so lookups don't care about shuffling or micro-batch boundaries
+    '''
+    def __init__(self, path, cuda=False):
+        with open(path, "rb") as f:
+            self.targets = pickle.load(f)
+        self.cuda = cuda
+        self.labels = next(iter(self.targets.values()))[1].shape[1]
+
+    @staticmethod
+    def key(forms, tags, length):
+        return tuple(forms[:length]), tuple(tags[:length])
+
+    @classmethod
+    def precompute(cls, teacher, loader, path):
+        teacher.eval()
+        targets = {}
+        loader.init_epoch()
+        for batch in loader:
+            chars, char_pack = None, None
+            (x_forms, pack), x_tags = batch.form, batch.upos
+            if teacher.use_chars:
+                (chars, _, char_pack) = batch.char
+
+            y_pred_head, y_pred_deprel = teacher_pass(teacher, x_forms, x_tags, pack, chars, char_pack)
+            heads, deprels = y_pred_head.data.float().cpu().numpy(), y_pred_deprel.data.float().cpu().numpy()
+            for n, length in enumerate(pack.tolist()):
+                key = cls.key(x_forms.data[n].tolist(), x_tags.data[n].tolist(), length)
+                targets[key] = (heads[n, :length, :length].astype(np.float16),
+                                deprels[n, :length].astype(np.float16))
+
+        with open(path, "wb") as f:
+            pickle.dump(targets, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __call__(self, forms, tags, pack, chars, char_pack):
+        batch_size, longest = forms.size()
+        # padding columns get no probability mass, padding rows are masked out of the loss
+        heads = torch.zeros(batch_size, longest, longest).fill_(-1e4)
+        deprels = torch.zeros(batch_size, longest, self.labels)
+        for n, length in enumerate(pack.tolist()):
+            key = self.key(forms.data[n].tolist(), tags.data[n].tolist(), length)
+            if key not in self.targets:
+                raise KeyError("sentence {} is not in the teacher cache; was it built from another train set?".format(n))
+            head, deprel = self.targets[key]
+            heads[n, :length, :length] = torch.from_numpy(head.astype(np.float32))
+            deprels[n, :length] = torch.from_numpy(deprel.astype(np.float32))
+
+        if self.cuda:
+            heads, deprels = heads.cuda(), deprels.cuda()
+        return Variable(heads), Variable(deprels)
+
+
+def attach(student, targets, temperature=2.0, alpha=0.5):
+    '''
+    train student against targets: alpha * gold loss + (1 - alpha) * T^2 * KL to the teacher's distributions
+    '''
+    student.teacher = targets
+    student.temperature, student.alpha = temperature, alpha
+
+
+def detach(student):
+    student.teacher = None
+    student.temperature, student.alpha = 1.0, 1.0
+
+
+def report(teacher, student, loader):
+    results = {'teacher': Benchmark.measure(teacher, loader), 'student': Benchmark.measure(student, loader)}
+    results['speedup'] = results['student']['tokens_per_sec'] / results['teacher']['tokens_per_sec']
+    results['las_delta'] = results['student']['las'] - results['teacher']['las']
+    results['uas_delta'] = results['student']['uas'] - results['teacher']['uas']
+    results['compression'] = results['teacher']['parameters'] / results['student']['parameters']
+    return results
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--teacher', required=True, help="state dict of a trained parser")
+    arg_parser.add_argument('--teacher_model', choices=['parser', 'tagandparse'], default='parser')
+    arg_parser.add_argument('--config', default='./config.ini')
+    arg_parser.add_argument('--train', action='store')
+    arg_parser.add_argument('--dev', action='store')
+    arg_parser.add_argument('--test', action='store')
+    arg_parser.add_argument('--embed', action='store')
+    arg_parser.add_argument('--use_chars', action='store_true')
+    arg_parser.add_argument('--use_cuda', action='store_true')
+    # precompute the teacher's outputs into this file (or reuse it); without it they are computed on the fly
+    arg_parser.add_argument('--cache', action='store')
+    arg_parser.add_argument('--save', action='store', help="checkpoint directory for the student")
+    arg_parser.add_argument('--workers', type=int, default=1)
+    arg_parser.add_argument('--metrics', action='store')
+    arg_parser.add_argument('--out', action='store', help="student vs teacher report, JSON")
+    args = arg_parser.parse_args()
+
+    config = Config.read(args.config)
+    student_config = config['student']
+
+    # the runnables read these off args
+    args.semtag = False
+    checkpoint, args.save = args.save, None
+
+    # the teacher's vocab caps, or its embedding rows won't line up
+    (train_loader, dev_loader, test_loader), sizes, vocab = Loader.get_iterators(
+        args, int(config['parser']['BATCH_SIZE']), **Config.vocab_params(config))
+
+    teacher_class = TagAndParse if args.teacher_model == 'tagandparse' else Parser
+    teacher = teacher_class(sizes, args, vocab, embeddings=vocab[0], **parser_params(config['parser']),
+                            **embed_params(config))
+    with open(args.teacher, "rb") as f:
+        state_dict = torch.load(f, map_location=lambda storage, loc: storage)
+    teacher.load_state_dict(Pretrained.fit_state_dict(teacher, state_dict, vocab[0]))
+    if args.use_cuda:
+        teacher.cuda()
+
+    student = Parser(sizes, args, vocab, embeddings=vocab[0], **parser_params(student_config), **embed_params(config))
+    if args.use_cuda:
+        student.cuda()
+    student.metrics = Telemetry.MetricsLogger(args.metrics, Config.runtime(config)[1], name='student')
+
+    if args.cache:
+        if not os.path.exists(args.cache):
+            print("Caching teacher outputs in {}".format(args.cache))
+            CachedTargets.precompute(teacher, train_loader, args.cache)
+        targets = CachedTargets(args.cache, cuda=args.use_cuda)
+    else:
+        targets = TeacherTargets(teacher)
+
+    attach(student, targets, float(student_config.get('TEMPERATURE', 2.0)), float(student_config.get('ALPHA', 0.5)))
+    print("Distilling")
+    Trainer.fit(student, train_loader, dev_loader, int(student_config['EPOCHS']), workers=args.workers,
+                checkpoint=checkpoint, patience=int(student_config.get('PATIENCE', 0)))
+    detach(student)
+
+    if checkpoint:
+        Checkpoint.save_model(os.path.join(checkpoint, 'student.pt'), Checkpoint.snapshot(student))
+
+    results = {'teacher_model': args.teacher_model, 'student': dict(student_config),
+               'results': report(teacher, student, test_loader)}
+    out = open(args.out, "w") if args.out else sys.stdout
+    json.dump(results, out, indent=2)
+    out.write("\n")
@@ -0,0 +1,125 @@
+import os
+import copy
+import socket
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+# set by init_process; a plain run is a world of one
+_rank, _world_size = 0, 1
+
+
+def rank():
+    return _rank
+
+
+def world_size():
+    return _world_size
+
+
+def is_master():
+    return _rank == 0
+
+
+def init_process(rank, world_size, backend='gloo'):
+    global _rank, _world_size
+    dist.init_process_group(backend, init_method='env://', rank=rank, world_size=world_size)
+    _rank, _world_size = rank, world_size
+
+    # split the cores between workers, otherwise every process spins up a full set of intra-op threads
+    torch.set_num_threads(max(1, os.cpu_count() // world_size))
+
+
+def launch(fn, world_size, *args):
+    '''
+    fork world_size workers running fn(*args) and return whatever rank 0 returns
+    fork (not spawn) so the workers inherit the iterators and the model that are already built
+    '''
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(_free_port()))
+
+    results = mp.SimpleQueue()
+    workers = []
+    for rank in range(world_size):
+        worker = mp.Process(target=_worker, args=(rank, world_size, results, fn, args))
+        worker.start()
+        workers.append(worker)
+
+    # read before joining: rank 0 blocks until its result has been picked up
+    result = results.get()
+    for worker in workers:
+        worker.join()
+
+    failed = [n for n, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError("distributed workers {} failed".format(failed))
+
+    return result
+
+
+def _worker(rank, world_size, results, fn, args):
+    init_process(rank, world_size)
+    result = fn(*args)
+    if is_master():
+        results.put(result)
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+
+
+def shard(iterator, rank, world_size):
+    # here rather than at the top, so importing the runnables doesn't pull in torchtext
+    from torchtext import data
+
+    # every worker gets a disjoint slice of the same size, so they all run the same number of steps;
+    # uneven shards would leave the bigger ones waiting forever in all_reduce
+    examples = iterator.dataset.examples
+    per_worker = len(examples) // world_size
+    dataset = data.Dataset(examples[rank::world_size][:per_worker], list(iterator.dataset.fields.items()))
+
+    kwargs = dict(batch_size=iterator.batch_size, sort_key=iterator.sort_key, train=True,
+                  sort_within_batch=iterator.sort_within_batch, device=iterator.device, repeat=False)
+    # keep an Augment.AugmentingIterator augmenting, with a draw of its own per worker
+    if hasattr(iterator, 'augment'):
+        augment = copy.copy(iterator.augment)
+        augment.seed = "{}:{}".format(augment.seed, rank)
+        sharded = type(iterator)(dataset, augment, **kwargs)
+    else:
+        sharded = data.Iterator(dataset, **kwargs)
+
+    # every shard shuffles from the unsharded loader's state, which is the one a resume restores. The shards are
+    # the same size, so they all move the state on alike and rank 0's, the one Checkpoint.save sees, stands for all
+    sharded.random_shuffler.random_state = iterator.random_shuffler.random_state
+    return sharded
+
+
+def broadcast_parameters(module):
+    for param in module.parameters():
+        dist.broadcast(param.data, 0)
+
+
+def average_gradients(module):
+    if _world_size == 1:
+        return
+
+    # one all_reduce over a flat buffer instead of one per parameter
+    grads = [param.grad.data for param in module.parameters() if param.grad is not None]
+    flat = _flatten_dense_tensors(grads)
+    dist.all_reduce(flat)
+    flat /= _world_size
+    for grad, synced in zip(grads, _unflatten_dense_tensors(flat, grads)):
+        grad.copy_(synced)
+
+
+def agree(flag):
+    # every rank follows rank 0's decision, it is the only one that sees dev scores
+    if _world_size == 1:
+        return flag
+
+    decision = torch.LongTensor([int(flag)])
+    dist.broadcast(decision, 0)
+    return bool(decision[0])
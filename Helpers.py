@@ -1,4 +1,6 @@
 import os
+import functools
+import contextlib
 import torch
 import torch.utils.data
 import torch.nn.functional as F
@@ -124,6 +126,187 @@ def process_batch(batch, cuda=False):
     return output
 
 
+BF16_UNSUPPORTED = "BF16 needs torch.autocast, which torch {} doesn't have; set BF16 = no in [runtime]"
+
+
+def autocast(enabled):
+    '''
+    bfloat16 autocast on cpu; a no-op when disabled. Enabled on a torch without torch.autocast (0.3) is an error,
+    not a quiet fp32 run
+    '''
+    if not enabled:
+        return contextlib.ExitStack()
+    if not hasattr(torch, 'autocast'):
+        raise RuntimeError(BF16_UNSUPPORTED.format(torch.__version__))
+    return torch.autocast('cpu', dtype=torch.bfloat16)
+
+
+def no_grad():
+    '''
+    autograd off; torch 0.3 has no torch.no_grad, but there the train=False loaders already yield volatile
+    Variables, which keeps everything computed from them out of the graph just the same
+    '''
+    if hasattr(torch, 'no_grad'):
+        return torch.no_grad()
+    return contextlib.ExitStack()
+
+
+def inference(method):
+    '''
+    decorator for the evaluate_/predict_ methods of the runnables: eval mode, no autograd
+    '''
+    @functools.wraps(method)
+    def wrapper(module, *args, **kwargs):
+        module.eval()
+        with no_grad():
+            return method(module, *args, **kwargs)
+    return wrapper
+
+
+def micro_batches(pack, token_budget):
+    '''
+    split a batch sorted longest-first into row ranges whose padded size (rows * longest row) fits token_budget
+    token_budget = 0 keeps the batch whole
+    '''
+    lengths = pack.tolist()
+    if not token_budget:
+        yield 0, len(lengths)
+        return
+
+    start = 0
+    while start < len(lengths):
+        end = min(len(lengths), start + max(1, token_budget // lengths[start]))
+        yield start, end
+        start = end
+
+
+def slice_batch(tensors, start, end, longest):
+    # rows start:end, minus the columns that are padding for all of them
+    return [None if t is None else t[start:end, :longest].contiguous() for t in tensors]
+
+
+def scale_gradients(module, factor):
+    for param in module.parameters():
+        if param.grad is not None:
+            param.grad.data.mul_(factor)
+
+
+class Optimisers:
+    '''
+    several optimisers stepped as one, for modules that mix dense parameters with sparse embeddings
+    '''
+    def __init__(self, *optimisers):
+        self.optimisers = optimisers
+
+    @property
+    def param_groups(self):
+        return [group for optimiser in self.optimisers for group in optimiser.param_groups]
+
+    def step(self):
+        for optimiser in self.optimisers:
+            optimiser.step()
+
+    def zero_grad(self):
+        for optimiser in self.optimisers:
+            optimiser.zero_grad()
+
+    def state_dict(self):
+        return {'optimisers': [optimiser.state_dict() for optimiser in self.optimisers]}
+
+    def load_state_dict(self, state_dict):
+        for optimiser, state in zip(self.optimisers, state_dict['optimisers']):
+            optimiser.load_state_dict(state)
+
+
+def optimiser_for(module, learning_rate, betas=(0.9, 0.9)):
+    '''
+    Adam over the trainable parameters; the weights of sparse Embeddings go to SparseAdam instead,
+    which only touches the rows that got a gradient. Frozen parameters get no optimiser state at all.
+    '''
+    sparse = {id(m.weight) for m in module.modules() if isinstance(m, torch.nn.Embedding) and m.sparse}
+    params = [param for param in module.parameters() if param.requires_grad]
+
+    dense = torch.optim.Adam([p for p in params if id(p) not in sparse], lr=learning_rate, betas=betas)
+    if not sparse:
+        return dense
+    return Optimisers(dense, torch.optim.SparseAdam([p for p in params if id(p) in sparse], lr=learning_rate,
+                                                    betas=betas))
+
+
+def length_mask(pack, longest, cuda=False):
+    # B x longest, 1 for the tokens (root included), 0 for padding
+    mask = torch.zeros(len(pack), longest)
+    for n, length in enumerate(pack.tolist()):
+        mask[n, :length] = 1
+    return Variable(mask.cuda() if cuda else mask)
+
+
+class MaskBuffers:
+    '''
+    B x S byte masks, 1 over the first length positions of each row, for the evaluate_ loops: one buffer per
+    (B, S, device), refilled in place from a single comparison against a shared arange rather than row by row.
+    A mask is only good until the next call with the same shape
+    '''
+    def __init__(self):
+        self.buffers = {}
+        self.positions = torch.arange(0, 256).long()
+
+    def __call__(self, pack, cuda=False):
+        lengths = (pack.data if isinstance(pack, Variable) else pack).cpu().long().view(-1, 1)
+        rows, longest = lengths.size(0), int(lengths.max())
+        if self.positions.size(0) < longest:
+            self.positions = torch.arange(0, 2 * longest).long()
+
+        key = (rows, longest, cuda)
+        if key not in self.buffers:
+            mask = torch.ByteTensor(rows, longest)
+            self.buffers[key] = mask.cuda() if cuda else mask
+        mask = self.buffers[key]
+        mask.copy_(self.positions[:longest].view(1, -1).expand(rows, longest) < lengths.expand(rows, longest))
+        return Variable(mask)
+
+
+eval_mask = MaskBuffers()
+
+
+class Resident:
+    '''
+    a dev/test loader whose batches are built on the first pass and kept, so padding and numericalising happen
+    once rather than every epoch; only for train=False loaders, which yield the same batches in the same order
+    every time. Everything else (dataset, batch_size, ...) is the wrapped loader's
+    '''
+    def __init__(self, loader):
+        self.loader = loader
+        self.batches = None
+
+    def __iter__(self):
+        if self.batches is None:
+            self.batches = list(self.loader)
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+
+def distillation_loss(student_logits, teacher_logits, mask, temperature=1.0):
+    '''
+    KL(teacher || student) between the temperature-softened distributions over the last dim, averaged over the
+    unmasked tokens and scaled by T^2 so its gradients stay comparable to the hard loss
+    '''
+    classes = student_logits.size(-1)
+    log_p = F.log_softmax(student_logits.contiguous().view(-1, classes) / temperature, dim=1)
+    log_q = F.log_softmax(teacher_logits.contiguous().view(-1, classes) / temperature, dim=1)
+    kl = (log_q.exp() * (log_q - log_p)).sum(1)
+    mask = mask.contiguous().view(-1)
+
+    return (kl * mask).sum() / mask.sum() * temperature ** 2
+
+
 def extract_best_label_logits(pred_arcs, label_logits, lengths):
     pred_arcs = pred_arcs.data
     size = label_logits.size()
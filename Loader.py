@@ -1,31 +1,44 @@
 import sys
 import os
+import glob
+import copy
 import codecs
 import numpy as np
 from torchtext import data, datasets, vocab
+import Augment
+import Pretrained
+from Scheduler import Scheduler
 import csv
 csv.field_size_limit(sys.maxsize)
 
 
 ROOT_LINE = "0\t__ROOT\t_\t__ROOT\t_\t_\t0\t__ROOT\t_\t_"
+# what get_iterators and seg_iterators return, in order
+SPLITS = ('train', 'dev', 'test')
 
 
-def conll_to_seg_csv(args, fname, columns=10, train=True):
-    col_range = range(columns)
+def conll_to_seg_words(fname):
+    # every word of the file in order, with 1 on the last word of each sentence
     rows = []
     with codecs.open(fname, 'r', 'utf-8') as f:
-        for n, line in enumerate(f):
+        for line in f:
             if line[0] == '#':
                 continue
             elif not line.rstrip():
-                rows[-1][1] = 1
+                if rows:
+                    rows[-1][1] = '1'
             else:
-                cols = [i.replace('"', '<qt>').replace(',', '<cm>') for i in line.rstrip("\n").split("\t")]
+                cols = line.rstrip("\n").split("\t")
                 if '.' in cols[0] or '-' in cols[0]: continue
-                rows.append([cols[1], 0])
-                # rows.append('"{}",{}'.format(cols[1], 0))
-    rows = ['"{}","{}"'.format(word, num) for word, num in rows]
-    return "\n".join(rows)
+                rows.append([cols[1], '0'])
+    return rows
+
+
+def windows(rows, window):
+    # consecutive, non-overlapping windows of words: what the segmenter sees at a time
+    for start in range(0, len(rows), window):
+        chunk = rows[start:start + window]
+        yield [word for word, _ in chunk], [switch for _, switch in chunk]
 
 
 def conll_to_csv(args, fname, columns=10):
@@ -59,49 +72,76 @@ def dep_to_int(tensor, vocab, _):
     fn = np.vectorize(lambda x: int(vocab.itos[x]))
     return fn(tensor)
 
-# just load raw text, write tokenised conllu for next loader
-def seg_iterators(args, batch_size):
-    batch = []
+def seg_iterators(args, batch_size, window=50, splits=SPLITS):
+    '''
+    windows of running words labelled with sentence ends, for the Segmenter; built in memory, no .tmp files
+    splits as for get_iterators
+    '''
     device = -(not args.use_cuda)
 
+    # the columns arrive as lists already, so the fields don't tokenise
     WORD = data.Field(batch_first=True, init_token='<w>')
     SWITCH = data.Field(batch_first=True, init_token='0')
-
     field_tuples = [('word', WORD), ('switch', SWITCH)]
-    
-    train_csv = conll_to_seg_csv(args, args.train, len(field_tuples))
-    dev_csv = conll_to_seg_csv(args, args.dev, len(field_tuples))
-    test_csv = conll_to_seg_csv(args, args.test, len(field_tuples))
 
-    for file, text in zip(["train", "dev", "test"], [train_csv, dev_csv, test_csv]):
-        with open(os.path.join(".tmp", "{}.csv".format(file)), "w") as f:
-            f.write(text)
+    datasets = {split: data.Dataset([data.Example.fromlist(list(columns), field_tuples)
+                                     for columns in windows(conll_to_seg_words(getattr(args, split)), window)],
+                                    field_tuples)
+                for split in ['train'] + [split for split in splits if split != 'train']}
 
-    train, dev, test = data.TabularDataset.splits(path=".tmp", train='train.csv',
-                                                    validation='dev.csv', test='test.csv',
-                                                    format="csv", fields=field_tuples)
+    for field in [WORD, SWITCH]:
+        field.build_vocab(datasets['train'])
 
-    field_names = [i[1] for i in field_tuples]
-    for field in field_names:
-        field.build_vocab(train)
+    iterators = dict.fromkeys(SPLITS)
+    if 'train' in splits:
+        iterators['train'] = data.Iterator(datasets['train'], batch_size=batch_size, train=True,
+                                           sort_within_batch=False, device=device, repeat=False)
 
-    train_iterator = data.Iterator(train, batch_size=batch_size, train=True,
-                                    sort_within_batch=False, device=device, repeat=False)
+    # in file order, so boundaries can be read back as a stream
+    for split in ['dev', 'test']:
+        if split in splits:
+            iterators[split] = data.Iterator(datasets[split], batch_size=batch_size, train=False, sort=False,
+                                             device=device, repeat=False)
 
-    dev_iterator = data.Iterator(dev, batch_size=1, train=False, sort_within_batch=True, sort_key=lambda x: len(x.form),
-                                    sort=False, device=device, repeat=False)
+    current_iterator = [iterators[split] for split in SPLITS]
 
-    test_iterator = data.Iterator(test, batch_size=1, train=False, sort_within_batch=True, sort_key=lambda x: len(x.form),
-                                    sort=False, device=device, repeat=False)
+    sizes = {'vocab': len(WORD.vocab), 'states': len(SWITCH.vocab)}
 
-    current_iterator = [train_iterator, dev_iterator, test_iterator]
+    return (current_iterator, sizes, [WORD.vocab, SWITCH.vocab])
 
-    sizes = {'vocab': len(WORD.vocab), 'states': len(SWITCH.vocab)}
 
-    # if args.use_chars:
-    #     sizes['chars'] = len(CHAR.vocab)
+def sentence_to_example(rows, field_tuples):
+    '''
+    one sentence as CoNLL-U rows (lists of column values) => an Example for the fields get_iterators built,
+    going through the same escaping and column layout as conll_to_csv
+    '''
+    names = [name for name, _ in field_tuples]
+    rows = [[i.replace('"', '<qt>').replace(',', '<cm>') for i in cols] for cols in rows
+            if '.' not in cols[0] and '-' not in cols[0]]
+    columns = [",".join(column) for column in zip(*rows)]
+    if 'char' in names:
+        columns = columns[:2] + [columns[1]] + columns[2:]
+    columns += ["_" for _ in range(len(names) - len(columns))]
+
+    return data.Example.fromlist(columns, field_tuples)
+
+
+def sentences_to_iterator(sentences, fields, batch_size=1, device=-1):
+    '''
+    sentences (each a list of CoNLL-U rows) straight into an iterator over the fields of a training dataset
+    (train_loader.dataset.fields), so text that never touched disk can be tagged or parsed
+    packing wants every batch longest-first, so the sentences are sorted up front; iterator.order[i] is the input
+    position of the i-th sentence the iterator yields
+    '''
+    field_tuples = list(fields.items())
+    examples = [sentence_to_example(rows, field_tuples) for rows in sentences]
+    order = sorted(range(len(examples)), key=lambda n: -len(examples[n].form))
+    dataset = data.Dataset([examples[n] for n in order], field_tuples)
+    iterator = data.Iterator(dataset, batch_size=batch_size, train=False, sort=False, sort_within_batch=False,
+                             device=device, repeat=False)
+    iterator.order = order
+    return iterator
 
-    return (current_iterator, sizes, [WORD.vocab, SWITCH.vocab])
 
 '''
 1. declare all fields you could every possibly use - this includes CHAR and SEM
@@ -109,8 +149,8 @@ def seg_iterators(args, batch_size):
 3. the size of field_tuples = number of columns in the conllu file; pass it to conll_to_csv
 4. add the vocab to the vocab dict at the end if you are using them 
 '''
-def get_iterators(args, batch_size):
-    device = -(not args.use_cuda)
+def conllu_fields(args):
+    # (name, field) per column, in file order
     tokeniser = lambda x: x.split(',')
 
     ID = data.Field(tokenize=tokeniser, batch_first=True, init_token='0')
@@ -138,54 +178,180 @@ def get_iterators(args, batch_size):
     if args.semtag:
         field_tuples.append(('sem', SEM))
 
-    if not os.path.exists(".tmp"):
-        os.makedirs(".tmp")
-
-    # ===== breaking here
-    train_csv = conll_to_csv(args, args.train, len(field_tuples))
-    dev_csv = conll_to_csv(args, args.dev, len(field_tuples))
-    test_csv = conll_to_csv(args, args.test, len(field_tuples))
-
-    for file, text in zip(["train", "dev", "test"], [train_csv, dev_csv, test_csv]):
-        with open(os.path.join(".tmp", "{}.csv".format(file)), "w") as f:
-            f.write(text)
-
-    train, dev, test = data.TabularDataset.splits(path=".tmp", train='train.csv',
-                                                    validation='dev.csv', test='test.csv',
-                                                    format="csv", fields=field_tuples)
-
-    field_names = [i[1] for i in field_tuples]
-    for field in field_names:
-        if field == FORM and args.embed:
-            vecs = vocab.Vectors(name=args.embed)
-            field.build_vocab(train, vectors=vecs)
+    return field_tuples
+
+
+def build_vocabs(args, field_tuples, train, inference, max_vocab=None, min_freq=1, max_extra=None):
+    '''
+    train: one dataset or several, whose words make up the vocabs; inference: datasets for Pretrained's extras
+    returns sizes and the vocab list the runnables take
+    '''
+    fields = dict(field_tuples)
+    for name, field in field_tuples:
+        if name == 'form':
+            # only the rows of the embedding file that end up in the vocab are read
+            store = Pretrained.PretrainedStore(args.embed) if args.embed else None
+            Pretrained.build_vocab(field, 'form', train, inference, store, max_size=max_vocab, min_freq=min_freq,
+                                   max_extra=max_extra)
+        elif isinstance(train, (list, tuple)):
+            field.build_vocab(*train)
         else:
             field.build_vocab(train)
 
-    train_iterator = data.Iterator(train, batch_size=batch_size, sort_key=lambda x: len(x.form), train=True,
-                                    sort_within_batch=True, device=device, repeat=False)
+    sizes = {'vocab': len(fields['form'].vocab), 'postags': len(fields['upos'].vocab),
+             'deprels': len(fields['deprel'].vocab), 'feats': len(fields['feats'].vocab)}
 
-    dev_iterator = data.Iterator(dev, batch_size=1, train=False, sort_within_batch=True, sort_key=lambda x: len(x.form),
-                                    sort=False, device=device, repeat=False)
+    if args.use_chars:
+        sizes['chars'] = len(fields['char'].nesting_field.vocab)
 
-    test_iterator = data.Iterator(test, batch_size=1, train=False, sort_within_batch=True, sort_key=lambda x: len(x.form),
-                                    sort=False, device=device, repeat=False)
+    if args.semtag:
+        sizes['semtags'] = len(fields['sem'].vocab)
 
-    # current_iterator = data.Iterator.splits((train, dev, test), batch_sizes=(batch_size, 1, 1),
-    #                                         sort_key=lambda x: len(x.form), sort_within_batch=True,
-    #                                         device=device, repeat=False)
+    return sizes, [fields['form'].vocab, fields['deprel'].vocab, fields['upos'].vocab, fields['feats'].vocab]
 
-    current_iterator = [train_iterator, dev_iterator, test_iterator]
 
-    sizes = {'vocab': len(FORM.vocab), 'postags': len(UPOS.vocab), 'deprels': len(DEPREL.vocab), 'feats': len(FEATS.vocab)}
+def get_iterators(args, batch_size, max_vocab=None, min_freq=1, max_extra=None, augment=None, splits=SPLITS):
+    '''
+    augment: an Augment.CodeSwitch applied to the training batches as they are built
+    splits: the iterators to build, the others come back as None; train is read either way, for the vocabs
+    '''
+    device = -(not args.use_cuda)
+    field_tuples = conllu_fields(args)
 
-    if args.use_chars:
-        sizes['chars'] = len(CHAR.vocab)
+    if not os.path.exists(".tmp"):
+        os.makedirs(".tmp")
 
-    if args.semtag:
-        sizes['semtags'] = len(SEM.vocab)
+    datasets = {}
+    for split in ['train'] + [split for split in splits if split != 'train']:
+        path = os.path.join(".tmp", "{}.csv".format(split))
+        with open(path, "w") as f:
+            f.write(conll_to_csv(args, getattr(args, split), len(field_tuples)))
+        datasets[split] = data.TabularDataset(path, format="csv", fields=field_tuples)
+
+    train = datasets['train']
+    inference = [datasets[split] for split in ['dev', 'test'] if split in datasets]
+    iterators = dict.fromkeys(SPLITS)
+
+    if augment:
+        # the words and tags augmentation can bring in need vocab entries too
+        sizes, vocabs = build_vocabs(args, field_tuples, [train, augment.vocab_source(field_tuples)], inference,
+                                     max_vocab, min_freq, max_extra)
+        if 'train' in splits:
+            iterators['train'] = Augment.AugmentingIterator(train, augment, batch_size=batch_size,
+                                                            sort_key=lambda x: len(x.form), train=True,
+                                                            sort_within_batch=True, device=device, repeat=False)
+    else:
+        sizes, vocabs = build_vocabs(args, field_tuples, train, inference, max_vocab, min_freq, max_extra)
+        if 'train' in splits:
+            iterators['train'] = data.Iterator(train, batch_size=batch_size, sort_key=lambda x: len(x.form), train=True,
+                                               sort_within_batch=True, device=device, repeat=False)
+
+    for split in ['dev', 'test']:
+        if split in splits:
+            iterators[split] = data.Iterator(datasets[split], batch_size=1, train=False, sort_within_batch=True,
+                                             sort_key=lambda x: len(x.form), sort=False, device=device, repeat=False)
+
+    current_iterator = [iterators[split] for split in SPLITS]
+
+    return (current_iterator, sizes, vocabs)
+
+
+def task_iterators(args, files, batch_size, semtag=False, **vocab_params):
+    '''
+    one task's loaders as the standalone multi-task taggers (CLTagger.py, MTLTagger.py) take them:
+    {'train', 'dev', 'test', 'sizes', 'vocab'} over files = (train, dev, test)
+    vocab_params: the vocab caps of get_iterators (Config.vocab_params)
+    '''
+    task_args = copy.copy(args)
+    task_args.train, task_args.dev, task_args.test = files
+    task_args.semtag = semtag
+    (train, dev, test), sizes, vocabs = get_iterators(task_args, batch_size, **vocab_params)
+    return {'train': train, 'dev': dev, 'test': test, 'sizes': sizes, 'vocab': vocabs[0]}
+
+
+def read_conllu(fname):
+    # sentences as lists of rows (lists of column values); comments are dropped
+    sentence = []
+    with codecs.open(fname, 'r', 'utf-8') as f:
+        for line in f:
+            if line[0] == '#':
+                continue
+            if not line.rstrip():
+                if sentence:
+                    yield sentence
+                sentence = []
+                continue
+            sentence.append(line.rstrip("\n").split("\t"))
+    if sentence:
+        yield sentence
+
+
+def treebank_files(directory):
+    '''
+    a UD treebank directory (data/UD_English) => (language, train, dev, test); the language is the directory name
+    '''
+    files = []
+    for split in ['train', 'dev', 'test']:
+        found = sorted(glob.glob(os.path.join(directory, '*-ud-{}.conllu'.format(split))))
+        assert found, "no {} file in {}".format(split, directory)
+        files.append(found[0])
+    return (os.path.basename(os.path.normpath(directory)).replace('UD_', '', 1), *files)
+
+
+class MultiTreebank:
+    '''
+    one training loader over several treebanks: each batch comes from one treebank, drawn by a Scheduler
+    (proportional to the treebank sizes, tempered, or in set proportions), and batch.lang is its index in langs
+    '''
+    def __init__(self, loaders, langs, **schedule):
+        self.langs = langs
+        self.scheduler = Scheduler(loaders, **schedule)
+
+    def init_epoch(self):
+        self.scheduler.init_epoch()
+
+    def __len__(self):
+        return len(self.scheduler)
+
+    def __iter__(self):
+        for step in self.scheduler:
+            for lang, batch in step:
+                batch.lang = self.langs.index(lang)
+                yield batch
+
+
+def multi_iterators(args, directories, batch_size, temperature=1.0, proportions=None, max_vocab=None, min_freq=1,
+                    max_extra=None):
+    '''
+    several UD treebanks read into one set of fields, so there is one vocab per column over all of them
+    train is a MultiTreebank; dev and test hold every treebank's sentences, in treebank order
+    sizes['langs'] is the number of treebanks, train.langs their names
+    '''
+    device = -(not args.use_cuda)
+    field_tuples = conllu_fields(args)
+    treebanks = [treebank_files(directory) for directory in directories]
+    langs = [lang for lang, _, _, _ in treebanks]
+
+    splits = [[data.Dataset([sentence_to_example(rows, field_tuples) for rows in read_conllu(fname)], field_tuples)
+               for fname in files] for _, *files in treebanks]
+    trains = [train for train, _, _ in splits]
+    inference = [dataset for _, dev, test in splits for dataset in (dev, test)]
+    sizes, vocabs = build_vocabs(args, field_tuples, trains, inference, max_vocab, min_freq, max_extra)
+    sizes['langs'] = len(langs)
+
+    loaders = {lang: data.Iterator(train, batch_size=batch_size, sort_key=lambda x: len(x.form), train=True,
+                                   sort_within_batch=True, device=device, repeat=False)
+               for lang, train in zip(langs, trains)}
+    train_iterator = MultiTreebank(loaders, langs, temperature=temperature, proportions=proportions)
+
+    dev, test = [data.Dataset([example for split in splits for example in split[n].examples], field_tuples)
+                 for n in (1, 2)]
+    dev_iterator = data.Iterator(dev, batch_size=1, train=False, sort_within_batch=True, sort_key=lambda x: len(x.form),
+                                    sort=False, device=device, repeat=False)
+    test_iterator = data.Iterator(test, batch_size=1, train=False, sort_within_batch=True, sort_key=lambda x: len(x.form),
+                                    sort=False, device=device, repeat=False)
 
-    return (current_iterator, sizes, [FORM.vocab, DEPREL.vocab, UPOS.vocab, FEATS.vocab])
+    return ([train_iterator, dev_iterator, test_iterator], sizes, vocabs)
 
 
 ROOT_LINE_2 = "\t_\t_"
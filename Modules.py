@@ -1,4 +1,5 @@
 import math
+import hashlib
 import torch
 from torch.autograd import Variable
 import torch.nn.functional as F
@@ -142,19 +143,12 @@ class ShorterBiaffine(torch.nn.Module):
         self.weight.data.uniform_(-stdv, stdv)
 
     def forward(self, input1, input2):
-        is_cuda = next(self.parameters()).is_cuda
         batch_size, len1, dim1 = input1.size()
 
-        ones = torch.ones(batch_size, len1, 1)
-        if is_cuda:
-            ones = ones.cuda()
-        input1 = torch.cat((input1, Variable(ones)), dim=2)
-        dim1 += 1
-
-        input1 = input1.contiguous().view(batch_size * len1, dim1)
-        W = self.weight.transpose(1, 2).contiguous().view(dim1, dim1 - 1)
-        affine = (input1 @ W).view(batch_size, len1, dim1 - 1)
-        biaffine = (affine @ input2.transpose(1, 2)).view(batch_size, len1, 1, len1).transpose(2, 3).squeeze(3)
+        # the last row of the weight is the bias term of input1: added by addmm instead of a column of ones
+        weight = self.weight.squeeze(2)
+        affine = torch.addmm(weight[-1], input1.contiguous().view(batch_size * len1, dim1), weight[:-1])
+        biaffine = affine.view(batch_size, len1, dim1) @ input2.transpose(1, 2)
 
         return biaffine
 
@@ -175,20 +169,141 @@ class LongerBiaffine(torch.nn.Module):
         self.bias.data.uniform_(-stdv, stdv)
 
     def forward(self, input1, input2):
-        is_cuda = next(self.parameters()).is_cuda
         batch_size, len1, dim1 = input1.size()
         batch_size, len2, dim2 = input2.size()
-        ones = torch.ones(batch_size, len1, 1)
-        if is_cuda:
-            ones = ones.cuda()
-        input1 = torch.cat((input1, Variable(ones)), dim=2)
-        input2 = torch.cat((input2, Variable(ones)), dim=2)
-        dim1 += 1
-        dim2 += 1
-        input1 = input1.view(batch_size * len1, dim1)
-        weight = self.weight.transpose(1, 2).contiguous().view(dim1, self.dep_labels * dim2)
-        affine = (input1 @ weight).view(batch_size, len1 * self.dep_labels, dim2)
-        biaffine = (affine @ input2.transpose(1, 2)).view(batch_size, len1, self.dep_labels, len2).transpose(2, 3)
+
+        # labels x (dim2 + 1) blocks; the last row is the bias term of input1, the last column of every block
+        # the bias term of input2, so both come out of the matmuls rather than from concatenated ones
+        weight = self.weight.transpose(1, 2).contiguous().view(dim1 + 1, self.dep_labels * (dim2 + 1))
+        affine = torch.addmm(weight[-1], input1.contiguous().view(batch_size * len1, dim1), weight[:-1])
+        affine = affine.view(batch_size, len1 * self.dep_labels, dim2 + 1)
+        biaffine = torch.baddbmm(affine[:, :, -1:], affine[:, :, :-1], input2.transpose(1, 2))
+        biaffine = biaffine.view(batch_size, len1, self.dep_labels, len2).transpose(2, 3)
         biaffine += self.bias.expand_as(biaffine)
         return biaffine
 
+
+
+class AuxHeads:
+    '''
+    token-level heads trained off the encoder output a runnable's forward has already computed, not a second pass
+    a runnable sets self.aux_heads: name -> (batch field with the gold labels, loss weight) and defines
+    <name>_head(output), output being the encoder's B x S x H; its forward(..., aux=True) returns their logits too
+    '''
+    aux_heads = {}
+
+    def aux_outputs(self, output):
+        return {name: getattr(self, name + '_head')(output) for name in self.aux_heads}
+
+    def aux_gold(self, batch):
+        # in aux_heads order, so they can be sliced into micro-batches alongside the rest of the batch
+        return [getattr(batch, field) for field, _ in self.aux_heads.values()]
+
+    def aux_loss(self, outputs, golds):
+        loss = 0
+        for (name, (_, weight)), gold in zip(self.aux_heads.items(), golds):
+            # predictions: (B x S x L) => (B * S x L); loss stays in fp32
+            y_pred = outputs[name].float()
+            loss = loss + weight * self.criterion(y_pred.view(-1, y_pred.size(2)), gold.contiguous().view(-1))
+        return loss
+
+
+class HashEmbedding(torch.nn.Module):
+    '''
+    form embeddings with a fixed number of rows: every word is hashed into `buckets` rows by `num_hashes` functions
+    and the rows are summed, so the trainable table (and its optimiser state) does not grow with the vocab
+    pretrained: optional vocab x embed_dim vectors, kept frozen and added for the words that have them
+    '''
+    def __init__(self, itos, buckets, embed_dim, num_hashes=2, pretrained=None):
+        super().__init__()
+        assert 1 <= num_hashes <= 16, "one blake2b digest covers up to 16 hash functions"
+        self.buckets = buckets
+        self.num_hashes = num_hashes
+        self.embeddings = torch.nn.Embedding(buckets, embed_dim)
+        # hash the strings, not the ids, so the same word lands in the same rows whatever vocab it comes from
+        self.register_buffer('rows', torch.LongTensor([self.hash(word) for word in itos]))
+        if pretrained is not None:
+            self.register_buffer('pretrained', pretrained.clone())
+        else:
+            self.pretrained = None
+
+    def hash(self, word):
+        # independent 32-bit slices of one digest (crc32 with different seeds collides on the same words)
+        digest = hashlib.blake2b(word.encode('utf-8'), digest_size=4 * self.num_hashes).digest()
+        return [int.from_bytes(digest[4 * n:4 * n + 4], 'little') % self.buckets for n in range(self.num_hashes)]
+
+    def forward(self, forms):
+        flat = forms.contiguous().view(-1)
+        rows = Variable(self.rows).index_select(0, flat)
+        embeds = self.embeddings(rows).sum(1)
+        if self.pretrained is not None:
+            embeds = embeds + Variable(self.pretrained).index_select(0, flat)
+
+        return embeds.view(*forms.size(), -1)
+
+    def extend(self, words, vectors):
+        self.rows = torch.cat([self.rows, self.rows.new([self.hash(word) for word in words])])
+        if self.pretrained is not None:
+            self.pretrained = torch.cat([self.pretrained, vectors.type_as(self.pretrained)])
+
+
+class DeltaEmbedding(torch.nn.Module):
+    '''
+    frozen pretrained vectors plus a trainable correction that starts at zero
+    the correction is a sparse Embedding: only the rows a batch looks up get a gradient, and SparseAdam only
+    updates those, so the step costs what the batch touched rather than the vocab size
+    '''
+    def __init__(self, vectors):
+        super().__init__()
+        self.register_buffer('pretrained', vectors.clone())
+        self.delta = torch.nn.Embedding(vectors.size(0), vectors.size(1), sparse=True)
+        self.delta.weight.data.zero_()
+
+    def forward(self, forms):
+        flat = forms.contiguous().view(-1)
+        embeds = Variable(self.pretrained).index_select(0, flat) + self.delta(flat)
+        return embeds.view(*forms.size(), -1)
+
+    def extend(self, words, vectors):
+        self.pretrained = torch.cat([self.pretrained, vectors.type_as(self.pretrained)])
+        extend_embedding(self.delta, words, torch.zeros(*vectors.size()))
+
+
+EMBED_MODES = ['train', 'frozen', 'delta']
+
+
+def form_embedding(vocab, embed_dim, pretrained=False, hash_buckets=0, hash_functions=2, mode='train'):
+    '''
+    a plain Embedding over the whole vocab, or a HashEmbedding when hash_buckets is set
+    pretrained: start from vocab.vectors (copied in and trained, or frozen under the hashed rows)
+    mode, for the plain Embedding:
+        train: dense table, every row trained
+        frozen: the pretrained vectors as they are, no gradients
+        delta: frozen pretrained vectors + a sparse trainable correction (without pretrained: a sparse table)
+    '''
+    assert mode in EMBED_MODES, "embedding mode is one of {}".format(EMBED_MODES)
+    if hash_buckets:
+        return HashEmbedding(vocab.itos, hash_buckets, embed_dim, hash_functions,
+                             pretrained=vocab.vectors if pretrained else None)
+
+    if pretrained and mode == 'delta':
+        return DeltaEmbedding(vocab.vectors)
+
+    embeddings = torch.nn.Embedding(len(vocab), embed_dim, sparse=mode == 'delta')
+    if pretrained:
+        embeddings.weight.data.copy_(vocab.vectors)
+        embeddings.weight.requires_grad = mode != 'frozen'
+    return embeddings
+
+
+def extend_embedding(embedding, words, vectors):
+    '''
+    append rows for new vocab words, initialised from vectors; for inference, the optimiser is not told
+    '''
+    if isinstance(embedding, (HashEmbedding, DeltaEmbedding)):
+        return embedding.extend(words, vectors)
+
+    weight = embedding.weight
+    embedding.weight = torch.nn.Parameter(torch.cat([weight.data, vectors.type_as(weight.data)]),
+                                          requires_grad=weight.requires_grad)
+    embedding.num_embeddings = embedding.weight.size(0)
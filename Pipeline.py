@@ -0,0 +1,220 @@
+'''
+raw text => CoNLL-U with segment -> tag -> parse running side by side: every stage is its own process (or several),
+stages are connected by bounded queues of chunks of sentences, and each stage batches its chunk on its own
+so while chunk N is being parsed, chunk N+1 is being tagged and N+2 segmented; the writer puts chunks back in
+input order, whichever worker finished them first
+'''
+import os
+import sys
+import argparse
+import queue
+import threading
+from multiprocessing.connection import wait
+import torch
+import torch.multiprocessing as mp
+import Loader
+import Tokenise
+import Config
+import Pretrained
+from Runner import load
+from Runnables import Tagger, Parser, Segmenter
+
+# end of input; a stage that sees it puts it back for its siblings and stops
+STOP = None
+
+
+def extend(embedding, fields, chunk, store):
+    '''
+    before a chunk is batched, its unseen words that the pretrained store has a vector for get a row of their own
+    in the vocab and in embedding instead of all being <unk>; store=None (no --embed) leaves them <unk>
+    '''
+    if store is not None:
+        Pretrained.extend(fields['form'].vocab, embedding, [row[1] for rows in chunk for row in rows], store)
+
+
+def tag(tagger, fields, chunk, batch_size, store=None):
+    extend(tagger.embeds, fields, chunk, store)
+    loader = Loader.sentences_to_iterator(chunk, fields, batch_size)
+    for position, tags in zip(loader.order, tagger.predict_(loader)):
+        # tags[0] is the root
+        for row, upos in zip(chunk[position], tags[1:]):
+            row[3] = upos
+    return chunk
+
+
+def parse(parser, fields, chunk, batch_size, store=None):
+    extend(parser.embeddings_forms, fields, chunk, store)
+    loader = Loader.sentences_to_iterator(chunk, fields, batch_size)
+    for position, (heads, deprels) in zip(loader.order, parser.predict_(loader)):
+        for row, head, deprel in zip(chunk[position], heads[1:], deprels[1:]):
+            row[6], row[7] = str(head), deprel
+    return chunk
+
+
+def _segment(segmenter, path, outbox, chunk_size, window, batch_size, threads):
+    torch.set_num_threads(threads)
+    with open(path, encoding='utf-8') as f:
+        for n, chunk in enumerate(Tokenise.chunks(segmenter, f, chunk_size, window, batch_size)):
+            outbox.put((n, chunk))
+
+
+def _stage(fn, runnable, fields, batch_size, store, inbox, outbox, threads):
+    torch.set_num_threads(threads)
+    while True:
+        item = inbox.get()
+        if item is STOP:
+            inbox.put(STOP)
+            return
+        n, chunk = item
+        outbox.put((n, fn(runnable, fields, chunk, batch_size, store)))
+
+
+def _put(outbox, item, consumers):
+    # a put that gives up once none of the consumers is left to make room; consumers=None: the writer, always there
+    while consumers is None or any(worker.is_alive() for worker in consumers):
+        try:
+            outbox.put(item, timeout=1)
+            return
+        except queue.Full:
+            pass
+
+
+def _terminate(stages):
+    for worker in (worker for stage in stages for worker in stage):
+        if worker.is_alive():
+            worker.terminate()
+
+
+def _supervise(stages, queues):
+    '''
+    a stage's output ends (STOP) once all its workers have exited; a worker that fails takes every other worker
+    down with it, otherwise the stages either side of it would block on its queues forever
+    '''
+    running = [list(stage) for stage in stages]
+    while any(running):
+        wait([worker.sentinel for stage in running for worker in stage])
+        for n, stage in enumerate(running):
+            exited = [worker for worker in stage if worker.exitcode is not None]
+            if any(worker.exitcode != 0 for worker in exited):
+                _terminate(stages)
+                queues[-1].put(STOP)
+                return
+
+            for worker in exited:
+                stage.remove(worker)
+            if exited and not stage:
+                # the next stage's workers, or the writer after the last stage
+                _put(queues[n], STOP, stages[n + 1] if n + 1 < len(stages) else None)
+
+
+def in_order(inbox):
+    '''
+    chunks from the last stage in input order: the ones that overtook the next expected chunk wait in a dict
+    '''
+    waiting, expected = {}, 0
+    while True:
+        item = inbox.get()
+        if item is STOP:
+            break
+        n, chunk = item
+        waiting[n] = chunk
+        while expected in waiting:
+            yield waiting.pop(expected)
+            expected += 1
+
+    assert not waiting, "chunks {} never arrived".format(sorted(waiting))
+
+
+def run(segmenter, tagger, parser, fields, path, out, chunk_size=256, queue_size=4, window=50, batch_size=32,
+        tag_workers=1, parse_workers=1, store=None):
+    '''
+    fields: the training dataset's fields (train_loader.dataset.fields), for turning CoNLL-U rows into batches
+    store: a Pretrained.PretrainedStore for the words the models have never seen (see extend)
+    the runnables are forked into the workers, not pickled; so is the vocab, which each worker extends on its own
+    '''
+    queues = [mp.Queue(maxsize=queue_size) for _ in range(3)]
+    threads = max(1, os.cpu_count() // (1 + tag_workers + parse_workers))
+
+    stages = [[mp.Process(target=_segment, args=(segmenter, path, queues[0], chunk_size, window, batch_size, threads))],
+              [mp.Process(target=_stage, args=(tag, tagger, fields, batch_size, store, queues[0], queues[1], threads))
+               for _ in range(tag_workers)],
+              [mp.Process(target=_stage, args=(parse, parser, fields, batch_size, store, queues[1], queues[2],
+                                               threads))
+               for _ in range(parse_workers)]]
+    for stage in stages:
+        for worker in stage:
+            worker.start()
+
+    # a crashed worker ends the run instead of hanging it: see _supervise
+    threading.Thread(target=_supervise, args=(stages, queues), daemon=True).start()
+
+    sent_id = 0
+    try:
+        for chunk in in_order(queues[2]):
+            for rows in chunk:
+                sent_id += 1
+                out.write(Tokenise.to_conllu(rows, sent_id))
+    finally:
+        # failures first: the workers stopped below would all count as failed
+        failed = [worker.exitcode for stage in stages for worker in stage if worker.exitcode not in (None, 0)]
+        # whatever stopped the writer, nothing is left running or waiting to flush into a queue nobody reads
+        _terminate(stages)
+        for stage in stages:
+            for worker in stage:
+                worker.join()
+        for q in queues:
+            q.cancel_join_thread()
+        if failed:
+            raise RuntimeError("pipeline workers exited with {}".format(failed))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--raw', required=True, help="raw text, any line breaks")
+    arg_parser.add_argument('--segmenter', required=True, help="state dict from Runner.py tokenise")
+    arg_parser.add_argument('--tagger', required=True, help="state dict from Runner.py train --tag")
+    arg_parser.add_argument('--parser', required=True,
+                            help="state dict from Runner.py train --parse (or a Prune.py bundle)")
+    arg_parser.add_argument('--config', default='./config.ini')
+    # the treebank the models were trained on, for their vocabs
+    arg_parser.add_argument('--train', action='store')
+    arg_parser.add_argument('--dev', action='store')
+    arg_parser.add_argument('--test', action='store')
+    arg_parser.add_argument('--embed', action='store')
+    arg_parser.add_argument('--use_chars', action='store_true')
+    arg_parser.add_argument('--chunk_size', type=int, default=256, help="sentences per chunk")
+    arg_parser.add_argument('--queue_size', type=int, default=4, help="chunks waiting between two stages")
+    arg_parser.add_argument('--tag_workers', type=int, default=1)
+    arg_parser.add_argument('--parse_workers', type=int, default=1)
+    arg_parser.add_argument('--out', action='store', help="CoNLL-U output, stdout by default")
+    args = arg_parser.parse_args()
+
+    config = Config.read(args.config)
+
+    # the runnables read these off args; the stages are cpu processes
+    args.semtag, args.save, args.use_cuda = False, None, False
+
+    batch_size = int(config['parser']['BATCH_SIZE'])
+    window = int(config['segmenter'].get('WINDOW', 50)) if config.has_section('segmenter') else 50
+
+    (train_loader, _, _), sizes, vocab = Loader.get_iterators(args, batch_size, splits=['train'],
+                                                              **Config.vocab_params(config))
+    (_, _, _), seg_sizes, seg_vocab = Loader.seg_iterators(args, batch_size, window, splits=[])
+
+    segmenter = Segmenter(seg_sizes, args, seg_vocab, **Config.segmenter_params(config))
+    load(segmenter, args.segmenter, seg_vocab)
+
+    tagger = Tagger(sizes, args, vocab, **Config.tagger_params(config['tagger']), **Config.embed_params(config))
+    load(tagger, args.tagger, vocab)
+
+    parser = Parser(sizes, args, vocab, embeddings=vocab, **Config.parser_params(config['parser']),
+                    **Config.embed_params(config))
+    load(parser, args.parser, vocab)
+
+    # words outside the train vocab get their pretrained vectors as they turn up
+    store = Pretrained.PretrainedStore(args.embed) if args.embed else None
+
+    out = open(args.out, "w", encoding='utf-8') if args.out else sys.stdout
+    run(segmenter, tagger, parser, train_loader.dataset.fields, args.raw, out, chunk_size=args.chunk_size,
+        queue_size=args.queue_size, window=window, batch_size=batch_size, tag_workers=args.tag_workers,
+        parse_workers=args.parse_workers, store=store)
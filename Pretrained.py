@@ -0,0 +1,144 @@
+import os
+import pickle
+import torch
+from collections import Counter
+from Modules import HashEmbedding, DeltaEmbedding, extend_embedding
+
+# the modules that hold one row per vocab word
+EMBEDDINGS = (torch.nn.Embedding, HashEmbedding, DeltaEmbedding)
+
+
+class PretrainedStore:
+    '''
+    a word2vec/glove style text file of vectors, read by seeking instead of loading it whole
+    the first use scans the file once for word -> byte offset and caches that next to it (<path>.idx);
+    after that only the rows that are asked for get read and parsed
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.offsets, self.dim = self._index()
+
+    def _index(self):
+        cache = self.path + ".idx"
+        if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(self.path):
+            with open(cache, "rb") as f:
+                return pickle.load(f)
+
+        offsets, dim = {}, None
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                fields = line.rstrip().split(b" ")
+                # a word2vec header is "<words> <dim>"
+                if offset == 0 and len(fields) == 2:
+                    offset += len(line)
+                    continue
+                if dim is None:
+                    dim = len(fields) - 1
+                if len(fields) - 1 == dim:
+                    word = fields[0].decode('utf-8', errors='replace')
+                    # first occurrence wins, as in torchtext's Vectors
+                    offsets.setdefault(word, offset)
+                offset += len(line)
+
+        try:
+            with open(cache, "wb") as f:
+                pickle.dump((offsets, dim), f)
+        except OSError:
+            pass
+
+        return offsets, dim
+
+    def __contains__(self, word):
+        return word in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, words):
+        # len(words) x dim; zeros for words without a vector, like torchtext's default
+        vectors = torch.zeros(len(words), self.dim)
+        with open(self.path, "rb") as f:
+            for n, word in sorted(enumerate(words), key=lambda x: self.offsets.get(x[1], -1)):
+                if word not in self.offsets:
+                    continue
+                f.seek(self.offsets[word])
+                values = f.readline().rstrip().split(b" ")[1:]
+                vectors[n] = torch.FloatTensor([float(v) for v in values])
+
+        return vectors
+
+
+def build_vocab(field, name, train, inference=(), store=None, max_size=None, min_freq=1, max_extra=None):
+    '''
+    FORM vocab from train, capped by max_size / min_freq, plus up to max_extra words of the inference datasets
+    (dev, test) that have a pretrained vector, most frequent first, so they are not <unk> at test time
+    only the rows of the store that end up in the vocab are read
+    vocab.train_size marks where the train words end; fit_state_dict relies on it
+    train: a dataset, or a list of them for one vocab over several treebanks
+    '''
+    trains = train if isinstance(train, (list, tuple)) else [train]
+    field.build_vocab(*trains, max_size=max_size, min_freq=min_freq)
+    vocab = field.vocab
+    vocab.train_size = len(vocab)
+    if store is None:
+        return vocab
+
+    counts = Counter(word for dataset in inference for example in dataset for word in getattr(example, name)
+                     if word not in vocab.stoi and word in store)
+    add_words(vocab, [word for word, _ in counts.most_common(max_extra)])
+    vocab.vectors = store.get(vocab.itos)
+    return vocab
+
+
+def add_words(vocab, words):
+    for word in words:
+        vocab.stoi[word] = len(vocab.itos)
+        vocab.itos.append(word)
+
+
+def rows(embedding):
+    # how many vocab words the module has a row for
+    if isinstance(embedding, HashEmbedding):
+        return embedding.rows.size(0)
+    elif isinstance(embedding, DeltaEmbedding):
+        return embedding.pretrained.size(0)
+    return embedding.weight.size(0)
+
+
+def extend(vocab, embedding, words, store):
+    '''
+    at inference: give the unseen words that the store has a vector for their own row, in the vocab and in the
+    embedding module, without rereading the file; returns how many rows the embedding got
+    the vocab can be shared by several models (a tagger and a parser): the words another model's extend already
+    put in it get their row here too
+    '''
+    add_words(vocab, [word for word in sorted(set(words)) if word not in vocab.stoi and word in store])
+    if vocab.vectors is not None and vocab.vectors.size(0) < len(vocab):
+        vocab.vectors = torch.cat([vocab.vectors, store.get(vocab.itos[vocab.vectors.size(0):])])
+
+    missing = vocab.itos[rows(embedding):]
+    if not missing:
+        return 0
+    extend_embedding(embedding, missing, store.get(missing))
+    return len(missing)
+
+
+def fit_state_dict(module, state_dict, vocab):
+    '''
+    a model saved with another dev/test set has other inference-only rows: keep the saved rows for the train words
+    and this run's rows (pretrained vectors, never trained) for the rest
+    '''
+    embeddings = {name for name, m in module.named_modules() if isinstance(m, EMBEDDINGS)}
+    own = module.state_dict()
+    fitted = {}
+    for key, saved in state_dict.items():
+        current = own.get(key)
+        if key.rsplit('.', 1)[0] in embeddings and current is not None and current.size(0) == len(vocab) \
+                and saved.size(0) >= vocab.train_size and saved.size()[1:] == current.size()[1:]:
+            merged = current.cpu().clone()
+            merged[:vocab.train_size] = saved[:vocab.train_size]
+            saved = merged
+        fitted[key] = saved
+
+    return fitted
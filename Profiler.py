@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import torch
+from collections import OrderedDict
+
+
+def _rss_mb():
+    # current resident set, not the peak; linux only, 0 elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return 0.0
+
+
+class _Probe:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.sync:
+            torch.cuda.synchronize()
+        self.rss = _rss_mb()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if self.profiler.sync:
+            torch.cuda.synchronize()
+        end = time.perf_counter()
+        self.profiler.record(self.name, self.start, end, _rss_mb() - self.rss)
+
+
+class _NoProbe:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullProfiler:
+    '''
+    what every runnable holds unless profiling was asked for: probes cost one attribute lookup
+    '''
+    _probe = _NoProbe()
+
+    def probe(self, name):
+        return self._probe
+
+    def end_epoch(self, epoch):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL = NullProfiler()
+
+
+class Profiler:
+    '''
+    named wall-time and RSS probes around the stages of a forward pass
+    end_epoch appends a per-stage summary to <directory>/profile.txt; trace events stream into
+    <directory>/trace.json (chrome://tracing) every epoch and every flush_every events, so they never pile up in
+    memory and skew the rss figures
+    '''
+    def __init__(self, directory, trace=True, sync=False, flush_every=10000):
+        self.directory = directory
+        self.sync = sync
+        self.events = [] if trace else None
+        self.flush_every = flush_every
+        self.stats = OrderedDict()
+        self.epoch = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.trace = None
+        if trace:
+            # the JSON array format, written an event at a time; close adds the closing bracket
+            self.trace = open(os.path.join(directory, "trace.json"), "w")
+            self.trace.write("[")
+            self.traced = 0
+
+    def probe(self, name):
+        return _Probe(self, name)
+
+    def record(self, name, start, end, rss_delta):
+        # calls, seconds, largest rss growth inside the stage
+        stat = self.stats.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += end - start
+        stat[2] = max(stat[2], rss_delta)
+
+        if self.events is not None:
+            self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0, 'ts': start * 1e6,
+                                'dur': (end - start) * 1e6, 'args': {'epoch': self.epoch, 'rss_delta_mb': rss_delta}})
+            if len(self.events) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        for event in self.events:
+            self.trace.write(("\n" if not self.traced else ",\n") + json.dumps(event))
+            self.traced += 1
+        self.trace.flush()
+        self.events = []
+
+    def summary(self):
+        total = sum(stat[1] for stat in self.stats.values()) or 1.0
+        lines = ["epoch {}".format(self.epoch),
+                 "{:<16}{:>10}{:>12}{:>10}{:>10}{:>14}".format('stage', 'calls', 'seconds', '%', 'ms/call', 'max rss +MB')]
+        for name, (calls, seconds, rss) in self.stats.items():
+            lines.append("{:<16}{:>10}{:>12.3f}{:>10.1f}{:>10.3f}{:>14.1f}".format(
+                name, calls, seconds, 100 * seconds / total, 1000 * seconds / calls, rss))
+        return "\n".join(lines) + "\n"
+
+    def end_epoch(self, epoch):
+        self.epoch = epoch
+        with open(os.path.join(self.directory, "profile.txt"), "a") as f:
+            f.write(self.summary() + "\n")
+        self.stats = OrderedDict()
+        self.epoch = epoch + 1
+        if self.trace is not None:
+            self.flush()
+
+    def close(self):
+        if self.trace is not None and not self.trace.closed:
+            self.flush()
+            self.trace.write("\n]\n")
+            self.trace.close()
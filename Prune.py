@@ -0,0 +1,248 @@
+'''
+structured pruning of a trained Parser / TagAndParse: whole hidden units go, and the matrices around them are
+rebuilt smaller, so the saving shows up in wall time and not just in a sparsity count
+    lstm: the same number of units is kept in every layer and direction (nn.LSTM has one hidden_size)
+    mlp_head / mlp_dep and the arc biaffine: head and dep units are ranked separately, kept in equal numbers
+    mlp_deprel_head / mlp_deprel_dep and the label biaffine: ranked and kept separately
+'''
+import sys
+import json
+import argparse
+import torch
+import Config
+import Loader
+import Trainer
+import Helpers
+import Benchmark
+import Checkpoint
+import Pretrained
+from Modules import ShorterBiaffine, LongerBiaffine
+from Runnables import Parser, TagAndParse
+
+
+def _top(scores, k):
+    # indices of the k largest scores, in their original order
+    return scores.sort(0, descending=True)[1][:k].sort()[0]
+
+
+def _norms(tensor, dim):
+    # L2 norm of every slice along dim
+    return tensor.transpose(0, dim).contiguous().view(tensor.size(dim), -1).norm(2, 1).view(-1)
+
+
+def _directions(lstm):
+    return ['', '_reverse'] if lstm.bidirectional else ['']
+
+
+def lstm_scores(lstm):
+    # a unit's weight: the norm of everything feeding its four gates
+    hidden = lstm.hidden_size
+    scores = {}
+    for layer in range(lstm.num_layers):
+        for suffix in _directions(lstm):
+            w_ih = getattr(lstm, 'weight_ih_l{}{}'.format(layer, suffix)).data
+            w_hh = getattr(lstm, 'weight_hh_l{}{}'.format(layer, suffix)).data
+            gates = torch.cat([w_ih.view(4, hidden, -1), w_hh.view(4, hidden, -1)], dim=2)
+            scores[layer, suffix] = _norms(gates, 1)
+    return scores
+
+
+def _outputs(lstm, keep, layer):
+    # columns of whatever reads this layer's output (fwd units, then bwd units)
+    return torch.cat([keep[layer, suffix] + n * lstm.hidden_size for n, suffix in enumerate(_directions(lstm))])
+
+
+def shrink_lstm(lstm, keep):
+    '''
+    keep: (layer, direction suffix) -> unit indices, all the same length
+    returns the smaller LSTM and the kept columns of its output
+    '''
+    hidden, units = lstm.hidden_size, len(next(iter(keep.values())))
+    new = torch.nn.LSTM(lstm.input_size, units, lstm.num_layers, bias=lstm.bias, batch_first=lstm.batch_first,
+                        dropout=lstm.dropout, bidirectional=lstm.bidirectional)
+
+    for layer in range(lstm.num_layers):
+        columns = None if layer == 0 else _outputs(lstm, keep, layer - 1)
+        for suffix in _directions(lstm):
+            rows = torch.cat([keep[layer, suffix] + gate * hidden for gate in range(4)])
+            for kind in ['weight_ih', 'weight_hh', 'bias_ih', 'bias_hh']:
+                name = '{}_l{}{}'.format(kind, layer, suffix)
+                if not hasattr(lstm, name) or getattr(lstm, name) is None:
+                    continue
+                value = getattr(lstm, name).data.index_select(0, rows)
+                if kind == 'weight_ih' and columns is not None:
+                    value = value.index_select(1, columns)
+                elif kind == 'weight_hh':
+                    value = value.index_select(1, keep[layer, suffix])
+                getattr(new, name).data.copy_(value)
+
+    return new, _outputs(lstm, keep, lstm.num_layers - 1)
+
+
+def shrink_linear(linear, rows=None, columns=None):
+    weight, bias = linear.weight.data, linear.bias.data
+    if rows is not None:
+        weight, bias = weight.index_select(0, rows), bias.index_select(0, rows)
+    if columns is not None:
+        weight = weight.index_select(1, columns)
+
+    new = torch.nn.Linear(weight.size(1), weight.size(0))
+    new.weight.data.copy_(weight)
+    new.bias.data.copy_(bias)
+    return new
+
+
+def _with_bias_row(keep, size):
+    # the biaffines carry their bias terms in an extra last row/column, which always stays
+    return torch.cat([keep, torch.LongTensor([size])])
+
+
+def shrink_arc_biaffine(biaffine, head, dep):
+    size = biaffine.weight.size(1)
+    new = ShorterBiaffine(len(head))
+    new.weight.data.copy_(biaffine.weight.data.index_select(0, _with_bias_row(head, size)).index_select(1, dep))
+    return new
+
+
+def shrink_label_biaffine(biaffine, head, dep):
+    new = LongerBiaffine(len(head), len(dep), biaffine.dep_labels)
+    weight = biaffine.weight.data.index_select(0, _with_bias_row(head, biaffine.in1_features))
+    new.weight.data.copy_(weight.index_select(1, _with_bias_row(dep, biaffine.in2_features)))
+    new.bias.data.copy_(biaffine.bias.data)
+    return new
+
+
+def shrink(runnable, lstm_keep, arc_head, arc_dep, label_head, label_dep):
+    runnable.cpu()
+    runnable.lstm, columns = shrink_lstm(runnable.lstm, lstm_keep)
+    runnable.mlp_head = shrink_linear(runnable.mlp_head, arc_head, columns)
+    runnable.mlp_dep = shrink_linear(runnable.mlp_dep, arc_dep, columns)
+    runnable.mlp_deprel_head = shrink_linear(runnable.mlp_deprel_head, label_head, columns)
+    runnable.mlp_deprel_dep = shrink_linear(runnable.mlp_deprel_dep, label_dep, columns)
+    runnable.biaffine = shrink_arc_biaffine(runnable.biaffine, arc_head, arc_dep)
+    runnable.label_biaffine = shrink_label_biaffine(runnable.label_biaffine, label_head, label_dep)
+
+    # the old optimiser holds the old parameters
+    runnable.optimiser = Helpers.optimiser_for(runnable, runnable.optimiser.param_groups[0]['lr'])
+    if runnable.use_cuda:
+        runnable.cuda()
+
+    return dims(runnable)
+
+
+def dims(runnable):
+    return {'lstm_dim': runnable.lstm.hidden_size, 'reduce_dim_arc': runnable.mlp_head.out_features,
+            'reduce_dim_label_head': runnable.mlp_deprel_head.out_features,
+            'reduce_dim_label_dep': runnable.mlp_deprel_dep.out_features}
+
+
+def prune(runnable, lstm=1.0, arc=1.0, label=1.0):
+    '''
+    keep the given fraction of units in each group, ranked by weight magnitude:
+    incoming weights times the weights that read the unit in the biaffine
+    returns the new dims
+    '''
+    keep = lambda size, fraction: max(1, int(round(size * fraction)))
+
+    scores = lstm_scores(runnable.lstm)
+    units = keep(runnable.lstm.hidden_size, lstm)
+    lstm_keep = {key: _top(score, units) for key, score in scores.items()}
+
+    arc_weight = runnable.biaffine.weight.data.squeeze(2)
+    arc_units = keep(runnable.mlp_head.out_features, arc)
+    arc_head = _top(_norms(runnable.mlp_head.weight.data, 0) * _norms(arc_weight[:-1], 0), arc_units)
+    arc_dep = _top(_norms(runnable.mlp_dep.weight.data, 0) * _norms(arc_weight, 1), arc_units)
+
+    label_weight = runnable.label_biaffine.weight.data
+    label_head = _top(_norms(runnable.mlp_deprel_head.weight.data, 0) * _norms(label_weight[:-1], 0),
+                      keep(runnable.mlp_deprel_head.out_features, label))
+    label_dep = _top(_norms(runnable.mlp_deprel_dep.weight.data, 0) * _norms(label_weight[:, :-1], 1),
+                     keep(runnable.mlp_deprel_dep.out_features, label))
+
+    return shrink(runnable, lstm_keep, arc_head, arc_dep, label_head, label_dep)
+
+
+def resize(runnable, shape):
+    # give a freshly built model the dims of a pruned bundle, so its state dict loads
+    first = lambda n: torch.arange(0, n).long()
+    lstm_keep = {(layer, suffix): first(shape['lstm_dim']) for layer in range(runnable.lstm.num_layers)
+                 for suffix in _directions(runnable.lstm)}
+    shrink(runnable, lstm_keep, first(shape['reduce_dim_arc']), first(shape['reduce_dim_arc']),
+           first(shape['reduce_dim_label_head']), first(shape['reduce_dim_label_dep']))
+
+
+def save_bundle(path, runnable, model):
+    Checkpoint.save_model(path, {'model': model, 'dims': dims(runnable), 'state_dict': Checkpoint.snapshot(runnable)})
+
+
+def load_state(runnable, state):
+    '''
+    load either a plain state dict or a pruned bundle, resizing the runnable for the latter
+    '''
+    if 'dims' in state:
+        resize(runnable, state['dims'])
+        state = state['state_dict']
+    return state
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--model', choices=['parser', 'tagandparse'], default='parser')
+    arg_parser.add_argument('--load', required=True, help="state dict of the trained model")
+    arg_parser.add_argument('--config', default='./config.ini')
+    arg_parser.add_argument('--train', action='store')
+    arg_parser.add_argument('--dev', action='store')
+    arg_parser.add_argument('--test', action='store')
+    arg_parser.add_argument('--embed', action='store')
+    arg_parser.add_argument('--use_chars', action='store_true')
+    arg_parser.add_argument('--use_cuda', action='store_true')
+    # fractions of units kept
+    arg_parser.add_argument('--lstm', type=float, default=0.5)
+    arg_parser.add_argument('--arc', type=float, default=0.5)
+    arg_parser.add_argument('--label', type=float, default=0.5)
+    arg_parser.add_argument('--finetune', type=int, default=0, help="epochs of fine-tuning after pruning")
+    arg_parser.add_argument('--save', action='store', help="where to write the pruned bundle")
+    arg_parser.add_argument('--out', action='store', help="before/after report, JSON")
+    args = arg_parser.parse_args()
+
+    config = Config.read(args.config)
+    parse = config['parser']
+    params = dict(Config.parser_params(parse), **Config.embed_params(config))
+
+    # the runnables read these off args
+    bundle, args.save, args.semtag = args.save, None, False
+    # with the vocab caps the model was trained with, or its embedding rows won't line up
+    (train_loader, dev_loader, test_loader), sizes, vocab = Loader.get_iterators(args, int(parse['BATCH_SIZE']),
+                                                                                 **Config.vocab_params(config))
+
+    runnable = (TagAndParse if args.model == 'tagandparse' else Parser)(sizes, args, vocab, embeddings=vocab[0], **params)
+    if args.use_cuda:
+        runnable.cuda()
+    with open(args.load, "rb") as f:
+        state = torch.load(f, map_location=lambda storage, loc: storage)
+    state = load_state(runnable, state)
+    runnable.load_state_dict(Pretrained.fit_state_dict(runnable, state, vocab[0]))
+
+    report = {'model': args.model, 'keep': {'lstm': args.lstm, 'arc': args.arc, 'label': args.label},
+              'before': dict(Benchmark.measure(runnable, test_loader), **dims(runnable))}
+
+    report['dims'] = prune(runnable, args.lstm, args.arc, args.label)
+    report['pruned'] = Benchmark.measure(runnable, test_loader)
+
+    if args.finetune:
+        print("Fine-tuning for {} epochs".format(args.finetune))
+        Trainer.fit(runnable, train_loader, dev_loader, args.finetune)
+        report['finetuned'] = Benchmark.measure(runnable, test_loader)
+
+    after = report.get('finetuned', report['pruned'])
+    report['speedup'] = after['tokens_per_sec'] / report['before']['tokens_per_sec']
+    report['uas_loss'] = report['before']['uas'] - after['uas']
+    report['las_loss'] = report['before']['las'] - after['las']
+    report['compression'] = report['before']['parameters'] / after['parameters']
+
+    if bundle:
+        save_bundle(bundle, runnable, args.model)
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    json.dump(report, out, indent=2)
+    out.write("\n")
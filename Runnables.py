@@ -2,18 +2,24 @@ import os
 import torch
 import pprint
 import Helpers
+import Profiler
+import Telemetry
+import Distributed
+from Scheduler import Scheduler
 from scripts import cle
 from torch.autograd import Variable
 from collections import Counter
 import torch.nn.functional as F
-from Modules import CharEmbedding, ShorterBiaffine, LongerBiaffine
+from Modules import CharEmbedding, ShorterBiaffine, LongerBiaffine, AuxHeads, form_embedding
 
 
 class Analyser(torch.nn.Module):
     def __init__(self, sizes, args, vocab, chain=False, embeddings=None, embed_dim=100, lstm_dim=100, lstm_layers=3,
-                 mlp_dim=100, learning_rate=1e-5):
+                 mlp_dim=100, learning_rate=1e-5, bf16=False, hash_buckets=0, hash_functions=2, embed_mode='train'):
         super().__init__()
         self.cuda = args.use_cuda
+        self.bf16 = bf16
+        self.metrics = Telemetry.MetricsLogger()
 
         self.morph_vocab = vocab[3]
         self.feat_vocab = []
@@ -28,12 +34,13 @@ class Analyser(torch.nn.Module):
         self.feat_vocab_stoi = {i: n for (n, i) in enumerate(self.feat_vocab_itos)}
 
         # components
-        self.embeds = torch.nn.Embedding(sizes['vocab'], embed_dim)
+        self.embeds = form_embedding(vocab[0], embed_dim, hash_buckets=hash_buckets, hash_functions=hash_functions,
+                                     mode=embed_mode)
         self.lstm = torch.nn.LSTM(embed_dim, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.5)
         self.mlp = torch.nn.Linear(2 * lstm_dim, mlp_dim)
         self.out = torch.nn.Linear(mlp_dim, len(self.feat_vocab))
 
-        self.optimiser = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
+        self.optimiser = Helpers.optimiser_for(self, learning_rate)
         self.criterion = torch.nn.BCEWithLogitsLoss()
 
     def forward(self, x_forms, pack):
@@ -56,7 +63,10 @@ class Analyser(torch.nn.Module):
         for i, batch in enumerate(train_loader):
             (x_forms, pack), x_tags = batch.form, batch.upos
             new_batch_tensor = Helpers.extract_batch_bucket_vector(batch, self.morph_vocab, self.feat_vocab_itos, self.feat_vocab_stoi)
-            predicted_tensor = self.forward(x_forms, pack)
+            with Helpers.autocast(self.bf16):
+                predicted_tensor = self.forward(x_forms, pack)
+            # loss stays in fp32
+            predicted_tensor = predicted_tensor.float()
 
             train_loss = self.criterion(predicted_tensor, new_batch_tensor.type(torch.FloatTensor))
 
@@ -64,48 +74,82 @@ class Analyser(torch.nn.Module):
             train_loss.backward()
             self.optimiser.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(
-                epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
+            self.metrics.log(epoch, train_loss, pack.tolist())
+
+        self.metrics.end_epoch(epoch)
+
+    @Helpers.inference
+    def evaluate_(self, test_loader, print_conll=False):
+        # micro precision/recall/F1 of the feature names predicted for each token
+        # print_conll is there for Runner; the names alone don't make a FEATS column, so nothing is written
+        predicted, gold, correct = 0, 0, 0
+        for batch in test_loader:
+            x_forms, pack = batch.form
+            gold_feats = Helpers.extract_batch_bucket_vector(batch, self.morph_vocab, self.feat_vocab_itos,
+                                                             self.feat_vocab_stoi).data.byte()
+            with Helpers.autocast(self.bf16):
+                predicted_tensor = self.forward(x_forms, pack)
+
+            # B x S x F, padding left out
+            mask = Helpers.eval_mask(pack).data.unsqueeze(2).expand_as(gold_feats)
+            predicted_feats = (predicted_tensor.data.float().cpu() > 0) & mask
+            gold_feats = gold_feats & mask
+            predicted += int(predicted_feats.sum())
+            gold += int(gold_feats.sum())
+            correct += int((predicted_feats & gold_feats).sum())
+
+        precision, recall = correct / max(predicted, 1), correct / max(gold, 1)
+        f1 = 2 * precision * recall / max(precision + recall, 1e-12)
+        print("Features: P = {:.4f} R = {:.4f} F1 = {:.4f}".format(precision, recall, f1))
+        # dev score for model selection
+        self.score = f1
+        self.scores = {'precision': precision, 'recall': recall, 'f1': f1}
 
 
 class Tagger(torch.nn.Module):
     def __init__(self, sizes, args, vocab, chain=False, embeddings=None, embed_dim=100, lstm_dim=100, lstm_layers=3,
-                 mlp_dim=100, learning_rate=1e-5):
+                 mlp_dim=100, learning_rate=1e-5, bf16=False, hash_buckets=0, hash_functions=2, embed_mode='train'):
         super().__init__()
 
-        self.embeds = torch.nn.Embedding(sizes['vocab'], embed_dim)
+        self.embeds = form_embedding(vocab[0], embed_dim, pretrained=bool(args.embed), hash_buckets=hash_buckets,
+                                     hash_functions=hash_functions, mode=embed_mode)
         self.compress = torch.nn.Linear(300,100)
         self.use_cuda = args.use_cuda
+        self.bf16 = bf16
+        # swapped for a Profiler.Profiler to time the stages of forward
+        self.profiler = Profiler.NULL
+        self.metrics = Telemetry.MetricsLogger()
         self.save = args.save
         self.vocab = vocab
         self.test_file = args.test
         self.chain = chain
-        if args.embed:
-            self.embeds.weight.data.copy_(vocab[0].vectors)
         self.lstm = torch.nn.LSTM(100, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.5)
         self.relu = torch.nn.ReLU()
         self.mlp = torch.nn.Linear(2 * lstm_dim, mlp_dim)
         self.out = torch.nn.Linear(mlp_dim, sizes['postags'])
         self.criterion = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimizer = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
+        self.optimizer = Helpers.optimiser_for(self, learning_rate)
         self.dropout = torch.nn.Dropout(p=0.5)
 
     def forward(self, forms, pack):
         # embeds + dropout
-        form_embeds = self.dropout(self.embeds(forms))
-        form_embeds = self.relu(self.compress(form_embeds))
+        with self.profiler.probe('embed'):
+            form_embeds = self.dropout(self.embeds(forms))
+            form_embeds = self.relu(self.compress(form_embeds))
 
         # pack/unpack for LSTM
-        packed = torch.nn.utils.rnn.pack_padded_sequence(form_embeds, pack.tolist(), batch_first=True)
-        lstm_out, _ = self.lstm(packed)
-        lstm_out, _ = torch.nn.utils.rnn.pad_packed_sequence(lstm_out, batch_first=True)
+        with self.profiler.probe('lstm'):
+            packed = torch.nn.utils.rnn.pack_padded_sequence(form_embeds, pack.tolist(), batch_first=True)
+            lstm_out, _ = self.lstm(packed)
+            lstm_out, _ = torch.nn.utils.rnn.pad_packed_sequence(lstm_out, batch_first=True)
 
         # LSTM => dense ReLU
-        mlp_out = self.dropout(self.relu(self.mlp(lstm_out)))
+        with self.profiler.probe('mlp'):
+            mlp_out = self.dropout(self.relu(self.mlp(lstm_out)))
 
-        # reduce to dim no_of_tags
-        y_pred = self.out(mlp_out)
-        if self.cuda:
+            # reduce to dim no_of_tags
+            y_pred = self.out(mlp_out)
+        if self.use_cuda:
             y_pred = y_pred.cuda()
 
         return y_pred
@@ -121,80 +165,108 @@ class Tagger(torch.nn.Module):
             for n, size in enumerate(pack):
                 mask[n, 0:size] = 1
 
-            y_pred = self(x_forms, pack)
+            with Helpers.autocast(self.bf16):
+                y_pred = self(x_forms, pack)
 
             # reshape for cross-entropy
             batch_size, longest_sentence_in_batch = x_forms.size()
 
             # predictions: (B x S x T) => (B * S, T)
             # heads: (B x S) => (B * S)
-            y_pred = y_pred.view(batch_size * longest_sentence_in_batch, -1)
+            # loss stays in fp32
+            y_pred = y_pred.float().view(batch_size * longest_sentence_in_batch, -1)
             x_tags = x_tags.contiguous().view(batch_size * longest_sentence_in_batch)
 
             train_loss = self.criterion(y_pred, x_tags)
 
             self.zero_grad()
             train_loss.backward()
+            Distributed.average_gradients(self)
             self.optimizer.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(
-                epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
-        
-        if self.save:
+            self.metrics.log(epoch, train_loss, pack.tolist())
+
+        self.metrics.end_epoch(epoch)
+        if self.save and Distributed.is_master():
             if not os.path.exists(self.save):
                 os.makedirs(self.save)
             with open(os.path.join(self.save, 'tagger.pt'), "wb") as f:
                 torch.save(self.state_dict(), f)
 
+    @Helpers.inference
     def evaluate_(self, test_loader, print_conll=False):
         correct, total = 0, 0
-        self.eval()
 
-        tag_tensors = [i.upos for i in test_loader]
+        tag_tensors = [i.upos for i in test_loader] if self.chain else None
         for i, batch in enumerate(test_loader):
             (x_forms, pack), x_tags, y_heads, y_deprels = batch.form, batch.upos, batch.head, batch.deprel
 
-            mask = torch.zeros(pack.size()[0], max(pack)).type(torch.LongTensor)
-            for n, size in enumerate(pack):
-                mask[n, 0:size] = 1
-
             # get tags
-            y_pred = self(x_forms, pack).max(2)[1]
-
-            mask = Variable(mask.type(torch.ByteTensor))
-            if self.cuda:
-                mask = mask.cuda()
+            with Helpers.autocast(self.bf16):
+                y_pred = self(x_forms, pack).max(2)[1]
 
+            mask = Helpers.eval_mask(pack, x_tags.is_cuda)
             correct += ((x_tags == y_pred) * mask).nonzero().size(0)
 
             total += mask.nonzero().size(0)
 
             if print_conll:
                 tag_vocab = self.vocab[2]
-                tags = [tag_vocab.itos[i.data[0]] for i in y_pred.view(-1, 1)]
+                tags = [tag_vocab.itos[i] for i in y_pred.data.view(-1).tolist()]
                 Helpers.write_tags_to_conllu(self.test_file, tags, i)
 
         print("Accuracy = {}/{} = {}".format(correct, total, (correct / total)))
+        # dev score for model selection
+        self.score = correct / total
+        self.scores = {'accuracy': correct / total}
         if self.chain: return tag_tensors
 
-class Parser(torch.nn.Module):
+    @Helpers.inference
+    def predict_(self, loader):
+        '''
+        the tags of every sentence the loader yields, in its order, as strings; position 0 is the root
+        '''
+        tag_vocab = self.vocab[2]
+        predictions = []
+        for batch in loader:
+            x_forms, pack = batch.form
+            with Helpers.autocast(self.bf16):
+                y_pred = self(x_forms, pack).max(2)[1].data.cpu()
+
+            for n, length in enumerate(pack.tolist()):
+                predictions.append([tag_vocab.itos[i] for i in y_pred[n, :length].tolist()])
+
+        return predictions
+
+class Parser(torch.nn.Module, AuxHeads):
     def __init__(self, sizes, args, vocab, embeddings=None, embed_dim=100, lstm_dim=400, lstm_layers=3,
-                 reduce_dim_arc=100, reduce_dim_label=100, learning_rate=1e-3):
+                 reduce_dim_arc=100, reduce_dim_label=100, learning_rate=1e-3, token_budget=0, effective_batch_size=0,
+                 bf16=False, hash_buckets=0, hash_functions=2, embed_mode='train'):
         super().__init__()
 
         self.use_cuda = args.use_cuda
+        self.bf16 = bf16
+        # swapped for a Profiler.Profiler to time the stages of forward
+        self.profiler = Profiler.NULL
+        self.metrics = Telemetry.MetricsLogger()
         self.use_chars = args.use_chars
         self.save = args.save
+        # 0 = no limit / step after every batch
+        self.token_budget = token_budget
+        self.effective_batch_size = effective_batch_size
+        # set by Distill.attach: soft arc/label targets from a teacher, mixed into the loss
+        self.teacher = None
+        self.temperature, self.alpha = 1.0, 1.0
         self.vocab = vocab
-        # for writer
-        self.test_file = args.test[0]
+        # for writer; --test is a list for the multilingual model, and Pipeline/predict may not have one
+        self.test_file = args.test[0] if isinstance(args.test, list) else args.test
 
         if self.use_chars:
             self.embeddings_chars = CharEmbedding(sizes['chars'], embed_dim, lstm_dim, lstm_layers)
 
-        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], embed_dim)
-        if args.embed:
-            self.embeddings_forms.weight.data.copy_(vocab[0].vectors)
+        self.embeddings_forms = form_embedding(vocab[0], embed_dim, pretrained=bool(args.embed),
+                                               hash_buckets=hash_buckets, hash_functions=hash_functions,
+                                               mode=embed_mode)
         self.compress = torch.nn.Linear(300,100)                                                      
 
         self.embeddings_tags = torch.nn.Embedding(sizes['postags'], 100)
@@ -210,54 +282,117 @@ class Parser(torch.nn.Module):
         self.biaffine = ShorterBiaffine(reduce_dim_arc)
         self.label_biaffine = LongerBiaffine(reduce_dim_label, reduce_dim_label, sizes['deprels'])
         self.criterion = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimiser = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
+        self.optimiser = Helpers.optimiser_for(self, learning_rate)
 
         if self.use_cuda:
             self.biaffine.cuda()
             self.label_biaffine.cuda()
 
-    def forward(self, forms, tags, pack, chars, char_pack):
-        form_embeds = self.dropout(self.embeddings_forms(forms))
-        form_embeds = self.relu(self.compress(form_embeds))
-        tag_embeds = self.dropout(self.embeddings_tags(tags))
-        composed_embeds = form_embeds
+    def forward(self, forms, tags, pack, chars, char_pack, heads=None, aux=False):
+        # heads: score the labels at these heads instead of the predicted ones
+        # aux: also return {name: logits} of the aux heads, off the same lstm output
+        with self.profiler.probe('embed'):
+            form_embeds = self.dropout(self.embeddings_forms(forms))
+            form_embeds = self.relu(self.compress(form_embeds))
+            tag_embeds = self.dropout(self.embeddings_tags(tags))
+            composed_embeds = form_embeds
 
-        if self.use_chars:
-            composed_embeds += self.dropout(self.embeddings_chars(chars, char_pack))
+            if self.use_chars:
+                composed_embeds += self.dropout(self.embeddings_chars(chars, char_pack))
 
-        embeds = torch.cat([composed_embeds, tag_embeds], dim=2)
+            embeds = torch.cat([composed_embeds, tag_embeds], dim=2)
 
         # pack/unpack for LSTM
-        embeds = torch.nn.utils.rnn.pack_padded_sequence(embeds, pack.tolist(), batch_first=True)
-        output, _ = self.lstm(embeds)
-        output, _ = torch.nn.utils.rnn.pad_packed_sequence(output, batch_first=True)
+        with self.profiler.probe('lstm'):
+            embeds = torch.nn.utils.rnn.pack_padded_sequence(embeds, pack.tolist(), batch_first=True)
+            output, _ = self.lstm(embeds)
+            output, _ = torch.nn.utils.rnn.pad_packed_sequence(output, batch_first=True)
 
         # predict heads
-        reduced_head_head = self.dropout(self.relu(self.mlp_head(output)))
-        reduced_head_dep = self.dropout(self.relu(self.mlp_dep(output)))
-        y_pred_head = self.biaffine(reduced_head_head, reduced_head_dep)
+        with self.profiler.probe('arc_mlp'):
+            reduced_head_head = self.dropout(self.relu(self.mlp_head(output)))
+            reduced_head_dep = self.dropout(self.relu(self.mlp_dep(output)))
+        with self.profiler.probe('arc_biaffine'):
+            y_pred_head = self.biaffine(reduced_head_head, reduced_head_dep)
 
         # predict deprels using heads
-        reduced_deprel_head = self.dropout(self.relu(self.mlp_deprel_head(output)))
-        reduced_deprel_dep = self.dropout(self.relu(self.mlp_deprel_dep(output)))
-        predicted_labels = y_pred_head.max(2)[1]
-        selected_heads = torch.stack([torch.index_select(reduced_deprel_head[n], 0, predicted_labels[n])
-                                        for n, _ in enumerate(predicted_labels)])
-        y_pred_label = self.label_biaffine(selected_heads, reduced_deprel_dep)
-        y_pred_label = Helpers.extract_best_label_logits(predicted_labels, y_pred_label, pack)
+        with self.profiler.probe('label_mlp'):
+            reduced_deprel_head = self.dropout(self.relu(self.mlp_deprel_head(output)))
+            reduced_deprel_dep = self.dropout(self.relu(self.mlp_deprel_dep(output)))
+        with self.profiler.probe('label_select'):
+            predicted_labels = y_pred_head.max(2)[1] if heads is None else heads
+            selected_heads = torch.stack([torch.index_select(reduced_deprel_head[n], 0, predicted_labels[n])
+                                            for n, _ in enumerate(predicted_labels)])
+        with self.profiler.probe('label_biaffine'):
+            y_pred_label = self.label_biaffine(selected_heads, reduced_deprel_dep)
+        with self.profiler.probe('label_extract'):
+            y_pred_label = Helpers.extract_best_label_logits(predicted_labels, y_pred_label, pack)
         if self.use_cuda:
             y_pred_label = y_pred_label.cuda()
 
+        if aux:
+            return y_pred_head, y_pred_label, self.aux_outputs(output)
         return y_pred_head, y_pred_label
 
+    def loss_(self, x_forms, x_tags, pack, chars, length_per_word_per_sent, y_heads, y_deprels, aux_gold=()):
+        # aux_gold: the aux heads' gold labels, as from aux_gold(batch)
+        heads = None
+        if self.teacher is not None:
+            # labels are scored at the teacher's heads so both label distributions describe the same arcs
+            teacher_head, teacher_deprel = self.teacher(x_forms, x_tags, pack, chars, length_per_word_per_sent)
+            heads = teacher_head.max(2)[1]
+
+        with Helpers.autocast(self.bf16):
+            y_pred_head, y_pred_deprel, *y_pred_aux = self(x_forms, x_tags, pack, chars, length_per_word_per_sent,
+                                                           heads, aux=bool(self.aux_heads))
+        # loss stays in fp32
+        y_pred_head, y_pred_deprel = y_pred_head.float(), y_pred_deprel.float()
+
+        distill_loss = 0
+        if self.teacher is not None:
+            mask = Helpers.length_mask(pack, y_heads.size(1), self.use_cuda)
+            distill_loss = Helpers.distillation_loss(y_pred_head, teacher_head, mask, self.temperature) + \
+                Helpers.distillation_loss(y_pred_deprel, teacher_deprel, mask, self.temperature)
+
+        # reshape for cross-entropy
+        batch_size, longest_sentence_in_batch = y_heads.size()
+
+        # predictions: (B x S x S) => (B * S x S)
+        # heads: (B x S) => (B * S)
+        y_pred_head = y_pred_head.view(batch_size * longest_sentence_in_batch, -1)
+        y_heads = y_heads.contiguous().view(batch_size * longest_sentence_in_batch)
+
+        # predictions: (B x S x D) => (B * S x D)
+        # heads: (B x S) => (B * S)
+        y_pred_deprel = y_pred_deprel.view(batch_size * longest_sentence_in_batch, -1)
+        y_deprels = y_deprels.contiguous().view(batch_size * longest_sentence_in_batch)
+
+        # sum losses; alpha = 1 unless distilling
+        gold_loss = self.criterion(y_pred_head, y_heads) + self.criterion(y_pred_deprel, y_deprels)
+        if y_pred_aux:
+            gold_loss = gold_loss + self.aux_loss(y_pred_aux[0], aux_gold)
+        return self.alpha * gold_loss + (1 - self.alpha) * distill_loss
+
+    def step_(self, tokens):
+        # gradients were summed over token-weighted micro-batches: turn them back into a token mean
+        Helpers.scale_gradients(self, 1 / tokens)
+        Distributed.average_gradients(self)
+        self.optimiser.step()
+        self.zero_grad()
+
     '''
     1. the bare minimum that needs to be loaded is forms, upos, head, deprel (could change later); load those
     2. initialise everything else to none; load it if necessary based on command line args
     3. pass everything, whether it's been loaded or not, to the forward function; if it's unnecessary it won't use it
+    4. each batch is split into micro-batches of at most token_budget padded tokens; the optimiser steps once
+       effective_batch_size sentences have been accumulated
     '''
     def train_(self, epoch, train_loader):
         self.train()
         train_loader.init_epoch()
+        self.zero_grad()
+        # sentences and tokens accumulated since the last step
+        sentences, tokens = 0, 0
 
         for i, batch in enumerate(train_loader):
             chars, length_per_word_per_sent = None, None
@@ -267,39 +402,43 @@ class Parser(torch.nn.Module):
             if self.use_chars:
                 (chars, _, length_per_word_per_sent) = batch.char
 
-            y_pred_head, y_pred_deprel = self(x_forms, x_tags, pack, chars, length_per_word_per_sent)
-
-            # reshape for cross-entropy
-            batch_size, longest_sentence_in_batch = y_heads.size()
-
-            # predictions: (B x S x S) => (B * S x S)
-            # heads: (B x S) => (B * S)
-            y_pred_head = y_pred_head.view(batch_size * longest_sentence_in_batch, -1)
-            y_heads = y_heads.contiguous().view(batch_size * longest_sentence_in_batch)
-
-            # predictions: (B x S x D) => (B * S x D)
-            # heads: (B x S) => (B * S)
-            y_pred_deprel = y_pred_deprel.view(batch_size * longest_sentence_in_batch, -1)
-            y_deprels = y_deprels.contiguous().view(batch_size * longest_sentence_in_batch)
-
-            # sum losses
-            train_loss = self.criterion(y_pred_head, y_heads) + self.criterion(y_pred_deprel, y_deprels)
-
-            self.zero_grad()
-            train_loss.backward()
-            self.optimiser.step()
-
-            print("Epoch: {}\t{}/{}\tloss: {}".format(epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
-
-        if self.save:
+            batch_loss = 0
+            for start, end in Helpers.micro_batches(pack, self.token_budget):
+                micro_pack = pack[start:end]
+                micro_tokens = int(micro_pack.sum())
+                micro = Helpers.slice_batch([x_forms, x_tags, chars, length_per_word_per_sent, y_heads, y_deprels] +
+                                            self.aux_gold(batch), start, end, int(pack[start]))
+                m_forms, m_tags, m_chars, m_char_pack, m_heads, m_deprels = micro[:6]
+
+                train_loss = self.loss_(m_forms, m_tags, micro_pack, m_chars, m_char_pack, m_heads, m_deprels,
+                                        micro[6:])
+                (train_loss * micro_tokens).backward()
+                tokens += micro_tokens
+                # stays on the device; the logger reads it back off the training thread
+                batch_loss = batch_loss + train_loss.data * micro_tokens
+
+            sentences += len(x_forms)
+            if sentences >= self.effective_batch_size:
+                self.step_(tokens)
+                sentences, tokens = 0, 0
+
+            lengths = pack.tolist()
+            self.metrics.log(epoch, batch_loss / sum(lengths), lengths)
+
+        # leftovers at the end of the epoch
+        if sentences:
+            self.step_(tokens)
+        self.metrics.end_epoch(epoch)
+
+        if self.save and Distributed.is_master():
             if not os.path.exists(self.save):
                 os.makedirs(self.save)
             with open(os.path.join(self.save, 'parser.pt'), "wb") as f:
                 torch.save(self.state_dict(), f)
 
+    @Helpers.inference
     def evaluate_(self, test_loader, print_conll=False):
         las_correct, uas_correct, total = 0, 0, 0
-        self.eval()
         for i, batch in enumerate(test_loader):
             chars, length_per_word_per_sent = None, None
             (x_forms, pack), x_tags, y_heads, y_deprels = batch.form, batch.upos, batch.head, batch.deprel
@@ -308,20 +447,13 @@ class Parser(torch.nn.Module):
             if self.use_chars:
                 (chars, _, length_per_word_per_sent) = batch.char
 
-            mask = torch.zeros(pack.size()[0], max(pack)).type(torch.LongTensor)
-            for n, size in enumerate(pack):
-                mask[n, 0:size] = 1
-
             # get labels
             # TODO: ensure well-formed tree
-            y_pred_head, y_pred_deprel = [i.max(2)[1] for i in
-                                          self(x_forms, x_tags, pack, chars, length_per_word_per_sent)]
+            with Helpers.autocast(self.bf16):
+                head_logits, deprel_logits = self(x_forms, x_tags, pack, chars, length_per_word_per_sent)
+            y_pred_head, y_pred_deprel = head_logits.max(2)[1], deprel_logits.max(2)[1]
 
-            mask = mask.type(torch.ByteTensor)
-            if self.use_cuda:
-                mask = mask.cuda()
-
-            mask = Variable(mask)
+            mask = Helpers.eval_mask(pack, y_heads.is_cuda)
             mask[0, 0] = 0
             heads_correct = ((y_heads == y_pred_head) * mask)
             deprels_correct = ((y_deprels == y_pred_deprel) * mask)
@@ -341,11 +473,12 @@ class Parser(torch.nn.Module):
 
             if print_conll:
                 deprel_vocab = self.vocab[1]
-                deprels = [deprel_vocab.itos[i.data[0]] for i in y_pred_deprel.view(-1, 1)]
+                deprels = [deprel_vocab.itos[i] for i in y_pred_deprel.data.view(-1).tolist()]
 
-                heads_softmaxes = self(x_forms, x_tags, pack, chars, length_per_word_per_sent)[0][0]
-                heads_softmaxes = F.softmax(heads_softmaxes, dim=1)
-                json = cle.mst(heads_softmaxes.data.numpy())
+                # the arc scores of the pass above; eval mode has no dropout, so a second pass would give the same
+                heads_softmaxes = F.softmax(head_logits[0].float(), dim=1)
+                with self.profiler.probe('decode'):
+                    json = cle.mst(heads_softmaxes.data.numpy())
 
 
 #            json = cle.mst(i, pad) for i, pad in zip(self(x_forms, x_tags, pack, chars,
@@ -355,21 +488,52 @@ class Parser(torch.nn.Module):
 
         print("UAS = {}/{} = {}\nLAS = {}/{} = {}".format(uas_correct, total, uas_correct / total,
                                                           las_correct, total, las_correct / total))
+        # dev score for model selection
+        self.score = las_correct / total
+        self.scores = {'uas': uas_correct / total, 'las': las_correct / total}
+
+    @Helpers.inference
+    def predict_(self, loader):
+        '''
+        (heads, deprels) of every sentence the loader yields, in its order; heads come from the MST decoder,
+        position 0 is the root
+        '''
+        deprel_vocab = self.vocab[1]
+        predictions = []
+        for batch in loader:
+            chars, length_per_word_per_sent = None, None
+            (x_forms, pack), x_tags = batch.form, batch.upos
+            if self.use_chars:
+                (chars, _, length_per_word_per_sent) = batch.char
+
+            with Helpers.autocast(self.bf16):
+                y_pred_head, y_pred_deprel = self(x_forms, x_tags, pack, chars, length_per_word_per_sent)[:2]
+            heads_softmaxes = F.softmax(y_pred_head.float(), dim=2).data.cpu().numpy()
+            y_pred_deprel = y_pred_deprel.max(2)[1].data.cpu()
+
+            for n, length in enumerate(pack.tolist()):
+                with self.profiler.probe('decode'):
+                    heads = cle.mst(heads_softmaxes[n, :length, :length])
+                predictions.append((heads.tolist(), [deprel_vocab.itos[i] for i in y_pred_deprel[n, :length].tolist()]))
+
+        return predictions
 
 
 class CLTagger(torch.nn.Module):
     def __init__(self, args, main_sizes, aux_sizes, main_embeds, aux_embeds, embed_dim=100, lstm_dim=100, lstm_layers=2,
-                 mlp_dim=100, learning_rate=1e-5):
+                 mlp_dim=100, learning_rate=1e-5, hash_buckets=0, hash_functions=2, embed_mode='train'):
 
         super().__init__()
+        self.metrics = Telemetry.MetricsLogger()
 
         #Load pretrained embeds
-        self.embeds_main = torch.nn.Embedding(main_sizes['vocab'], embed_dim)
-        self.embeds_aux = torch.nn.Embedding(aux_sizes['vocab'], embed_dim)
-
-        if args.embed:
-            self.embeds_main.weight.data.copy_(main_embeds.vectors)
-            self.embeds_aux.weight.data.copy_(aux_embeds.vectors)
+        # with hash_buckets set, each side gets its own fixed-size table rather than one row per word of its vocab
+        self.embeds_main = form_embedding(main_embeds, embed_dim, pretrained=bool(args.embed),
+                                          hash_buckets=hash_buckets, hash_functions=hash_functions,
+                                          mode=embed_mode)
+        self.embeds_aux = form_embedding(aux_embeds, embed_dim, pretrained=bool(args.embed),
+                                         hash_buckets=hash_buckets, hash_functions=hash_functions,
+                                         mode=embed_mode)
 
         #Pass through shared then individual LSTMs
         self.lstm_shared = torch.nn.LSTM(embed_dim, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.5)
@@ -386,7 +550,7 @@ class CLTagger(torch.nn.Module):
         #Losses
         self.criterion_main = torch.nn.CrossEntropyLoss(ignore_index=-1)
         self.criterion_aux = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimizer = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
+        self.optimizer = Helpers.optimiser_for(self, learning_rate)
         self.dropout = torch.nn.Dropout(p=0.5)
 
     def forward(self, forms, pack, type_task):
@@ -429,78 +593,88 @@ class CLTagger(torch.nn.Module):
         # reduce to dim no_of_tags
         return self.out_aux(mlp_out)
 
-    def train_(self, epoch, train_loader, type_task="main"):
-
-
-        self.train()
-        train_loader.init_epoch()
+    def loss_(self, batch, type_task="main"):
+        (x_forms, pack), x_tags = batch.form, batch.upos
+        y_pred = self(x_forms, pack, type_task)
 
-        for i, batch in enumerate(train_loader):
-            (x_forms, pack), x_tags, y_heads, y_deprels = batch.form, batch.upos, batch.head, batch.deprel
+        # predictions: (B x S x T) => (B * S, T)
+        # heads: (B x S) => (B * S)
+        batch_size, longest_sentence_in_batch = x_forms.size()
+        y_pred = y_pred.view(batch_size * longest_sentence_in_batch, -1)
+        x_tags = x_tags.contiguous().view(batch_size * longest_sentence_in_batch)
 
-            mask = torch.zeros(pack.size()[0], max(pack)).type(torch.LongTensor)
-            for n, size in enumerate(pack):
-                mask[n, 0:size] = 1
+        criterion = self.criterion_aux if type_task == "aux" else self.criterion_main
+        return criterion(y_pred, x_tags), pack.tolist()
 
-            y_pred = self(x_forms, pack, type_task)
-            # reshape for cross-entropy
-            batch_size, longest_sentence_in_batch = x_forms.size()
+    def train_(self, epoch, train_loader, type_task="main"):
+        # train_loader: one task's loader, or a Scheduler interleaving both tasks
+        if not isinstance(train_loader, Scheduler):
+            train_loader = Scheduler({type_task: train_loader})
 
-            # predictions: (B x S x T) => (B * S, T)
-            # heads: (B x S) => (B * S)
-            y_pred = y_pred.view(batch_size * longest_sentence_in_batch, -1)
-            x_tags = x_tags.contiguous().view(batch_size * longest_sentence_in_batch)
+        self.train()
+        train_loader.init_epoch()
 
-            if type_task == "aux":
-                train_loss = self.criterion_aux(y_pred, x_tags)
-            else:
-                train_loss = self.criterion_main(y_pred, x_tags)
+        for step in train_loader:
+            # one batch per task on a combined step: their weighted losses share the optimiser step
+            train_loss, lengths = 0, []
+            for task, batch in step:
+                loss, pack = self.loss_(batch, task)
+                train_loss = train_loss + train_loader.weights[task] * loss
+                lengths += pack
 
             self.zero_grad()
             train_loss.backward()
             self.optimizer.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(
-                epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data))
+            self.metrics.log(epoch, train_loss, lengths)
 
+        self.metrics.end_epoch(epoch)
+
+    @Helpers.inference
     def evaluate_(self, test_loader, type_task="main"):
         correct, total = 0, 0
-        self.eval()
         for i, batch in enumerate(test_loader):
             (x_forms, pack), x_tags, y_heads, y_deprels = batch.form, batch.upos, batch.head, batch.deprel
 
-            mask = torch.zeros(pack.size()[0], max(pack)).type(torch.LongTensor)
-            for n, size in enumerate(pack):
-                mask[n, 0:size] = 1
-
-                # get tags
+            # get tags
             y_pred = self(x_forms, pack, type_task).max(2)[1]
-            mask = Variable(mask.type(torch.ByteTensor))
+            mask = Helpers.eval_mask(pack, x_tags.is_cuda)
 
             correct += ((x_tags == y_pred) * mask).nonzero().size(0)
 
             total += mask.nonzero().size(0)
 
         print("Accuracy = {}/{} = {}".format(correct, total, (correct / total)))
+        # dev score for model selection
+        self.score = correct / total
+        self.scores = {'accuracy': correct / total}
 
 
-class TagAndParse(torch.nn.Module):
+class TagAndParse(torch.nn.Module, AuxHeads):
     def __init__(self, sizes, args, vocab, embeddings=None, embed_dim=100, lstm_dim=400, lstm_layers=3,
-                 reduce_dim_arc=100, reduce_dim_label=100, learning_rate=1e-3):
+                 reduce_dim_arc=100, reduce_dim_label=100, learning_rate=1e-3, token_budget=0, effective_batch_size=0,
+                 bf16=False, hash_buckets=0, hash_functions=2, embed_mode='train'):
         super().__init__()
 
         self.use_cuda = args.use_cuda
+        self.bf16 = bf16
+        # swapped for a Profiler.Profiler to time the stages of forward
+        self.profiler = Profiler.NULL
+        self.metrics = Telemetry.MetricsLogger()
         self.use_chars = args.use_chars
         self.save = args.save
+        # 0 = no limit / step after every batch
+        self.token_budget = token_budget
+        self.effective_batch_size = effective_batch_size
         self.vocab = vocab
-        # for writer
-        self.test_file = args.test[0]
+        # for writer; --test is a list for the multilingual model, and Pipeline/predict may not have one
+        self.test_file = args.test[0] if isinstance(args.test, list) else args.test
 
         # for tagger
-        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], embed_dim)
-        if args.embed:
-            self.embeddings_forms.weight.data.copy_(embeddings.vectors)
-            # self.embeddings_forms.weight.requires_grad = False
+        embeddings = vocab[0] if embeddings is None else embeddings
+        self.embeddings_forms = form_embedding(embeddings, embed_dim, pretrained=bool(args.embed),
+                                               hash_buckets=hash_buckets, hash_functions=hash_functions,
+                                               mode=embed_mode)
 
         # self.embeddings_forms_random = torch.nn.Embedding(sizes['vocab'], embed_dim)
         self.tag_lstm = torch.nn.LSTM(embed_dim, 150, lstm_layers - 2, batch_first=True, bidirectional=True, dropout=0.33)
@@ -523,60 +697,114 @@ class TagAndParse(torch.nn.Module):
         self.biaffine = ShorterBiaffine(reduce_dim_arc)
         self.label_biaffine = LongerBiaffine(reduce_dim_label, reduce_dim_label, sizes['deprels'])
         self.criterion = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        params = filter(lambda p: p.requires_grad, self.parameters())
-        self.optimiser = torch.optim.Adam(params, lr=learning_rate, betas=(0.9, 0.9))
+        self.optimiser = Helpers.optimiser_for(self, learning_rate)
 
         if self.use_cuda:
             self.biaffine.cuda()
             self.label_biaffine.cuda()
 
-    def forward(self, forms, tags, pack, chars, char_pack):
-        form_embeds = F.dropout(self.embeddings_forms(forms), p=0.33, training=self.training)
-        # form_embeds_random = F.dropout(self.embeddings_forms_random(forms), p=0.33, training=self.training)
+    def forward(self, forms, tags, pack, chars, char_pack, aux=False):
+        # aux: also return {name: logits} of the aux heads, off the same lstm output
+        with self.profiler.probe('embed'):
+            form_embeds = F.dropout(self.embeddings_forms(forms), p=0.33, training=self.training)
+            # form_embeds_random = F.dropout(self.embeddings_forms_random(forms), p=0.33, training=self.training)
 
-        if self.use_chars:
-            form_embeds += F.dropout(self.embeddings_chars(chars, char_pack), p=0.33, training=self.training)
+            if self.use_chars:
+                form_embeds += F.dropout(self.embeddings_chars(chars, char_pack), p=0.33, training=self.training)
 
         # tag
-        packed_form = torch.nn.utils.rnn.pack_padded_sequence(form_embeds, pack.tolist(), batch_first=True)
-        out_tag_lstm, _ = self.tag_lstm(packed_form)
-        out_tag_lstm, _ = torch.nn.utils.rnn.pad_packed_sequence(out_tag_lstm, batch_first=True)
-        out_tag_mlp = F.dropout(self.relu(self.tag_mlp(out_tag_lstm)), p=0.33, training=self.training)
-        y_pred_postag = self.tag_out(out_tag_mlp)
-
-        embeds = torch.cat([form_embeds, out_tag_lstm, y_pred_postag], dim=2)
+        with self.profiler.probe('tag'):
+            packed_form = torch.nn.utils.rnn.pack_padded_sequence(form_embeds, pack.tolist(), batch_first=True)
+            out_tag_lstm, _ = self.tag_lstm(packed_form)
+            out_tag_lstm, _ = torch.nn.utils.rnn.pad_packed_sequence(out_tag_lstm, batch_first=True)
+            out_tag_mlp = F.dropout(self.relu(self.tag_mlp(out_tag_lstm)), p=0.33, training=self.training)
+            y_pred_postag = self.tag_out(out_tag_mlp)
 
         # pack/unpack for LSTM
-        embeds = torch.nn.utils.rnn.pack_padded_sequence(embeds, pack.tolist(), batch_first=True)
-        output, _ = self.lstm(embeds)
-        output, _ = torch.nn.utils.rnn.pad_packed_sequence(output, batch_first=True)
+        with self.profiler.probe('lstm'):
+            embeds = torch.cat([form_embeds, out_tag_lstm, y_pred_postag], dim=2)
+            embeds = torch.nn.utils.rnn.pack_padded_sequence(embeds, pack.tolist(), batch_first=True)
+            output, _ = self.lstm(embeds)
+            output, _ = torch.nn.utils.rnn.pad_packed_sequence(output, batch_first=True)
 
         # predict heads
-        reduced_head_head = F.dropout(self.relu(self.mlp_head(output)), p=0.33, training=self.training)
-        reduced_head_dep = F.dropout(self.relu(self.mlp_dep(output)), p=0.33, training=self.training)
-        y_pred_head = self.biaffine(reduced_head_head, reduced_head_dep)
+        with self.profiler.probe('arc_mlp'):
+            reduced_head_head = F.dropout(self.relu(self.mlp_head(output)), p=0.33, training=self.training)
+            reduced_head_dep = F.dropout(self.relu(self.mlp_dep(output)), p=0.33, training=self.training)
+        with self.profiler.probe('arc_biaffine'):
+            y_pred_head = self.biaffine(reduced_head_head, reduced_head_dep)
 
         # predict deprels using heads
-        reduced_deprel_head = F.dropout(self.relu(self.mlp_deprel_head(output)), p=0.33, training=self.training)
-        reduced_deprel_dep = F.dropout(self.relu(self.mlp_deprel_dep(output)), p=0.33, training=self.training)
-        predicted_labels = y_pred_head.max(2)[1]
-        selected_heads = torch.stack([torch.index_select(reduced_deprel_head[n], 0, predicted_labels[n])
-                                        for n, _ in enumerate(predicted_labels)])
-        y_pred_label = self.label_biaffine(selected_heads, reduced_deprel_dep)
-        y_pred_label = Helpers.extract_best_label_logits(predicted_labels, y_pred_label, pack)
+        with self.profiler.probe('label_mlp'):
+            reduced_deprel_head = F.dropout(self.relu(self.mlp_deprel_head(output)), p=0.33, training=self.training)
+            reduced_deprel_dep = F.dropout(self.relu(self.mlp_deprel_dep(output)), p=0.33, training=self.training)
+        with self.profiler.probe('label_select'):
+            predicted_labels = y_pred_head.max(2)[1]
+            selected_heads = torch.stack([torch.index_select(reduced_deprel_head[n], 0, predicted_labels[n])
+                                            for n, _ in enumerate(predicted_labels)])
+        with self.profiler.probe('label_biaffine'):
+            y_pred_label = self.label_biaffine(selected_heads, reduced_deprel_dep)
+        with self.profiler.probe('label_extract'):
+            y_pred_label = Helpers.extract_best_label_logits(predicted_labels, y_pred_label, pack)
         if self.use_cuda:
             y_pred_label = y_pred_label.cuda()
 
+        if aux:
+            return y_pred_head, y_pred_label, y_pred_postag, self.aux_outputs(output)
         return y_pred_head, y_pred_label, y_pred_postag
 
+    def loss_(self, x_forms, x_tags, pack, chars, length_per_word_per_sent, y_heads, y_deprels, aux_gold=()):
+        # aux_gold: the aux heads' gold labels, as from aux_gold(batch)
+        with Helpers.autocast(self.bf16):
+            y_pred_head, y_pred_deprel, y_pred_postags, *y_pred_aux = self(x_forms, x_tags, pack, chars,
+                                                                           length_per_word_per_sent,
+                                                                           aux=bool(self.aux_heads))
+        # loss stays in fp32
+        y_pred_head, y_pred_deprel, y_pred_postags = y_pred_head.float(), y_pred_deprel.float(), y_pred_postags.float()
+
+        # reshape for cross-entropy
+        batch_size, longest_sentence_in_batch = y_heads.size()
+
+        # predictions: (B x S x S) => (B * S x S)
+        # heads: (B x S) => (B * S)
+        y_pred_head = y_pred_head.view(batch_size * longest_sentence_in_batch, -1)
+        y_heads = y_heads.contiguous().view(batch_size * longest_sentence_in_batch)
+
+        # predictions: (B x S x D) => (B * S x D)
+        # heads: (B x S) => (B * S)
+        y_pred_deprel = y_pred_deprel.view(batch_size * longest_sentence_in_batch, -1)
+        y_deprels = y_deprels.contiguous().view(batch_size * longest_sentence_in_batch)
+
+        # same for tags
+        y_pred_postags = y_pred_postags.view(batch_size * longest_sentence_in_batch, -1)
+        y_tags = x_tags.contiguous().view(batch_size * longest_sentence_in_batch)
+
+        # sum losses
+        loss = self.criterion(y_pred_head, y_heads) + self.criterion(y_pred_deprel, y_deprels) + 0.75 * self.criterion(y_pred_postags, y_tags)
+        if y_pred_aux:
+            loss = loss + self.aux_loss(y_pred_aux[0], aux_gold)
+        return loss
+
+    def step_(self, tokens):
+        # gradients were summed over token-weighted micro-batches: turn them back into a token mean
+        Helpers.scale_gradients(self, 1 / tokens)
+        Distributed.average_gradients(self)
+        self.optimiser.step()
+        self.zero_grad()
+
     '''
     1. the bare minimum that needs to be loaded is forms, upos, head, deprel (could change later); load those
     2. initialise everything else to none; load it if necessary based on command line args
     3. pass everything, whether it's been loaded or not, to the forward function; if it's unnecessary it won't use it
+    4. each batch is split into micro-batches of at most token_budget padded tokens; the optimiser steps once
+       effective_batch_size sentences have been accumulated
     '''
     def train_(self, epoch, train_loader):
         self.train()
         train_loader.init_epoch()
+        self.zero_grad()
+        # sentences and tokens accumulated since the last step
+        sentences, tokens = 0, 0
 
         for i, batch in enumerate(train_loader):
             chars, length_per_word_per_sent = None, None
@@ -586,41 +814,41 @@ class TagAndParse(torch.nn.Module):
             if self.use_chars:
                 (chars, _, length_per_word_per_sent) = batch.char
 
-            y_pred_head, y_pred_deprel, y_pred_postags = self(x_forms, x_tags, pack, chars, length_per_word_per_sent)
-
-            # reshape for cross-entropy
-            batch_size, longest_sentence_in_batch = y_heads.size()
-
-            # predictions: (B x S x S) => (B * S x S)
-            # heads: (B x S) => (B * S)
-            y_pred_head = y_pred_head.view(batch_size * longest_sentence_in_batch, -1)
-            y_heads = y_heads.contiguous().view(batch_size * longest_sentence_in_batch)
-
-            # predictions: (B x S x D) => (B * S x D)
-            # heads: (B x S) => (B * S)
-            y_pred_deprel = y_pred_deprel.view(batch_size * longest_sentence_in_batch, -1)
-            y_deprels = y_deprels.contiguous().view(batch_size * longest_sentence_in_batch)
-
-            # same for tags
-            y_pred_postags = y_pred_postags.view(batch_size * longest_sentence_in_batch, -1)
-            y_tags = x_tags.contiguous().view(batch_size * longest_sentence_in_batch)
-
-            # sum losses
-            train_loss = self.criterion(y_pred_head, y_heads) + self.criterion(y_pred_deprel, y_deprels) + 0.75 * self.criterion(y_pred_postags, y_tags)
-
-            self.zero_grad()
-            train_loss.backward()
-            self.optimiser.step()
-
-            print("Epoch: {}\t{}/{}\tloss: {}".format(epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
-
-        if self.save:
+            batch_loss = 0
+            for start, end in Helpers.micro_batches(pack, self.token_budget):
+                micro_pack = pack[start:end]
+                micro_tokens = int(micro_pack.sum())
+                micro = Helpers.slice_batch([x_forms, x_tags, chars, length_per_word_per_sent, y_heads, y_deprels] +
+                                            self.aux_gold(batch), start, end, int(pack[start]))
+                m_forms, m_tags, m_chars, m_char_pack, m_heads, m_deprels = micro[:6]
+
+                train_loss = self.loss_(m_forms, m_tags, micro_pack, m_chars, m_char_pack, m_heads, m_deprels,
+                                        micro[6:])
+                (train_loss * micro_tokens).backward()
+                tokens += micro_tokens
+                # stays on the device; the logger reads it back off the training thread
+                batch_loss = batch_loss + train_loss.data * micro_tokens
+
+            sentences += len(x_forms)
+            if sentences >= self.effective_batch_size:
+                self.step_(tokens)
+                sentences, tokens = 0, 0
+
+            lengths = pack.tolist()
+            self.metrics.log(epoch, batch_loss / sum(lengths), lengths)
+
+        # leftovers at the end of the epoch
+        if sentences:
+            self.step_(tokens)
+        self.metrics.end_epoch(epoch)
+
+        if self.save and Distributed.is_master():
             with open(self.save[0], "wb") as f:
                 torch.save(self.state_dict(), f)
 
+    @Helpers.inference
     def evaluate_(self, test_loader, print_conll=False):
         las_correct, uas_correct, total = 0, 0, 0
-        self.eval()
         for i, batch in enumerate(test_loader):
             chars, length_per_word_per_sent = None, None
             (x_forms, pack), x_tags, y_heads, y_deprels = batch.form, batch.upos, batch.head, batch.deprel
@@ -629,20 +857,13 @@ class TagAndParse(torch.nn.Module):
             if self.use_chars:
                 (chars, _, length_per_word_per_sent) = batch.char
 
-            mask = torch.zeros(pack.size()[0], max(pack)).type(torch.LongTensor)
-            for n, size in enumerate(pack):
-                mask[n, 0:size] = 1
-
             # get labels
             # TODO: ensure well-formed tree
-            y_pred_head, y_pred_deprel, y_pred_postags = [i.max(2)[1] for i in
-                                          self(x_forms, x_tags, pack, chars, length_per_word_per_sent)]
+            with Helpers.autocast(self.bf16):
+                head_logits, deprel_logits, _ = self(x_forms, x_tags, pack, chars, length_per_word_per_sent)
+            y_pred_head, y_pred_deprel = head_logits.max(2)[1], deprel_logits.max(2)[1]
 
-            mask = mask.type(torch.ByteTensor)
-            if self.use_cuda:
-                mask = mask.cuda()
-
-            mask = Variable(mask)
+            mask = Helpers.eval_mask(pack, y_heads.is_cuda)
             mask[:, 0] = 0
             heads_correct = ((y_heads == y_pred_head) * mask)
             deprels_correct = ((y_deprels == y_pred_deprel) * mask)
@@ -662,11 +883,12 @@ class TagAndParse(torch.nn.Module):
 
             if print_conll:
                 deprel_vocab = self.vocab[1]
-                deprels = [deprel_vocab.itos[i.data[0]] for i in y_pred_deprel.view(-1, 1)]
+                deprels = [deprel_vocab.itos[i] for i in y_pred_deprel.data.view(-1).tolist()]
 
-                heads_softmaxes = self(x_forms, x_tags, pack, chars, length_per_word_per_sent)[0][0]
-                heads_softmaxes = F.softmax(heads_softmaxes, dim=1)
-                json = cle.mst(heads_softmaxes.data.numpy())
+                # the arc scores of the pass above; eval mode has no dropout, so a second pass would give the same
+                heads_softmaxes = F.softmax(head_logits[0].float(), dim=1)
+                with self.profiler.probe('decode'):
+                    json = cle.mst(heads_softmaxes.data.numpy())
 
 
 #            json = cle.mst(i, pad) for i, pad in zip(self(x_forms, x_tags, pack, chars,
@@ -676,4 +898,116 @@ class TagAndParse(torch.nn.Module):
 
         print("UAS = {}/{} = {}\nLAS = {}/{} = {}".format(uas_correct, total, uas_correct / total,
                                                           las_correct, total, las_correct / total))
+        # dev score for model selection
+        self.score = las_correct / total
+        self.scores = {'uas': uas_correct / total, 'las': las_correct / total}
+
+
+
+class Segmenter(torch.nn.Module):
+    '''
+    sentence boundaries in running text: tags every word of a window (Loader.seg_iterators) with its SWITCH,
+    '1' on the last word of a sentence
+    '''
+    def __init__(self, sizes, args, vocab, embed_dim=100, lstm_dim=100, lstm_layers=2, learning_rate=1e-3, bf16=False):
+        super().__init__()
+        self.use_cuda = args.use_cuda
+        self.bf16 = bf16
+        # swapped for a Profiler.Profiler to time the stages of forward
+        self.profiler = Profiler.NULL
+        self.metrics = Telemetry.MetricsLogger()
+        self.save = args.save
+        self.vocab = vocab
+        self.word_pad = vocab[0].stoi['<pad>']
+        self.boundary = vocab[1].stoi['1']
+
+        self.embeds = torch.nn.Embedding(sizes['vocab'], embed_dim)
+        self.lstm = torch.nn.LSTM(embed_dim, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.33)
+        self.out = torch.nn.Linear(2 * lstm_dim, sizes['states'])
+        self.dropout = torch.nn.Dropout(p=0.33)
+        self.criterion = torch.nn.CrossEntropyLoss(ignore_index=vocab[1].stoi['<pad>'])
+        self.optimiser = Helpers.optimiser_for(self, learning_rate)
+
+    def forward(self, words):
+        # windows are cut from running text and all but the last are full, so no packing
+        with self.profiler.probe('embed'):
+            embeds = self.dropout(self.embeds(words))
+        with self.profiler.probe('lstm'):
+            lstm_out, _ = self.lstm(embeds)
+        with self.profiler.probe('out'):
+            return self.out(self.dropout(lstm_out))
+
+    def lengths(self, words):
+        return (words.data != self.word_pad).long().sum(1).view(-1).tolist()
+
+    def train_(self, epoch, train_loader):
+        self.train()
+        train_loader.init_epoch()
+
+        for i, batch in enumerate(train_loader):
+            words, switches = batch.word, batch.switch
+            with Helpers.autocast(self.bf16):
+                y_pred = self(words)
+
+            # loss stays in fp32
+            y_pred = y_pred.float().view(-1, y_pred.size(2))
+            train_loss = self.criterion(y_pred, switches.contiguous().view(-1))
+
+            self.zero_grad()
+            train_loss.backward()
+            Distributed.average_gradients(self)
+            self.optimiser.step()
+
+            self.metrics.log(epoch, train_loss, self.lengths(words))
+
+        self.metrics.end_epoch(epoch)
+        if self.save and Distributed.is_master():
+            if not os.path.exists(self.save):
+                os.makedirs(self.save)
+            with open(os.path.join(self.save, 'segmenter.pt'), "wb") as f:
+                torch.save(self.state_dict(), f)
+
+    @Helpers.inference
+    def evaluate_(self, test_loader):
+        # precision/recall/F1 of the sentence ends
+        predicted, gold, correct = 0, 0, 0
+        for batch in test_loader:
+            with Helpers.autocast(self.bf16):
+                y_pred = self(batch.word).max(2)[1]
+
+            # the words of each window only, not its <w> column or the padding after it
+            words = batch.word.data != self.word_pad
+            words[:, 0] = 0
+            predicted_ends = (y_pred.data == self.boundary) & words
+            gold_ends = (batch.switch.data == self.boundary) & words
+            predicted += int(predicted_ends.sum())
+            gold += int(gold_ends.sum())
+            correct += int((predicted_ends & gold_ends).sum())
+
+        precision, recall = correct / max(predicted, 1), correct / max(gold, 1)
+        f1 = 2 * precision * recall / max(precision + recall, 1e-12)
+        print("Sentence ends: P = {:.4f} R = {:.4f} F1 = {:.4f}".format(precision, recall, f1))
+        # dev score for model selection
+        self.score = f1
+        self.scores = {'precision': precision, 'recall': recall, 'f1': f1}
+
+    @Helpers.inference
+    def ends(self, windows):
+        '''
+        windows: lists of words; returns, for each, a list of booleans marking the words that end a sentence
+        '''
+        stoi = self.vocab[0].stoi
+        # .get: stoi is a defaultdict, indexing it with an unseen word would add that word to it for good
+        unk = stoi['<unk>']
+        longest = max(len(window) for window in windows) + 1
+        ids = [[stoi['<w>']] + [stoi.get(word, unk) for word in window] for window in windows]
+        ids = torch.LongTensor([row + [self.word_pad] * (longest - len(row)) for row in ids])
+        if self.use_cuda:
+            ids = ids.cuda()
+
+        with Helpers.autocast(self.bf16):
+            y_pred = self(Variable(ids)).max(2)[1].data.cpu()
 
+        # column 0 is the <w> init token
+        return [[bool(y_pred[n, k + 1] == self.boundary) for k in range(len(window))]
+                for n, window in enumerate(windows)]
@@ -1,161 +1,398 @@
+'''
+    python Runner.py train --parse --train T --dev D --test E
+    python Runner.py eval --parse --load parser.pt --train T --test E
+    python Runner.py predict --tagger tagger.pt --parser parser.pt --train T --test E > parsed.conllu
+    python Runner.py tokenise --train T --dev D --test E [--load segmenter.pt --raw text.txt]
+    python Runner.py bench throughput --synthetic 500
+
+every subcommand imports only what it runs and builds only the iterators it reads; --train is always read, the
+vocabs come from it
+'''
+import os
 import sys
-import torch
 import argparse
-import configparser
-import Loader
-from Runnables import Tagger, Parser, CLTagger, TagAndParse, Analyser
+import Config
 
 
-if __name__ == '__main__':
-    TAG_PARAMS, PARSE_PARAMS = {}, {}
-
-    arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument('--tokenise', action='store_true')
-    arg_parser.add_argument('--tag', action='store_true')
-    arg_parser.add_argument('--parse', action='store_true')
-    arg_parser.add_argument('--morph', action='store_true')
-    arg_parser.add_argument('--config', default='./config.ini')
-    arg_parser.add_argument('--save', action='store')
-    arg_parser.add_argument('--load', action='store')
-    arg_parser.add_argument('--train', action='store')
-    arg_parser.add_argument('--dev', action='store')
-    arg_parser.add_argument('--test', action='store')
-    arg_parser.add_argument('--embed', action='store')
-    arg_parser.add_argument('--use_chars', action='store_true')
-    arg_parser.add_argument('--use_cuda', action='store_true')
+def parse_options(config):
+    # the Parser/TagAndParse keyword arguments past the dims: gradient accumulation
+    return dict(token_budget=int(config['parser'].get('TOKEN_BUDGET', 0)),
+                effective_batch_size=int(config['parser'].get('EFFECTIVE_BATCH_SIZE', 0)))
+
+
+def build(args, config, sizes, vocab):
+    '''
+    the runnable the model flags ask for; with --tag and --parse, the tagger
+    '''
+    from Runnables import Tagger, Parser, Analyser
+
+    bf16, _ = Config.runtime(config)
+    embed = Config.embed_params(config)
+    if args.tag:
+        return Tagger(sizes, args, vocab, chain=args.parse, embeddings=None, bf16=bf16,
+                      **Config.tagger_params(config['tagger']), **embed)
+    elif args.parse:
+        return Parser(sizes, args, vocab, embeddings=vocab, bf16=bf16, **Config.parser_params(config['parser']),
+                      **parse_options(config), **embed)
+    return Analyser(sizes, args, vocab, bf16=bf16, **embed)
+
+
+def instrument(runnable, args, config, name, profile=None):
+    import Profiler
+    import Telemetry
+
+    _, log_interval = Config.runtime(config)
+    if args.use_cuda:
+        runnable.cuda()
+    if profile:
+        runnable.profiler = Profiler.Profiler(profile, sync=args.use_cuda)
+    runnable.metrics = Telemetry.MetricsLogger(args.metrics, log_interval, name=name)
+    return runnable
+
+
+def load(runnable, path, vocab):
+    '''
+    a state dict saved by train or Prune.py into runnable, fitted to this run's vocab; Pipeline.py loads with it too
+    '''
+    import Prune
+    import Checkpoint
+    import Pretrained
+
+    state_dict = Checkpoint.load_model(path)
+    # a Prune.py bundle carries the shrunken dims along with the weights
+    state_dict = Prune.load_state(runnable, state_dict)
+    # the rows for dev/test-only words depend on this run's files, not the ones the model was trained with
+    if hasattr(vocab[0], 'train_size'):
+        state_dict = Pretrained.fit_state_dict(runnable, state_dict, vocab[0])
+    runnable.load_state_dict(state_dict)
+
+
+# ========
+# commands
+# ========
+def train(args, config):
+    if args.treebanks:
+        return train_multiling(args, config)
+    elif args.cl_tagger:
+        return train_cl_tagger(args, config)
+
+    import Loader
+    import Trainer
+    import Augment
+
+    augment = Config.augment_params(config)
+    if augment:
+        augment = Augment.CodeSwitch.from_file(augment.pop('path'), **augment)
+    (train_loader, dev_loader, test_loader), sizes, vocab = Loader.get_iterators(
+        args, int(config['parser']['BATCH_SIZE']), augment=augment, **Config.vocab_params(config))
+
+    if args.tag and args.parse:
+        return train_tag_then_parse(args, config, (train_loader, dev_loader, test_loader), sizes, vocab)
+
+    runnable = build(args, config, sizes, vocab)
+    instrument(runnable, args, config, type(runnable).__name__.lower(), args.profile)
+
+    print("Training")
+    section = config['parser' if args.parse else 'tagger']
+    Trainer.fit(runnable, train_loader, dev_loader, int(section['EPOCHS']), workers=args.workers,
+                checkpoint=args.checkpoint, resume=args.resume, patience=int(section.get('PATIENCE', 0)),
+                async_eval=args.async_eval)
+
+    print("Eval")
+    runnable.evaluate_(test_loader, print_conll=True)
+
+
+def train_tag_then_parse(args, config, loaders, sizes, vocab):
+    import Trainer
+    from Runnables import Parser
+
+    train_loader, dev_loader, test_loader = loaders
+    bf16, _ = Config.runtime(config)
+
+    def resume(half):
+        # --resume is the --checkpoint directory of the interrupted run; each half carries on from its own
+        # checkpoint.pt there, if it got that far
+        path = args.resume and os.path.join(args.resume, half, 'checkpoint.pt')
+        return path if path and os.path.exists(path) else None
+
+    runnable = build(args, config, sizes, vocab)
+    instrument(runnable, args, config, 'tagger', args.profile and os.path.join(args.profile, 'tagger'))
+
+    print("Training tagger")
+    Trainer.fit(runnable, train_loader, dev_loader, int(config['tagger']['EPOCHS']), workers=args.workers,
+                checkpoint=args.checkpoint and os.path.join(args.checkpoint, 'tagger'), resume=resume('tagger'),
+                patience=int(config['tagger'].get('PATIENCE', 0)), async_eval=args.async_eval)
+
+    # test
+    print("Evaluating tagger")
+    tag_tensors = runnable.evaluate_(test_loader, print_conll=True)
+    test_loader.data().upos = (i for i in tag_tensors)
+
+    runnable = Parser(sizes, args, vocab, embeddings=vocab, bf16=bf16, **Config.parser_params(config['parser']),
+                      **parse_options(config), **Config.embed_params(config))
+    instrument(runnable, args, config, 'parser', args.profile and os.path.join(args.profile, 'parser'))
+
+    print("Training parser")
+    Trainer.fit(runnable, train_loader, dev_loader, int(config['parser']['EPOCHS']), workers=args.workers,
+                checkpoint=args.checkpoint and os.path.join(args.checkpoint, 'parser'), resume=resume('parser'),
+                patience=int(config['parser'].get('PATIENCE', 0)), async_eval=args.async_eval)
+
+    # test
+    print("Evaluating parser")
+    runnable.evaluate_(test_loader, print_conll=True)
+
+
+def train_cl_tagger(args, config):
+    import Loader
+    import Trainer
+    from Scheduler import Scheduler
+    from Runnables import CLTagger
+
+    batch_size = int(config['parser']['BATCH_SIZE'])
+    vocab_params = Config.vocab_params(config)
+    main = Loader.task_iterators(args, (args.train, args.dev, args.test), batch_size, **vocab_params)
+    aux = Loader.task_iterators(args, args.aux, batch_size, **vocab_params)
+
+    runnable = CLTagger(args, main['sizes'], aux['sizes'], main['vocab'], aux['vocab'], **Config.embed_params(config))
+    instrument(runnable, args, config, 'cl_tagger')
+
+    # batches of both tasks interleaved through the epoch, not an epoch of one and then of the other
+    scheduler = Scheduler({'main': main['train'], 'aux': aux['train']}, **Config.multitask_params(config))
+    Trainer.fit(runnable, scheduler, main['dev'], int(config['parser']['EPOCHS']),
+                patience=int(config['parser'].get('PATIENCE', 0)), async_eval=args.async_eval)
+
+
+def train_multiling(args, config):
+    import Loader
+    import Trainer
+    from Runnables import TagAndParse
+
+    # one model, one vocab, one pass over batches drawn from every treebank
+    (train_loader, dev_loader, test_loader), sizes, vocab = \
+        Loader.multi_iterators(args, args.treebanks, int(config['parser']['BATCH_SIZE']),
+                               **Config.multiling_params(config), **Config.vocab_params(config))
+    print("Treebanks: {}".format(", ".join(train_loader.langs)))
+    # the conllu writer reads its file off args.test
+    args.test = [Loader.treebank_files(directory)[3] for directory in args.treebanks]
+
+    bf16, _ = Config.runtime(config)
+    runnable = TagAndParse(sizes, args, vocab, embeddings=vocab[0], bf16=bf16, **Config.parser_params(config['parser']),
+                           **parse_options(config), **Config.embed_params(config))
+    instrument(runnable, args, config, 'multiling')
+
+    print("Training")
+    Trainer.fit(runnable, train_loader, dev_loader, int(config['parser']['EPOCHS']),
+                patience=int(config['parser'].get('PATIENCE', 0)), async_eval=args.async_eval)
+
+    print("Eval")
+    runnable.evaluate_(test_loader)
+
+
+def evaluate(args, config):
+    import Loader
+
+    (_, _, test_loader), sizes, vocab = Loader.get_iterators(args, int(config['parser']['BATCH_SIZE']),
+                                                             splits=['test'], **Config.vocab_params(config))
+    runnable = build(args, config, sizes, vocab)
+    instrument(runnable, args, config, type(runnable).__name__.lower(), args.profile)
+
+    print("Loading")
+    load(runnable, args.load, vocab)
+
+    print("Eval")
+    runnable.evaluate_(test_loader, print_conll=True)
+
+
+def predict(args, config):
+    '''
+    --test with the UPOS column from --tagger and/or HEAD and DEPREL from --parser, as CoNLL-U on stdout
+    '''
+    import itertools
+    import Loader
+    import Pipeline
+    import Tokenise
+    from Runnables import Tagger, Parser
+
+    batch_size = int(config['parser']['BATCH_SIZE'])
+    (train_loader, _, _), sizes, vocab = Loader.get_iterators(args, batch_size, splits=['train'],
+                                                              **Config.vocab_params(config))
+    fields = train_loader.dataset.fields
+    embed = Config.embed_params(config)
+
+    stages = []
+    if args.tagger:
+        tagger = Tagger(sizes, args, vocab, **Config.tagger_params(config['tagger']), **embed)
+        load(tagger, args.tagger, vocab)
+        stages.append((Pipeline.tag, tagger))
+    if args.parser:
+        parser = Parser(sizes, args, vocab, embeddings=vocab, **Config.parser_params(config['parser']), **embed)
+        load(parser, args.parser, vocab)
+        stages.append((Pipeline.parse, parser))
+
+    # the vocab only has the train words: the others get their pretrained vectors as they turn up
+    store = None
+    if args.embed:
+        import Pretrained
+        store = Pretrained.PretrainedStore(args.embed)
+
+    # words only: multiword ranges and empty nodes get no tags or heads
+    sentences = ([row for row in rows if row[0].isdigit()] for rows in Loader.read_conllu(args.test))
+    n = 0
+    while True:
+        chunk = list(itertools.islice(sentences, args.chunk_size))
+        if not chunk:
+            break
+        for fn, runnable in stages:
+            chunk = fn(runnable, fields, chunk, batch_size, store)
+        for rows in chunk:
+            n += 1
+            sys.stdout.write(Tokenise.to_conllu(rows, sent_id=n))
+
+
+def tokenise(args, config):
+    import Loader
+    import Trainer
+    import Tokenise
+    from Runnables import Segmenter
+
+    window = int(config['segmenter'].get('WINDOW', 50)) if config.has_section('segmenter') else 50
+    batch_size = int(config['parser']['BATCH_SIZE'])
+    # segmenting raw text with a trained model needs no iterators, only the vocabs
+    splits = [] if args.load and args.raw else ['test'] if args.load else ['train', 'dev', 'test']
+    (train_loader, dev_loader, test_loader), sizes, vocab = Loader.seg_iterators(args, batch_size, window, splits)
+
+    bf16, _ = Config.runtime(config)
+    runnable = Segmenter(sizes, args, vocab, bf16=bf16, **Config.segmenter_params(config))
+    instrument(runnable, args, config, 'segmenter')
+
+    if args.load:
+        import torch
+        with open(args.load, "rb") as f:
+            runnable.load_state_dict(torch.load(f, map_location=lambda storage, loc: storage))
+    else:
+        print("Training segmenter")
+        epochs = int(config['segmenter'].get('EPOCHS', 10)) if config.has_section('segmenter') else 10
+        Trainer.fit(runnable, train_loader, dev_loader, epochs, workers=args.workers, checkpoint=args.checkpoint,
+                    resume=args.resume, patience=int(config['tagger'].get('PATIENCE', 0)),
+                    async_eval=args.async_eval)
+
+    if args.raw:
+        with open(args.raw, encoding='utf-8') as f:
+            for n, tokens in enumerate(Tokenise.sentences(runnable, f, window, batch_size), 1):
+                sys.stdout.write(Tokenise.to_conllu(Tokenise.to_rows(tokens), sent_id=n))
+    else:
+        runnable.evaluate_(test_loader)
+
+
+def bench(args, config):
+    import Benchmark
+    Benchmark.main(args.rest)
+
+
+# ===
+# CLI
+# ===
+def arg_parser():
+    # what Loader and the runnables read off args
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', default='./config.ini')
+    common.add_argument('--train', action='store')
+    common.add_argument('--dev', action='store')
+    common.add_argument('--test', action='store')
+    common.add_argument('--embed', action='store')
+    common.add_argument('--use_chars', action='store_true')
+    common.add_argument('--use_cuda', action='store_true')
+    common.add_argument('--semtag', action='store_true')
+    common.add_argument('--save', action='store')
+    # training metrics as JSON lines
+    common.add_argument('--metrics', action='store')
+
+    models = argparse.ArgumentParser(add_help=False)
+    models.add_argument('--tag', action='store_true')
+    models.add_argument('--parse', action='store_true')
+    models.add_argument('--morph', action='store_true')
+    # per-stage timings of the forward pass, written to this directory
+    models.add_argument('--profile', action='store')
+
+    training = argparse.ArgumentParser(add_help=False)
+    # data-parallel cpu training over local processes
+    training.add_argument('--workers', type=int, default=1)
+    training.add_argument('--checkpoint', action='store')
+    training.add_argument('--resume', action='store',
+                          help="checkpoint.pt to carry on from; with --tag --parse, the --checkpoint directory")
+    # dev evaluation in a separate process, on snapshots of the weights, while training carries on
+    training.add_argument('--async_eval', action='store_true')
+
+    parser = argparse.ArgumentParser(description="train, evaluate and run the tagger, parser and segmenter")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('train', parents=[common, models, training], help="train and evaluate on --test")
     # aux tasks
-    arg_parser.add_argument('--semtag', action='store_true')
-    arg_parser.add_argument('--cl_tagger', action='store_true')
-    args = arg_parser.parse_args()
+    command.add_argument('--cl_tagger', action='store_true')
+    command.add_argument('--aux', nargs=3, metavar=('TRAIN', 'DEV', 'TEST'), help="the --cl_tagger aux treebank")
+    # polyglot: several UD treebank directories, trained as one
+    command.add_argument('--treebanks', nargs='+')
+    command.set_defaults(run=train)
+
+    command = commands.add_parser('eval', parents=[common, models], help="score a trained model on --test")
+    command.add_argument('--load', action='store', required=True)
+    command.set_defaults(run=evaluate)
+
+    command = commands.add_parser('predict', parents=[common], help="tag and/or parse --test, CoNLL-U to stdout")
+    command.add_argument('--tagger', action='store', help="state dict from train --tag")
+    command.add_argument('--parser', action='store', help="state dict from train --parse (or a Prune.py bundle)")
+    command.add_argument('--chunk_size', type=int, default=256, help="sentences batched at a time")
+    command.set_defaults(run=predict)
+
+    command = commands.add_parser('tokenise', parents=[common, training], help="train or run the segmenter")
+    command.add_argument('--load', action='store')
+    # raw text to segment with a trained model (--load); CoNLL-U goes to stdout
+    command.add_argument('--raw', action='store')
+    command.set_defaults(run=tokenise)
+
+    # everything after bench goes to Benchmark.py as it is, --help included
+    command = commands.add_parser('bench', help="Benchmark.py's suites", add_help=False)
+    command.set_defaults(run=bench, config='./config.ini')
+
+    return parser
+
+
+def main(argv=None):
+    parser = arg_parser()
+    args, args.rest = parser.parse_known_args(argv)
+    if args.rest and args.command != 'bench':
+        parser.error("unrecognized arguments: {}".format(" ".join(args.rest)))
 
     # sanity checks
-    # later, allow both tag and parse to do something like tag-first-parser
-    assert args.semtag + args.cl_tagger <= 1
-
-    config = configparser.ConfigParser()
-    config.read(args.config)
-
-    # parser
-    PARSE_BATCH_SIZE = int(config['parser']['BATCH_SIZE'])
-    PARSE_EMBED_DIM = int(config['parser']['EMBED_DIM'])
-    PARSE_LSTM_DIM = int(config['parser']['LSTM_DIM'])
-    PARSE_LSTM_LAYERS = int(config['parser']['LSTM_LAYERS'])
-    PARSE_REDUCE_DIM_ARC = int(config['parser']['REDUCE_DIM_ARC'])
-    PARSE_REDUCE_DIM_LABEL = int(config['parser']['REDUCE_DIM_LABEL'])
-    PARSE_LEARNING_RATE = float(config['parser']['LEARNING_RATE'])
-
-    # tagger
-    TAG_BATCH_SIZE = int(config['tagger']['BATCH_SIZE'])
-    TAG_EMBED_DIM = int(config['tagger']['EMBED_DIM'])
-    TAG_LSTM_DIM = int(config['tagger']['LSTM_DIM'])
-    TAG_LSTM_LAYERS = int(config['tagger']['LSTM_LAYERS'])
-    TAG_LEARNING_RATE = float(config['tagger']['LEARNING_RATE'])
-    TAG_MLP_DIM = int(config['tagger']['MLP_DIM'])
-
-    PARSE_EPOCHS = int(config['parser']['EPOCHS'])
-    TAG_EPOCHS = int(config['tagger']['EPOCHS'])
-
-    # =============================
-    # Ignore these functions
-    # Seriously, don't look at them
-    # =============================
-    def run_cl_tagger(args, iterators):
-        assert len(iterators) == 2, "r u ok because this not how aux tasks work fam"
-
-        main, aux = iterators[0], iterators[1]
-        (train_loader_main, dev_loader_main, test_loader_main), sizes_main, vocab_main = main
-        (train_loader_aux, dev_loader_aux, test_loader_aux), sizes_aux, vocab_aux = aux
-
-        runnable = CLTagger(args, sizes_main, sizes_aux, vocab_main, vocab_aux)
-
-        for epoch in range(PARSE_EPOCHS):
-            runnable.train_(epoch, train_loader_main, type_task="main")
-            runnable.train_(epoch, train_loader_aux, type_task="aux")
-
-    # ====================================
-    # Another really, really ugly bastard
-    # ====================================
-    def run_multiling(args, iterators):
-        # first pass - just get all the vocabs
-        for iterator in iterators:
-            (train_loader, dev_loader, test_loader), sizes, vocab = iterator
-            runnable = TagAndParse(sizes, args, vocab, embeddings=vocab[0], embed_dim=PARSE_EMBED_DIM, lstm_dim=PARSE_LSTM_DIM, lstm_layers=PARSE_LSTM_LAYERS,
-                                   reduce_dim_arc=PARSE_REDUCE_DIM_ARC, reduce_dim_label=PARSE_REDUCE_DIM_LABEL, learning_rate=PARSE_LEARNING_RATE)
-
-
-    # ==========================
-    # Actual loading begins here
-    # Start with args
-    # ==========================
-    if args.cl_tagger:
-        iterators = Loader.get_iterators(args, PARSE_BATCH_SIZE)
-        run_cl_tagger(args, iterators)
+    if args.command == 'eval' or args.command == 'train' and not (args.treebanks or args.cl_tagger):
+        assert args.tag or args.parse or args.morph, "which model: --tag, --parse or --morph"
+    if args.command == 'train':
+        # later, allow both tag and parse to do something like tag-first-parser
+        assert args.semtag + args.cl_tagger <= 1
+        assert args.workers == 1 or not args.use_cuda, "--workers is for cpu training"
+        assert not args.cl_tagger or args.aux, "--cl_tagger needs --aux"
+        assert not (args.resume and args.tag and args.parse) or os.path.isdir(args.resume), \
+            "with --tag --parse, --resume is the --checkpoint directory"
+    elif args.command == 'predict':
+        assert args.tagger or args.parser, "predict needs --tagger, --parser or both"
+        assert args.test, "predict reads its sentences from --test"
 
-    else:
-        (train_loader, dev_loader, test_loader), sizes, vocab = Loader.seg_iterators(args, PARSE_BATCH_SIZE)
-
-        # ============
-        # Wall of code
-        # ============
-        if args.parse and args.tag:
-            runnable = Tagger(sizes, args, vocab, chain=True, embeddings=None, embed_dim=TAG_EMBED_DIM, lstm_dim=TAG_LSTM_DIM, lstm_layers=TAG_LSTM_LAYERS,
-                              mlp_dim=TAG_MLP_DIM, learning_rate=TAG_LEARNING_RATE)
-
-            if args.use_cuda: runnable.cuda()
-
-            print("Training tagger")
-            for epoch in range(TAG_EPOCHS):
-                runnable.train_(epoch, train_loader)
-                runnable.evaluate_(dev_loader)
-
-            # test
-            print("Evaluating tagger")
-            tag_tensors = runnable.evaluate_(test_loader, print_conll=True)
-            test_loader.data().upos = (i for i in tag_tensors)
-
-            runnable = Parser(sizes, args, vocab, embeddings=vocab, embed_dim=PARSE_EMBED_DIM, lstm_dim=PARSE_LSTM_DIM, lstm_layers=PARSE_LSTM_LAYERS,
-                              reduce_dim_arc=PARSE_REDUCE_DIM_ARC, reduce_dim_label=PARSE_REDUCE_DIM_LABEL, learning_rate=PARSE_LEARNING_RATE)
-            
-            if args.use_cuda: runnable.cuda()
-
-            print("Training parser")
-            for epoch in range(PARSE_EPOCHS):
-                runnable.train_(epoch, train_loader)
-                runnable.evaluate_(dev_loader)
-
-            # test
-            print("Evaluating parser")
-            runnable.evaluate_(test_loader, print_conll=True)
-            sys.exit()
-
-        elif args.tokenise:
-            Loader.seg_iterators(args, 50)
-
-        elif args.parse:
-            runnable = Parser(sizes, args, vocab, embeddings=vocab, embed_dim=PARSE_EMBED_DIM, lstm_dim=PARSE_LSTM_DIM, lstm_layers=PARSE_LSTM_LAYERS,
-                              reduce_dim_arc=PARSE_REDUCE_DIM_ARC, reduce_dim_label=PARSE_REDUCE_DIM_LABEL, learning_rate=PARSE_LEARNING_RATE)
-        elif args.tag:
-            runnable = Tagger(sizes, args, vocab, embeddings=None, embed_dim=TAG_EMBED_DIM, lstm_dim=TAG_LSTM_DIM, lstm_layers=TAG_LSTM_LAYERS,
-                              mlp_dim=TAG_MLP_DIM, learning_rate=TAG_LEARNING_RATE)
-
-        elif args.morph:
-            runnable = Analyser(sizes, args, vocab)
-
-        if args.use_cuda:
-            runnable.cuda()
-
-        # training
-        if args.load:
-            print("Loading")
-            with open(args.load, "rb") as f:
-                runnable.load_state_dict(torch.load(f, map_location=lambda storage, loc: storage))
-
-        else:
-            print("Training")
-            for epoch in range(TAG_EPOCHS):
-                runnable.train_(epoch, train_loader)
-                runnable.evaluate_(dev_loader)
-
-        # test
-        print("Eval")
-        runnable.evaluate_(test_loader, print_conll=True)
+    config = Config.read(args.config)
+    if Config.runtime(config)[0] and args.command != 'bench':
+        import torch
+        if not hasattr(torch, 'autocast'):
+            import Helpers
+            parser.error(Helpers.BF16_UNSUPPORTED.format(torch.__version__))
+    if args.command in ('train', 'tokenise'):
+        # sparse gradients don't go through the flat all_reduce
+        assert args.workers == 1 or Config.embed_params(config).get('embed_mode', 'train') != 'delta', \
+            "--workers needs dense embeddings"
+        # the evaluator is forked, and a forked process can't use cuda
+        assert not (args.async_eval and args.use_cuda), "--async_eval is for cpu training"
+
+    args.run(args, config)
+
+
+if __name__ == '__main__':
+    main()
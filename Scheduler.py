@@ -0,0 +1,63 @@
+import random
+
+
+class Scheduler:
+    '''
+    interleaves the batches of several tasks' loaders, so a shared encoder sees every task throughout the epoch
+    instead of a whole epoch of one and then a whole epoch of the other
+        loaders: task name -> torchtext iterator
+        temperature: task t is drawn with probability ~ len(loader_t) ** (1 / temperature);
+                     1 is proportional to the loader sizes, higher flattens towards uniform
+        proportions: task name -> share of the steps, overriding the sizes (every task needs one)
+        weights: task name -> loss weight (default 1)
+        combined: every step holds one batch of each task, so their weighted losses go into one optimiser step
+        steps: steps per epoch; by default as many batches as the loaders hold between them
+                 (as many as the largest holds when combined)
+    a loader that runs out mid-epoch starts over, reshuffled
+    iterating yields steps: lists of (task, batch)
+    '''
+    def __init__(self, loaders, temperature=1.0, proportions=None, weights=None, combined=False, steps=None):
+        self.loaders = dict(loaders)
+        self.tasks = sorted(self.loaders)
+        self.temperature = temperature
+        self.proportions = proportions
+        assert not proportions or set(proportions) == set(self.tasks), "proportions for {}".format(self.tasks)
+        self.weights = {task: 1.0 for task in self.tasks}
+        self.weights.update(weights or {})
+        self.combined = combined
+        self.steps = steps or (max if combined else sum)(len(loader) for loader in self.loaders.values())
+        self._iterators = {}
+
+    def probabilities(self):
+        if self.proportions:
+            sizes = [self.proportions[task] for task in self.tasks]
+        else:
+            sizes = [len(self.loaders[task]) ** (1 / self.temperature) for task in self.tasks]
+        return {task: size / sum(sizes) for task, size in zip(self.tasks, sizes)}
+
+    def init_epoch(self):
+        self._iterators = {task: iter(loader) for task, loader in self.loaders.items()}
+
+    def _next(self, task):
+        try:
+            return next(self._iterators[task])
+        except StopIteration:
+            self._iterators[task] = iter(self.loaders[task])
+            return next(self._iterators[task])
+
+    def __len__(self):
+        return self.steps
+
+    def __iter__(self):
+        if not self._iterators:
+            self.init_epoch()
+
+        probabilities = self.probabilities()
+        for _ in range(self.steps):
+            if self.combined:
+                yield [(task, self._next(task)) for task in self.tasks]
+            else:
+                task = random.choices(self.tasks, weights=[probabilities[task] for task in self.tasks])[0]
+                yield [(task, self._next(task))]
+
+        self._iterators = {}
@@ -1,50 +1,21 @@
-import os
-import math
 import random
 import argparse
-import configparser
 import torch
-import torch.utils.data
-import torch.nn.functional as F
 import numpy as np
 from torch.autograd import Variable
-from Helpers import build_data, process_batch
+import Config
 import Helpers
-import Loader
-from Modules import Biaffine, LongerBiaffine, LinearAttention, ShorterBiaffine
-
-random.seed(1337)
-np.random.seed(1337)
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', action='store_true')
-parser.add_argument('--cuda', action='store_true')
-parser.add_argument('--config', default='./config.ini')
-parser.add_argument('--train', default='./data/en-ud-train.conllu.sem')
-parser.add_argument('--dev', default='./data/en-ud-dev.conllu.sem')
-parser.add_argument('--test', default='./data/en-ud-test.conllu.sem')
-args = parser.parse_args()
-
-config = configparser.ConfigParser()
-config.read(args.config)
-
-BATCH_SIZE = int(config['parser']['BATCH_SIZE'])
-EMBED_DIM = int(config['parser']['EMBED_DIM'])
-LSTM_DIM = int(config['parser']['LSTM_DIM'])
-LSTM_LAYERS = int(config['parser']['LSTM_LAYERS'])
-REDUCE_DIM_ARC = int(config['parser']['REDUCE_DIM_ARC'])
-REDUCE_DIM_LABEL = int(config['parser']['REDUCE_DIM_LABEL'])
-LEARNING_RATE = float(config['parser']['LEARNING_RATE'])
-EPOCHS = int(config['parser']['EPOCHS'])
+import Telemetry
+from Modules import LongerBiaffine, LinearAttention, ShorterBiaffine
 
 
 class CharEmbedding(torch.nn.Module):
-    def __init__(self, sizes, args):
+    def __init__(self, sizes, args, embed_dim=300, lstm_dim=500, lstm_layers=3):
         super().__init__()
-        self.embedding_chars = torch.nn.Embedding(sizes['chars'], EMBED_DIM)
-        self.lstm = torch.nn.LSTM(EMBED_DIM, LSTM_DIM, LSTM_LAYERS,
+        self.embedding_chars = torch.nn.Embedding(sizes['chars'], embed_dim)
+        self.lstm = torch.nn.LSTM(embed_dim, lstm_dim, lstm_layers,
                                   batch_first=True, bidirectional=False, dropout=0.33)
-        self.attention = LinearAttention(LSTM_DIM)
+        self.attention = LinearAttention(lstm_dim)
 
     def forward(self, forms, pack_sent):
         # input: B x S x W
@@ -72,32 +43,34 @@ class CharEmbedding(torch.nn.Module):
 
 
 class Parser(torch.nn.Module):
-    def __init__(self, sizes, args):
+    def __init__(self, sizes, args, embed_dim=300, lstm_dim=500, lstm_layers=3, reduce_dim_arc=400, reduce_dim_label=100,
+                 learning_rate=1e-3):
         super().__init__()
+        self.metrics = Telemetry.MetricsLogger()
 
         self.use_cuda = args.cuda
         self.debug = args.debug
 
-        # self.embeddings_chars = CharEmbedding(sizes, EMBED_DIM)
-        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], EMBED_DIM)
-        self.embeddings_tags = torch.nn.Embedding(sizes['postags'], EMBED_DIM)
-        self.lstm = torch.nn.LSTM(500 + sizes['semtags'], LSTM_DIM, LSTM_LAYERS,
+        # self.embeddings_chars = CharEmbedding(sizes, embed_dim)
+        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], embed_dim)
+        self.embeddings_tags = torch.nn.Embedding(sizes['postags'], embed_dim)
+        self.lstm = torch.nn.LSTM(500 + sizes['semtags'], lstm_dim, lstm_layers,
                                   batch_first=True, bidirectional=True, dropout=0.33)
-        self.mlp_head = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_ARC)
-        self.mlp_dep = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_ARC)
-        self.mlp_deprel_head = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_LABEL)
-        self.mlp_deprel_dep = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_LABEL)
+        self.mlp_head = torch.nn.Linear(2 * lstm_dim, reduce_dim_arc)
+        self.mlp_dep = torch.nn.Linear(2 * lstm_dim, reduce_dim_arc)
+        self.mlp_deprel_head = torch.nn.Linear(2 * lstm_dim, reduce_dim_label)
+        self.mlp_deprel_dep = torch.nn.Linear(2 * lstm_dim, reduce_dim_label)
         self.mlp_tag = torch.nn.Linear(300, 150)
         self.out_tag = torch.nn.Linear(150, sizes['semtags'])
-        self.lstm_tag = torch.nn.LSTM(EMBED_DIM, 150, LSTM_LAYERS - 2,
+        self.lstm_tag = torch.nn.LSTM(embed_dim, 150, lstm_layers - 2,
                                   batch_first=True, bidirectional=True, dropout=0.33)
         self.relu = torch.nn.ReLU()
         self.dropout = torch.nn.Dropout(p=0.33)
-        # self.biaffine = Biaffine(REDUCE_DIM_ARC + 1, REDUCE_DIM_ARC, BATCH_SIZE)
-        self.biaffine = ShorterBiaffine(REDUCE_DIM_ARC)
-        self.label_biaffine = LongerBiaffine(REDUCE_DIM_LABEL, REDUCE_DIM_LABEL, sizes['deprels'])
+        # self.biaffine = Biaffine(reduce_dim_arc + 1, reduce_dim_arc, batch_size)
+        self.biaffine = ShorterBiaffine(reduce_dim_arc)
+        self.label_biaffine = LongerBiaffine(reduce_dim_label, reduce_dim_label, sizes['deprels'])
         self.criterion = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimiser = torch.optim.Adam(self.parameters(), lr=LEARNING_RATE, betas=(0.9, 0.9))
+        self.optimiser = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
 
         if self.use_cuda:
             self.biaffine.cuda()
@@ -190,7 +163,9 @@ class Parser(torch.nn.Module):
             train_loss.backward()
             self.optimiser.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
+            self.metrics.log(epoch, train_loss, pack.tolist())
+
+        self.metrics.end_epoch(epoch)
 
     def evaluate_(self, test_loader):
         las_correct, uas_correct, tags_correct, total = 0, 0, 0, 0
@@ -236,20 +211,39 @@ class Parser(torch.nn.Module):
                                                           tags_correct, total,  tags_correct / total))
 
 
-if __name__ == '__main__':
-    # args
-    (train_loader, dev_loader, test_loader), sizes = Loader.get_iterators(args, BATCH_SIZE)
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--debug', action='store_true')
+    arg_parser.add_argument('--cuda', action='store_true')
+    arg_parser.add_argument('--config', default='./config.ini')
+    arg_parser.add_argument('--train', default='./data/en-ud-train.conllu.sem')
+    arg_parser.add_argument('--dev', default='./data/en-ud-dev.conllu.sem')
+    arg_parser.add_argument('--test', default='./data/en-ud-test.conllu.sem')
+    args = arg_parser.parse_args(argv)
+    # what Loader reads off args
+    args.use_cuda, args.use_chars, args.semtag, args.embed = args.cuda, False, True, None
+
+    config = Config.read(args.config)
+    random.seed(1337)
+    np.random.seed(1337)
+
+    import Loader
+    (train_loader, dev_loader, test_loader), sizes, _ = Loader.get_iterators(args, int(config['parser']['BATCH_SIZE']))
 
-    parser = Parser(sizes, args)
+    parser = Parser(sizes, args, **Config.parser_params(config['parser']))
     if args.cuda:
         parser.cuda()
 
     # training
     print("Training")
-    for epoch in range(EPOCHS):
+    for epoch in range(int(config['parser']['EPOCHS'])):
         parser.train_(epoch, train_loader)
         parser.evaluate_(dev_loader)
 
     # test
     print("Eval")
     parser.evaluate_(test_loader)
+
+
+if __name__ == '__main__':
+    main()
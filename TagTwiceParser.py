@@ -1,66 +1,36 @@
-import os
-import math
 import random
 import argparse
-import configparser
 import torch
-import torch.utils.data
-import torch.nn.functional as F
 import numpy as np
 from torch.autograd import Variable
-from Helpers import build_data, process_batch
+import Config
 import Helpers
-import Loader
-from Modules import Biaffine, LongerBiaffine, LinearAttention, ShorterBiaffine, CharEmbedding
-
-
-random.seed(1337)
-np.random.seed(1337)
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', action='store_true')
-parser.add_argument('--cuda', action='store_true')
-parser.add_argument('--config', default='./config.ini')
-parser.add_argument('--train', default='./data/en-ud-train.conllu.sem')
-parser.add_argument('--dev', default='./data/en-ud-dev.conllu.sem')
-parser.add_argument('--test', default='./data/en-ud-test.conllu.sem')
-parser.add_argument('--embed')
-parser.add_argument('--chars', default = False)
-
-args = parser.parse_args()
-
-config = configparser.ConfigParser()
-config.read(args.config)
-
-BATCH_SIZE = int(config['parser']['BATCH_SIZE'])
-EMBED_DIM = int(config['parser']['EMBED_DIM'])
-LSTM_DIM = int(config['parser']['LSTM_DIM'])
-LSTM_LAYERS = int(config['parser']['LSTM_LAYERS'])
-REDUCE_DIM_ARC = int(config['parser']['REDUCE_DIM_ARC'])
-REDUCE_DIM_LABEL = int(config['parser']['REDUCE_DIM_LABEL'])
-LEARNING_RATE = float(config['parser']['LEARNING_RATE'])
-EPOCHS = int(config['parser']['EPOCHS'])
+import Telemetry
+from Modules import LongerBiaffine, ShorterBiaffine, CharEmbedding
 
 
 class Parser(torch.nn.Module):
-    def __init__(self, sizes, vocab, args):
+    def __init__(self, sizes, vocab, args, embed_dim=300, lstm_dim=500, lstm_layers=3, reduce_dim_arc=400,
+                 reduce_dim_label=100, learning_rate=1e-3):
         super().__init__()
+        self.metrics = Telemetry.MetricsLogger()
         self.use_cuda = args.cuda
         self.debug = args.debug
-        
-        if args.chars:
-            self.embeddings_chars = CharEmbedding(sizes['chars'], EMBED_DIM, LSTM_DIM, LSTM_LAYERS)
-        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], EMBED_DIM)
+        self.chars = args.chars
+
+        if self.chars:
+            self.embeddings_chars = CharEmbedding(sizes['chars'], embed_dim, lstm_dim, lstm_layers)
+        self.embeddings_forms = torch.nn.Embedding(sizes['vocab'], embed_dim)
         if args.embed:
             self.embeddings_forms.weight.data.copy_(vocab.vectors)
-        self.embeddings_forms_rand = torch.nn.Embedding(sizes['vocab'], EMBED_DIM) 
-     #   self.embeddings_tags = torch.nn.Embedding(sizes['postags'], EMBED_DIM)
-        self.lstm = torch.nn.LSTM(700  + sizes['semtags'] + sizes['postags'], LSTM_DIM, LSTM_LAYERS + 1,
+        self.embeddings_forms_rand = torch.nn.Embedding(sizes['vocab'], embed_dim) 
+     #   self.embeddings_tags = torch.nn.Embedding(sizes['postags'], embed_dim)
+        self.lstm = torch.nn.LSTM(700  + sizes['semtags'] + sizes['postags'], lstm_dim, lstm_layers + 1,
                                   batch_first=True, bidirectional=True, dropout=0.33)
-        self.mlp_head = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_ARC)
-        self.mlp_dep = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_ARC)
-        self.mlp_deprel_head = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_LABEL)
-        self.mlp_deprel_dep = torch.nn.Linear(2 * LSTM_DIM, REDUCE_DIM_LABEL)
+        self.mlp_head = torch.nn.Linear(2 * lstm_dim, reduce_dim_arc)
+        self.mlp_dep = torch.nn.Linear(2 * lstm_dim, reduce_dim_arc)
+        self.mlp_deprel_head = torch.nn.Linear(2 * lstm_dim, reduce_dim_label)
+        self.mlp_deprel_dep = torch.nn.Linear(2 * lstm_dim, reduce_dim_label)
         #pos
         self.mlp_tag = torch.nn.Linear(300, 150)
         self.out_tag = torch.nn.Linear(150, sizes['postags'])
@@ -68,18 +38,18 @@ class Parser(torch.nn.Module):
         self.mlp_semtag = torch.nn.Linear(500, 200)
         self.out_semtag = torch.nn.Linear(200, sizes['semtags'])
 
-        self.lstm_tag = torch.nn.LSTM(EMBED_DIM * 2, 150, 1,
+        self.lstm_tag = torch.nn.LSTM(embed_dim * 2, 150, 1,
                                   batch_first=True, bidirectional=True, dropout=0.33)
 
-        self.lstm_semtag = torch.nn.LSTM(EMBED_DIM * 5 +  sizes['postags'], 250, 1,
+        self.lstm_semtag = torch.nn.LSTM(embed_dim * 5 +  sizes['postags'], 250, 1,
                                   batch_first=True, bidirectional=True, dropout=0.33)
         self.relu = torch.nn.ReLU()
         self.dropout = torch.nn.Dropout(p=0.33)
-        # self.biaffine = Biaffine(REDUCE_DIM_ARC + 1, REDUCE_DIM_ARC, BATCH_SIZE)
-        self.biaffine = ShorterBiaffine(REDUCE_DIM_ARC)
-        self.label_biaffine = LongerBiaffine(REDUCE_DIM_LABEL, REDUCE_DIM_LABEL, sizes['deprels'])
+        # self.biaffine = Biaffine(reduce_dim_arc + 1, reduce_dim_arc, batch_size)
+        self.biaffine = ShorterBiaffine(reduce_dim_arc)
+        self.label_biaffine = LongerBiaffine(reduce_dim_label, reduce_dim_label, sizes['deprels'])
         self.criterion = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimiser = torch.optim.Adam(self.parameters(), lr=LEARNING_RATE, betas=(0.9, 0.9))
+        self.optimiser = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
 
         if self.use_cuda:
             self.biaffine.cuda()
@@ -88,14 +58,14 @@ class Parser(torch.nn.Module):
     def forward(self, forms, tags, semtags, pack, chars, char_pack):
         # embed and dropout forms and tags; concat
         # TODO: same mask embedding
-        if args.chars:
+        if self.chars:
             char_embeds = self.dropout(self.embeddings_chars(chars, char_pack))
         form_embeds = self.dropout(self.embeddings_forms(forms))
       # tag_embeds = self.dropout(self.embeddings_tags(tags))
         #task-specific emb
         form_embeds_rand = self.dropout(self.embeddings_forms_rand(forms))
         #merge all emb
-        if args.chars:
+        if self.chars:
             form_embeds += char_embeds 
             form_embeds = torch.cat([form_embeds_rand ,form_embeds], dim = 2)
         else:
@@ -195,7 +165,9 @@ class Parser(torch.nn.Module):
             train_loss.backward()
             self.optimiser.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
+            self.metrics.log(epoch, train_loss, pack.tolist())
+
+        self.metrics.end_epoch(epoch)
 
     def evaluate_(self, test_loader):
         las_correct, uas_correct, semtags_correct, tags_correct, total = 0, 0, 0, 0, 0
@@ -245,23 +217,41 @@ class Parser(torch.nn.Module):
                                                           semtags_correct, total,  semtags_correct / total))
 
 
-if __name__ == '__main__':
-    # args
-    loaders = Loader.get_iterators(args, BATCH_SIZE)
-   
-    train_loader, dev_loader, test_loader, vocab =  loaders['train'], loaders['dev'], loaders['test'],  loaders['vocab'] 
-    sizes = loaders['sizes']   
-
-    parser = Parser(sizes, vocab, args)
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--debug', action='store_true')
+    arg_parser.add_argument('--cuda', action='store_true')
+    arg_parser.add_argument('--config', default='./config.ini')
+    arg_parser.add_argument('--train', default='./data/en-ud-train.conllu.sem')
+    arg_parser.add_argument('--dev', default='./data/en-ud-dev.conllu.sem')
+    arg_parser.add_argument('--test', default='./data/en-ud-test.conllu.sem')
+    arg_parser.add_argument('--embed')
+    arg_parser.add_argument('--chars', action='store_true')
+    args = arg_parser.parse_args(argv)
+    # what Loader reads off args; train_ and evaluate_ unpack batch.char either way
+    args.use_cuda, args.use_chars, args.semtag = args.cuda, True, True
+
+    config = Config.read(args.config)
+    random.seed(1337)
+    np.random.seed(1337)
+
+    import Loader
+    (train_loader, dev_loader, test_loader), sizes, vocab = Loader.get_iterators(args, int(config['parser']['BATCH_SIZE']))
+
+    parser = Parser(sizes, vocab[0], args, **Config.parser_params(config['parser']))
     if args.cuda:
         parser.cuda()
 
     # training
     print("Training")
-    for epoch in range(EPOCHS):
+    for epoch in range(int(config['parser']['EPOCHS'])):
         parser.train_(epoch, train_loader)
         parser.evaluate_(dev_loader)
 
     # test
     print("Eval")
     parser.evaluate_(test_loader)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,23 @@
-import sys
-import configparser
 import argparse
 import torch
-import Loader
-import torch.nn.functional as F
+import Config
+import Telemetry
 from torch.autograd import Variable
-from Runner import build_data
-from Helpers import process_batch
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', action='store_true')
-parser.add_argument('--cuda', action='store_true')
-parser.add_argument('--config', default='./config.ini')
-parser.add_argument('--train', default='./data/en-ud-train.conllu.sem')
-parser.add_argument('--dev', default='./data/en-ud-dev.conllu.sem')
-parser.add_argument('--test', default='./data/en-ud-test.conllu.sem')
-parser.add_argument('--embedd', default='')
-parser.add_argument('--train', action='append')
-parser.add_argument('--dev', action='append')
-parser.add_argument('--test', action='append')
-parser.add_argument('--embed', action='append')
-args = parser.parse_args()
-
-config = configparser.ConfigParser()
-config.read(args.config)
-
-BATCH_SIZE = int(config['tagger']['BATCH_SIZE'])
-EMBED_DIM = int(config['tagger']['EMBED_DIM'])
-LSTM_DIM = int(config['tagger']['LSTM_DIM'])
-LSTM_LAYERS = int(config['tagger']['LSTM_LAYERS'])
-MLP_DIM = int(config['tagger']['MLP_DIM'])
-LEARNING_RATE = float(config['tagger']['LEARNING_RATE'])
-EPOCHS = int(config['tagger']['EPOCHS'])
 
 
 class Tagger(torch.nn.Module):
-    def __init__(self, sizes, vocab, args):
+    def __init__(self, sizes, vocab, args, embed_dim=300, lstm_dim=400, lstm_layers=1, mlp_dim=400, learning_rate=2e-3):
         super().__init__()
+        self.metrics = Telemetry.MetricsLogger()
 
-        self.embeds = torch.nn.Embedding(sizes['vocab'], EMBED_DIM)
+        self.embeds = torch.nn.Embedding(sizes['vocab'], embed_dim)
         self.embeds.weight.data.copy_(vocab.vectors)
-        self.lstm = torch.nn.LSTM(EMBED_DIM, LSTM_DIM, LSTM_LAYERS, batch_first=True, bidirectional=True, dropout=0.5)
+        self.lstm = torch.nn.LSTM(embed_dim, lstm_dim, lstm_layers, batch_first=True, bidirectional=True, dropout=0.5)
         self.relu = torch.nn.ReLU()
-        self.mlp = torch.nn.Linear(2 * LSTM_DIM, MLP_DIM)
-        self.out = torch.nn.Linear(MLP_DIM, sizes['semtags'])
+        self.mlp = torch.nn.Linear(2 * lstm_dim, mlp_dim)
+        self.out = torch.nn.Linear(mlp_dim, sizes['semtags'])
         self.criterion = torch.nn.CrossEntropyLoss(ignore_index=-1)
-        self.optimizer = torch.optim.Adam(self.parameters(), lr=LEARNING_RATE, betas=(0.9, 0.9))
+        self.optimizer = torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.9))
         self.dropout = torch.nn.Dropout(p=0.5)
 
     def forward(self, forms, pack):
@@ -90,8 +62,9 @@ class Tagger(torch.nn.Module):
             train_loss.backward()
             self.optimizer.step()
 
-            print("Epoch: {}\t{}/{}\tloss: {}".format(
-                epoch, (i + 1) * len(x_forms), len(train_loader.dataset), train_loss.data[0]))
+            self.metrics.log(epoch, train_loss, pack.tolist())
+
+        self.metrics.end_epoch(epoch)
 
     def evaluate_(self, test_loader):
         correct, total = 0, 0
@@ -115,19 +88,32 @@ class Tagger(torch.nn.Module):
         print("Accuracy = {}/{} = {}".format(correct, total, (correct / total)))
 
 
-def main():
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--debug', action='store_true')
+    arg_parser.add_argument('--cuda', action='store_true')
+    arg_parser.add_argument('--config', default='./config.ini')
+    arg_parser.add_argument('--train', default='./data/en-ud-train.conllu.sem')
+    arg_parser.add_argument('--dev', default='./data/en-ud-dev.conllu.sem')
+    arg_parser.add_argument('--test', default='./data/en-ud-test.conllu.sem')
+    arg_parser.add_argument('--embed', required=True)
+    args = arg_parser.parse_args(argv)
+    # what Loader reads off args
+    args.use_cuda, args.use_chars, args.semtag = args.cuda, False, True
+
+    config = Config.read(args.config)
 
-    sets = (args.train[0], args.dev[0], args.test[0])
-    (train_loader, dev_loader, test_loader), sizes, vocab = Loader.get_iterators(sets, args.embed[0], BATCH_SIZE, args.cuda)
+    import Loader
+    (train_loader, dev_loader, test_loader), sizes, vocab = Loader.get_iterators(args, int(config['tagger']['BATCH_SIZE']))
     print(len(train_loader))
 
-    tagger = Tagger(sizes, vocab, args)
+    tagger = Tagger(sizes, vocab[0], args, **Config.tagger_params(config['tagger']))
     if args.cuda:
         tagger.cuda()
 
     # training
     print("Training")
-    for epoch in range(EPOCHS):
+    for epoch in range(int(config['tagger']['EPOCHS'])):
         tagger.train_(epoch, train_loader)
         tagger.evaluate_(dev_loader)
 
@@ -0,0 +1,106 @@
+import sys
+import json
+import time
+import queue
+import threading
+
+
+class MetricsLogger:
+    '''
+    per-step training metrics, accumulated without reading anything back from the device
+    every interval steps the window is handed to a background thread, which does the one sync, prints a summary
+    line and appends a JSON record to path (if given)
+    '''
+    def __init__(self, path=None, interval=50, name=None):
+        self.path = path
+        self.interval = interval
+        self.name = name
+        self.step = 0
+        self._queue = None
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.loss, self.steps, self.sentences, self.tokens, self.padded = None, 0, 0, 0, 0
+        self.start = time.time()
+
+    def log(self, epoch, loss, lengths, longest=None):
+        '''
+        loss: a Variable or tensor; only its .data is kept, as a running device-side sum
+        lengths: sentence lengths in the batch, as a python list
+        '''
+        data = loss.data if hasattr(loss, 'data') else loss
+        self.loss = data.clone() if self.loss is None else self.loss + data
+        self.steps += 1
+        self.step += 1
+        self.sentences += len(lengths)
+        self.tokens += sum(lengths)
+        self.padded += len(lengths) * (longest or max(lengths))
+
+        if self.steps >= self.interval:
+            self.flush(epoch)
+
+    def flush(self, epoch):
+        if not self.steps:
+            return
+
+        seconds = time.time() - self.start
+        record = {'name': self.name, 'epoch': epoch, 'step': self.step, 'steps': self.steps,
+                  'sentences': self.sentences, 'tokens': self.tokens, 'seconds': seconds,
+                  'step_time': seconds / self.steps, 'tokens_per_sec': self.tokens / seconds,
+                  'padding_ratio': 1 - self.tokens / self.padded, 'time': time.time()}
+        self._submit((record, self.loss))
+        self._reset()
+
+    def end_epoch(self, epoch):
+        self.flush(epoch)
+
+    def _submit(self, item):
+        if self._thread is None:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._write, daemon=True)
+            self._thread.start()
+        self._queue.put(item)
+
+    def _write(self):
+        out = open(self.path, "a") if self.path else None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            record, loss = item
+            # the only device read, and it happens off the training thread
+            record['loss'] = float(loss.sum()) / record['steps']
+            print("Epoch: {epoch}\tstep {step}\tloss: {loss:.4f}\t{tokens_per_sec:.0f} tok/s\t"
+                  "{step_time:.3f} s/step\tpadding {padding_ratio:.2f}".format(**record))
+            sys.stdout.flush()
+            if out:
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+        if out:
+            out.close()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+class NullLogger:
+    def log(self, epoch, loss, lengths, longest=None):
+        pass
+
+    def flush(self, epoch):
+        pass
+
+    def end_epoch(self, epoch):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL = NullLogger()
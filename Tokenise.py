@@ -0,0 +1,70 @@
+import re
+
+'''
+raw text => sentences, as a stream: lines are tokenised by rule, the Segmenter decides where sentences end,
+and sentences come out in chunks that Loader.sentences_to_iterator turns into batches for the tagger/parser
+'''
+
+# words (with internal hyphens/apostrophes), numbers with separators, or single punctuation marks
+TOKEN = re.compile(r"\d+(?:[.,:]\d+)*|\w+(?:[-'’]\w+)*|[^\w\s]", re.UNICODE)
+
+
+def tokenise(text):
+    return TOKEN.findall(text)
+
+
+def sentences(segmenter, lines, window=50, batch_size=32):
+    '''
+    yields sentences (lists of tokens) in text order
+    tokens are buffered until batch_size windows are full and segmented in one forward pass; the words after the
+    last predicted end are carried into the next batch, and whatever is left at the end is one last sentence
+    '''
+    pending, carry = [], []
+
+    def flush(tokens, final=False):
+        windows = [tokens[start:start + window] for start in range(0, len(tokens), window)]
+        ends = [end for flags in segmenter.ends(windows) for end in flags] if windows else []
+        sentence = list(carry)
+        del carry[:]
+        for token, end in zip(tokens, ends):
+            sentence.append(token)
+            if end:
+                yield sentence
+                sentence = []
+        if final and sentence:
+            yield sentence
+        else:
+            carry.extend(sentence)
+
+    for line in lines:
+        pending.extend(tokenise(line))
+        while len(pending) >= window * batch_size:
+            tokens, pending = pending[:window * batch_size], pending[window * batch_size:]
+            yield from flush(tokens)
+
+    yield from flush(pending, final=True)
+
+
+def to_rows(tokens):
+    # a bare CoNLL-U sentence: ids and forms, everything else left for the tagger/parser
+    return [[str(n), token, '_', '_', '_', '_', '_', '_', '_', '_'] for n, token in enumerate(tokens, 1)]
+
+
+def to_conllu(rows, sent_id=None):
+    header = "# sent_id = {}\n".format(sent_id) if sent_id is not None else ""
+    header += "# text = {}\n".format(" ".join(row[1] for row in rows))
+    return header + "\n".join("\t".join(row) for row in rows) + "\n\n"
+
+
+def chunks(segmenter, lines, chunk_size=256, window=50, batch_size=32):
+    '''
+    sentences as lists of CoNLL-U rows, chunk_size at a time: the unit the later stages batch over
+    '''
+    chunk = []
+    for tokens in sentences(segmenter, lines, window, batch_size):
+        chunk.append(to_rows(tokens))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,167 @@
+import os
+import traceback
+import torch
+import torch.multiprocessing as mp
+import Helpers
+import Checkpoint
+import Profiler
+import Telemetry
+import Distributed
+
+
+def fit(runnable, train_loader, dev_loader, epochs, workers=1, checkpoint=None, resume=None, patience=0,
+        async_eval=False):
+    '''
+    train for up to epochs, evaluating on dev after each one; leaves the best-on-dev weights in runnable
+    checkpoint: directory for checkpoint.pt (written every epoch) and best.pt
+    resume: checkpoint.pt to carry on from
+    patience: stop after this many epochs without a better dev score (0 = never)
+    async_eval: evaluate snapshots of the weights in a separate process (see AsyncEvaluator) while training goes
+    on; the scores reach the tracker as they come back, so an early stop can land a few epochs late
+    '''
+    # the dev batches are built once and reused by every epoch's evaluate_
+    dev_loader = Helpers.Resident(dev_loader)
+    tracker = Checkpoint.Tracker(patience)
+    start = 0
+    if resume:
+        print("Resuming from {}".format(resume))
+        start = Checkpoint.load(resume, runnable, train_loader, tracker)
+
+    if workers > 1:
+        state_dict = Distributed.launch(_fit, workers, runnable, train_loader, dev_loader, start, epochs,
+                                        tracker, checkpoint, async_eval)
+    else:
+        state_dict = _fit(runnable, train_loader, dev_loader, start, epochs, tracker, checkpoint, async_eval)
+
+    runnable.load_state_dict(state_dict)
+
+
+def _fit(runnable, train_loader, dev_loader, start, epochs, tracker, checkpoint, async_eval=False):
+    if Distributed.world_size() > 1:
+        Distributed.broadcast_parameters(runnable)
+        train_loader = Distributed.shard(train_loader, Distributed.rank(), Distributed.world_size())
+
+    # only rank 0 writes the profile and the metrics
+    if not Distributed.is_master():
+        runnable.profiler = Profiler.NULL
+        runnable.metrics = Telemetry.NULL
+    profiler = getattr(runnable, 'profiler', Profiler.NULL)
+
+    # forked before the first step, so it doesn't inherit the optimiser state
+    evaluator = AsyncEvaluator(runnable, dev_loader) if async_eval and Distributed.is_master() else None
+    # epoch -> weights, for the snapshots out for evaluation
+    snapshots = {}
+
+    best_state = None
+    for epoch in range(start, epochs):
+        # an Augment.AugmentingIterator draws by epoch
+        if hasattr(train_loader, 'set_epoch'):
+            train_loader.set_epoch(epoch)
+        runnable.train_(epoch, train_loader)
+
+        stop = False
+        if Distributed.is_master():
+            if evaluator is None:
+                runnable.evaluate_(dev_loader)
+                scored = [(epoch, runnable.score)]
+            else:
+                snapshots[epoch] = Checkpoint.snapshot(runnable)
+                evaluator.submit(epoch, snapshots[epoch])
+                scored = evaluator.results()
+            best_state = _track(tracker, scored, snapshots, runnable, checkpoint) or best_state
+
+            # with async_eval, the tracker saved here only knows the epochs whose scores are already back
+            if checkpoint:
+                Checkpoint.save(os.path.join(checkpoint, 'checkpoint.pt'), runnable, epoch, train_loader, tracker)
+            stop = tracker.should_stop()
+            profiler.end_epoch(epoch)
+
+        if Distributed.agree(stop):
+            print("No improvement for {} epochs, stopping".format(tracker.patience))
+            break
+
+    if not Distributed.is_master():
+        return
+
+    if evaluator is not None:
+        best_state = _track(tracker, evaluator.results(wait=True), snapshots, runnable, checkpoint) or best_state
+        evaluator.close()
+
+    profiler.close()
+    getattr(runnable, 'metrics', Telemetry.NULL).close()
+    if tracker.best_epoch >= 0:
+        print("Best dev score {} at epoch {}".format(tracker.best, tracker.best_epoch))
+
+    # the best epoch may predate a resume, in which case it only exists on disk
+    if best_state is None and checkpoint and os.path.exists(os.path.join(checkpoint, 'best.pt')):
+        best_state = Checkpoint.load_model(os.path.join(checkpoint, 'best.pt'))
+
+    return best_state or Checkpoint.snapshot(runnable)
+
+
+def _track(tracker, scored, snapshots, runnable, checkpoint):
+    '''
+    feed (epoch, score) pairs to the tracker in epoch order; returns the weights of the last one that beat the best
+    so far, or None. The weights of an epoch are its entry in snapshots if it has one, runnable's otherwise
+    '''
+    best_state = None
+    for epoch, score in scored:
+        state = snapshots.pop(epoch, None)
+        if tracker.update(epoch, score):
+            best_state = state if state is not None else Checkpoint.snapshot(runnable)
+            if checkpoint:
+                Checkpoint.save_model(os.path.join(checkpoint, 'best.pt'), best_state)
+
+    return best_state
+
+
+class AsyncEvaluator:
+    '''
+    dev evaluation in a process of its own: submit(epoch, state_dict) hands it a snapshot of the weights,
+    results() picks up the scores that have come back since, in epoch order
+    fork, like Distributed.launch: the process starts with a copy of the runnable and of the dev batches, so only
+    the weights go through the queue; cpu only, a forked process can't use cuda
+    '''
+    def __init__(self, runnable, dev_loader):
+        self.requests, self.replies = mp.Queue(), mp.Queue()
+        self.pending = 0
+        self.process = mp.Process(target=_evaluate, args=(runnable, dev_loader, self.requests, self.replies),
+                                  daemon=True)
+        self.process.start()
+
+    def submit(self, epoch, state_dict):
+        self.requests.put((epoch, state_dict))
+        self.pending += 1
+
+    def results(self, wait=False):
+        # [(epoch, score)] of the finished evaluations; wait: block until all of them have finished
+        scored = []
+        while self.pending and (wait or not self.replies.empty()):
+            epoch, score, scores, error = self.replies.get()
+            self.pending -= 1
+            if error:
+                raise RuntimeError("dev evaluation of epoch {} failed:\n{}".format(epoch, error))
+            print("Epoch {} dev: {}".format(epoch, scores))
+            scored.append((epoch, score))
+
+        return scored
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join()
+
+
+def _evaluate(runnable, dev_loader, requests, replies):
+    # the profile and the metrics are the training process's; half the threads, so the two don't fight over
+    # every core
+    runnable.profiler = Profiler.NULL
+    runnable.metrics = Telemetry.NULL
+    torch.set_num_threads(max(1, torch.get_num_threads() // 2))
+
+    for epoch, state_dict in iter(requests.get, None):
+        try:
+            runnable.load_state_dict(state_dict)
+            runnable.evaluate_(dev_loader)
+            replies.put((epoch, runnable.score, runnable.scores, None))
+        except Exception:
+            replies.put((epoch, None, None, traceback.format_exc()))
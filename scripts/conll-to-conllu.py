@@ -1,16 +1,6 @@
 import sys
+import transform
 
-for line in sys.stdin:
-	if line[0] == '#':
-		sys.stdout.write(line)
-		continue
-
-	if not line.strip():
-		sys.stdout.write(line)
-		continue
-
-	cols = line.split("\t")
-	sys.stdout.write("{}\t{}\t{}\t{}\t{}\t".format(cols[0], cols[2], cols[1], cols[3], cols[4]))
-	sys.stdout.write("{}\t{}\t{}\t{}\tLanguage={}\n".format(cols[5], cols[6], cols[7], '_', cols[8]))
-	
-
+# 9-column code-switch files: lemma and form swap places, the language in the last column goes to MISC
+transform.run([transform.columns(['{0}', '{2}', '{1}', '{3}', '{4}', '{5}', '{6}', '{7}', '_', 'Language={8}'])],
+              transform.read(sys.stdin), sys.stdout)
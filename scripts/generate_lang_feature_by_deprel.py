@@ -1,40 +1,6 @@
-import random
 import sys
+import transform
 
-random.seed(1337)
-
-def do_stuff(f):
-	toks = []
-	for line in f:
-		if line[0] == '#' or not line.strip():
-			continue
-
-		cols = line.split("\t")
-		if cols[7] == 'case':
-			toks.append(cols[1])
-
-	return toks
-
-with open(sys.argv[1]) as f:
-	l1 = f.readlines()
-
-with open(sys.argv[2]) as f:
-	l2 = f.readlines()
-
-with open(sys.argv[3]) as f:
-	combo = f.readlines()
-
-# build samples
-toks = do_stuff(l1) + do_stuff(l2)
-
-for line in combo:
-	if line[0] == '#' or not line.strip():
-		sys.stdout.write(line)
-		continue
-
-	cols = line.split("\t")
-	if cols[7] == 'case':
-		sys.stdout.write("{}\tLanguage={}".format("\t".join(cols[0:9]), random.choice(['en', 'hi'])))
-	else:
-		sys.stdout.write(line)
-
+# usage: generate_lang_feature_by_deprel.py L1 L2 COMBO; only COMBO is rewritten, L1 and L2 are accepted as before
+transform.run([transform.misc('Language', ['en', 'hi'], where=transform.deprel('case'), replace=True)],
+              transform.read_files(sys.argv[3:4]), sys.stdout, seed=1337)
@@ -1,18 +1,6 @@
 import sys
-import time
-import random
+import transform
 
-random.seed(time.time())
-
-for line in sys.stdin:
-	if line[0] == '#':
-		sys.stdout.write(line)
-		continue
-	
-	if not line.strip():
-		sys.stdout.write(line)
-		continue
-	
-	cols = line.split("\t")
-	sys.stdout.write("{}\t{}\t{}\t{}\t{}\t".format(*cols[0:5]))
-	sys.stdout.write("{}\t{}\t{}\t{}\tLanguage={}\n".format(*cols[5:9], random.choice(sys.argv[1:])))
+# a different draw every run
+transform.run([transform.misc('Language', sys.argv[1:], replace=True)], transform.read(sys.stdin), sys.stdout,
+              seed=None)
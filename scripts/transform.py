@@ -0,0 +1,290 @@
+'''
+streaming CoNLL-U transforms
+
+a file is read as a stream of sentences and pushed through a chain of stages, each a generator over sentences, so
+nothing is read whole; with several workers the stream is cut into shards of sentences, the shards go through a
+process pool and come back out in input order
+every stage gets a random.Random seeded from (seed, shard number), so the output depends on the seed and the shard
+size but not on the number of workers
+
+    python scripts/transform.py train.conllu --where deprel=case --misc Language=en,hi --workers 4 > out.conllu
+    python scripts/transform.py --substitute seeds.tsv < in.conllu > out.conllu
+
+the stages run in the order they are given on the command line; --where applies to the stage after it
+'''
+import sys
+import random
+import argparse
+import itertools
+import collections
+import multiprocessing
+
+COLUMNS = ['id', 'form', 'lemma', 'upos', 'xpos', 'feats', 'head', 'deprel', 'deps', 'misc']
+FORM, UPOS, HEAD, DEPREL, MISC = 1, 3, 6, 7, 9
+
+
+class Sentence:
+    '''
+    comments as they were (without newlines), rows as lists of column values: words, multiword ranges, empty nodes
+    '''
+    def __init__(self, comments=None, rows=None):
+        self.comments = comments or []
+        self.rows = rows or []
+
+    def words(self):
+        # the rows of actual words, not ranges or empty nodes
+        return [row for row in self.rows if row[0].isdigit()]
+
+    def __str__(self):
+        return "".join(line + "\n" for line in self.comments + ["\t".join(row) for row in self.rows]) + "\n"
+
+
+def read(lines):
+    sentence = Sentence()
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith('#'):
+            sentence.comments.append(line)
+        elif not line.strip():
+            if sentence.comments or sentence.rows:
+                yield sentence
+            sentence = Sentence()
+        else:
+            sentence.rows.append(line.split("\t"))
+
+    if sentence.comments or sentence.rows:
+        yield sentence
+
+
+def read_files(paths):
+    # stdin when there are none
+    if not paths:
+        yield from read(sys.stdin)
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            yield from read(f)
+
+
+# ==========
+# conditions
+# ==========
+def deprel(*labels):
+    return lambda row: len(row) > DEPREL and row[DEPREL] in labels
+
+
+def column(index, *values):
+    return lambda row: len(row) > index and row[index] in values
+
+
+def always(row):
+    return True
+
+
+# ======
+# stages: stage(sentences, rng) => sentences
+# ======
+def rewrite(fn, where=always):
+    # fn(row, rng) => new row, for every row the condition holds for
+    def stage(sentences, rng):
+        for sentence in sentences:
+            sentence.rows = [fn(row, rng) if where(row) else row for row in sentence.rows]
+            yield sentence
+    return stage
+
+
+def columns(templates, where=always):
+    '''
+    rebuild the columns from format strings over the old ones: ['{0}', '{2}', '{1}', ..., 'Language={8}']
+    '''
+    return rewrite(lambda row, rng: [template.format(*row) for template in templates], where)
+
+
+def misc(key, values, where=always, replace=False):
+    '''
+    key=value into MISC, value drawn from values; replace: MISC becomes just that, instead of gaining the feature
+    '''
+    values = [values] if isinstance(values, str) else list(values)
+
+    def fn(row, rng):
+        row = row + ['_'] * (len(COLUMNS) - len(row))
+        value = values[0] if len(values) == 1 else rng.choice(values)
+        features = [] if replace or row[MISC] == '_' else row[MISC].split('|')
+        features = [feature for feature in features if feature.split('=', 1)[0] != key]
+        row[MISC] = "|".join(sorted(features + ["{}={}".format(key, value)]))
+        return row
+
+    return rewrite(fn, where)
+
+
+def substitute(table, index=FORM, where=always, p=1.0):
+    '''
+    replace the values of a column that are in table (value => replacement, or a list to draw one from)
+    with probability p
+    '''
+    def fn(row, rng):
+        if row[index] not in table or (p < 1.0 and rng.random() >= p):
+            return row
+        replacement = table[row[index]]
+        row = list(row)
+        row[index] = replacement if isinstance(replacement, str) else rng.choice(replacement)
+        return row
+
+    return rewrite(fn, where)
+
+
+def resample(pool, index=FORM, where=always, p=1.0):
+    # replace the column with a random draw from pool, with probability p
+    pool = list(pool)
+
+    def fn(row, rng):
+        if p < 1.0 and rng.random() >= p:
+            return row
+        row = list(row)
+        row[index] = rng.choice(pool)
+        return row
+
+    return rewrite(fn, where)
+
+
+def load_seeds(path, bidirectional=True):
+    '''
+    a seed dictionary: word<TAB>translation per line, # for comments; both directions by default
+    '''
+    table = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line[0] == '#' or not line.strip():
+                continue
+            source, target = line.rstrip("\n").split("\t")[:2]
+            table[source] = target
+
+    if bidirectional:
+        table = {**table, **{target: source for source, target in table.items()}}
+    return table
+
+
+def collect(sentences, index=FORM, where=always):
+    # the values of a column over the rows the condition holds for, in order
+    return [row[index] for sentence in sentences for row in sentence.rows if where(row)]
+
+
+# =======
+# running
+# =======
+def apply(stages, sentences, rng):
+    for stage in stages:
+        sentences = stage(sentences, rng)
+    return sentences
+
+
+def shards(sentences, size):
+    sentences = iter(sentences)
+    while True:
+        shard = list(itertools.islice(sentences, size))
+        if not shard:
+            return
+        yield shard
+
+
+# the stages reach the workers by fork, so they can be closures
+_stages, _seed = [], None
+
+
+def _init(stages, seed):
+    global _stages, _seed
+    _stages, _seed = stages, seed
+
+
+def _shard_rng(seed, n):
+    return random.Random(None if seed is None else "{}:{}".format(seed, n))
+
+
+def _process(job):
+    n, shard = job
+    return "".join(str(sentence) for sentence in apply(_stages, shard, _shard_rng(_seed, n)))
+
+
+def run(stages, sentences, out, workers=1, shard_size=1000, seed=1337):
+    '''
+    sentences through the stages into out; seed=None for a different draw every run
+    '''
+    jobs = enumerate(shards(sentences, shard_size))
+    if workers == 1:
+        _init(stages, seed)
+        for job in jobs:
+            out.write(_process(job))
+        return
+
+    with multiprocessing.get_context('fork').Pool(workers, initializer=_init, initargs=(stages, seed)) as pool:
+        # at most workers * 2 shards in flight, written out in submission order; imap would read the whole input
+        # ahead into its task queue
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(pool.apply_async(_process, (job,)))
+            if len(pending) >= workers * 2:
+                out.write(pending.popleft().get())
+        while pending:
+            out.write(pending.popleft().get())
+
+
+# ===
+# CLI
+# ===
+class _Stage(argparse.Action):
+    # collects the stages in command-line order, each with the --where given just before it
+    def __call__(self, parser, namespace, values, option_string=None):
+        where = getattr(namespace, 'where', None) or always
+        namespace.where = None
+        stages = getattr(namespace, 'stages', None) or []
+        stages.append(self.build(values, where))
+        namespace.stages = stages
+
+
+class _Where(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        name, labels = values.split('=', 1)
+        index = COLUMNS.index(name)
+        namespace.where = column(index, *labels.split(','))
+
+
+class _Columns(_Stage):
+    build = staticmethod(lambda values, where: columns(values.split(','), where))
+
+
+class _Misc(_Stage):
+    @staticmethod
+    def build(values, where):
+        key, choices = values.split('=', 1)
+        return misc(key, choices.split(','), where)
+
+
+class _SetMisc(_Stage):
+    @staticmethod
+    def build(values, where):
+        key, choices = values.split('=', 1)
+        return misc(key, choices.split(','), where, replace=True)
+
+
+class _Substitute(_Stage):
+    build = staticmethod(lambda values, where: substitute(load_seeds(values), where=where))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="streaming CoNLL-U transforms; stages run in the order given")
+    arg_parser.add_argument('files', nargs='*', help="CoNLL-U files, stdin if none")
+    arg_parser.add_argument('--where', action=_Where, help="COLUMN=V1,V2: only rows with these values, for the next stage")
+    arg_parser.add_argument('--columns', action=_Columns, help="comma-separated templates over the old columns, {0}..{9}")
+    arg_parser.add_argument('--misc', action=_Misc, help="KEY=V1,V2: add KEY to MISC, one of the values at random")
+    arg_parser.add_argument('--set_misc', action=_SetMisc, help="like --misc, but MISC becomes just that")
+    arg_parser.add_argument('--substitute', action=_Substitute, help="seed dictionary file, applied both ways to FORM")
+    arg_parser.add_argument('--seed', type=int, default=1337)
+    arg_parser.add_argument('--workers', type=int, default=1)
+    arg_parser.add_argument('--shard_size', type=int, default=1000, help="sentences per shard")
+    args = arg_parser.parse_args(argv)
+
+    run(getattr(args, 'stages', None) or [], read_files(args.files), sys.stdout, workers=args.workers,
+        shard_size=args.shard_size, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+'''
+a columnar index over a set of CoNLL-U files, built once and then memory-mapped
+
+every word of every file gets a position; per column (form, lemma, upos, deprel, head distance) the index holds
+    <column>.ids.npy      the value id at every position
+    <column>.indptr.npy   CSR over value ids: the positions of value v are indices[indptr[v]:indptr[v + 1]]
+    <column>.indices.npy  (sorted within every value)
+plus the sentence boundaries and a histogram of sentence lengths, with the string values in meta.json
+so "every case marker" is a slice of one array instead of a scan of the treebanks
+
+    python scripts/treebank_index.py build INDEX a.conllu b.conllu
+    python scripts/treebank_index.py query INDEX --where deprel=case --show form
+'''
+import os
+import sys
+import json
+import hashlib
+import argparse
+from array import array
+from collections import Counter
+import numpy as np
+
+try:
+    from scripts import transform
+except ImportError:
+    import transform
+
+COLUMNS = {'form': transform.FORM, 'lemma': 2, 'upos': transform.UPOS, 'deprel': transform.DEPREL}
+# head - id, 0 for the root
+HEAD_DISTANCE = 'head_distance'
+
+
+def _csr(ids, size):
+    # positions grouped by value; a stable sort keeps them in order within each value
+    indices = np.argsort(ids, kind='mergesort').astype(np.int64)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(ids, minlength=size))]).astype(np.int64)
+    return indptr, indices
+
+
+def build(path, files):
+    '''
+    index files into the directory path; one streaming pass, no file is read whole
+    '''
+    values = {column: {} for column in COLUMNS}
+    ids = {column: array('q') for column in list(COLUMNS) + [HEAD_DISTANCE]}
+    sentence_starts, lengths = array('q', [0]), Counter()
+
+    for sentence in transform.read_files(files):
+        words = sentence.words()
+        for row in words:
+            for column, index in COLUMNS.items():
+                value = row[index] if len(row) > index else '_'
+                ids[column].append(values[column].setdefault(value, len(values[column])))
+            head = row[transform.HEAD] if len(row) > transform.HEAD else '_'
+            ids[HEAD_DISTANCE].append(int(head) - int(row[0]) if head.isdigit() and head != '0' else 0)
+        sentence_starts.append(sentence_starts[-1] + len(words))
+        lengths[len(words)] += 1
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    save = lambda name, a: np.save(os.path.join(path, name + '.npy'), a)
+
+    meta = {'files': [os.path.abspath(f) for f in files], 'tokens': sentence_starts[-1],
+            'sentences': len(sentence_starts) - 1, 'values': {}}
+    for column in COLUMNS:
+        meta['values'][column] = sorted(values[column], key=values[column].get)
+        column_ids = np.frombuffer(ids[column], dtype=np.int64).astype(np.int32)
+        save(column + '.ids', column_ids)
+        for name, a in zip(['indptr', 'indices'], _csr(column_ids, len(values[column]))):
+            save(column + '.' + name, a)
+
+    # distances are keyed from the smallest one up
+    distances = np.frombuffer(ids[HEAD_DISTANCE], dtype=np.int64).astype(np.int32)
+    meta['head_distance_min'] = int(distances.min()) if len(distances) else 0
+    save(HEAD_DISTANCE + '.ids', distances)
+    for name, a in zip(['indptr', 'indices'], _csr(distances - meta['head_distance_min'],
+                                                   int(distances.max() - meta['head_distance_min'] + 1)
+                                                   if len(distances) else 0)):
+        save(HEAD_DISTANCE + '.' + name, a)
+
+    save('sentence_starts', np.frombuffer(sentence_starts, dtype=np.int64))
+    histogram = np.zeros(max(lengths) + 1 if lengths else 1, dtype=np.int64)
+    for length, count in lengths.items():
+        histogram[length] = count
+    save('lengths', histogram)
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return TreebankIndex(path)
+
+
+class TreebankIndex:
+    '''
+    the queries: positions(column, value) for one value, where(deprel='case', upos='ADP') for several at once,
+    then values / counter / sentences of those positions
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.files = self.meta['files']
+        self.stoi = {column: {value: n for n, value in enumerate(values)}
+                     for column, values in self.meta['values'].items()}
+        self._arrays = {}
+
+    @classmethod
+    def for_files(cls, files, directory=None):
+        '''
+        the index of these files, built the first time and rebuilt when one of them is newer
+        kept in .index-<hash of the paths> next to the first file unless directory is given
+        '''
+        paths = [os.path.abspath(f) for f in files]
+        if directory is None:
+            digest = hashlib.sha1("\n".join(paths).encode('utf-8')).hexdigest()[:12]
+            directory = os.path.join(os.path.dirname(paths[0]), '.index-' + digest)
+
+        meta = os.path.join(directory, 'meta.json')
+        if not os.path.exists(meta) or any(os.path.getmtime(f) > os.path.getmtime(meta) for f in paths):
+            return build(directory, files)
+        return cls(directory)
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def __len__(self):
+        return self.meta['tokens']
+
+    def _key(self, column, value):
+        if column == HEAD_DISTANCE:
+            return int(value) - self.meta['head_distance_min']
+        return self.stoi[column].get(value, -1)
+
+    def positions(self, column, value):
+        key = self._key(column, value)
+        indptr = self._array(column + '.indptr')
+        if key < 0 or key + 1 >= len(indptr):
+            return np.zeros(0, dtype=np.int64)
+        return self._array(column + '.indices')[indptr[key]:indptr[key + 1]]
+
+    def count(self, column, value):
+        key = self._key(column, value)
+        indptr = self._array(column + '.indptr')
+        if key < 0 or key + 1 >= len(indptr):
+            return 0
+        return int(indptr[key + 1] - indptr[key])
+
+    def where(self, **conditions):
+        '''
+        positions matching all of column=value (or column=[values], any of them); head_distance takes ints
+        '''
+        result = None
+        for column, wanted in conditions.items():
+            wanted = [wanted] if isinstance(wanted, (str, int)) else wanted
+            found = np.unique(np.concatenate([self.positions(column, value) for value in wanted]))
+            result = found if result is None else np.intersect1d(result, found, assume_unique=True)
+        return result if result is not None else np.arange(len(self))
+
+    def values(self, column, positions):
+        ids = self._array(column + '.ids')[positions]
+        if column == HEAD_DISTANCE:
+            return np.asarray(ids).tolist()
+        strings = self.meta['values'][column]
+        return [strings[i] for i in ids.tolist()]
+
+    def counter(self, column, positions):
+        ids = self._array(column + '.ids')[positions]
+        counts = Counter(dict(zip(*np.unique(ids, return_counts=True))))
+        if column == HEAD_DISTANCE:
+            return Counter({int(k): int(v) for k, v in counts.items()})
+        strings = self.meta['values'][column]
+        return Counter({strings[int(k)]: int(v) for k, v in counts.items()})
+
+    def sentences(self, positions):
+        # the sentence of every position, numbered over all the files
+        return np.searchsorted(self._array('sentence_starts'), positions, side='right') - 1
+
+    def sentence_forms(self, n):
+        starts = self._array('sentence_starts')
+        return self.values('form', np.arange(starts[n], starts[n + 1]))
+
+    def length_histogram(self):
+        # sentences of length n: histogram[n]
+        return np.array(self._array('lengths'))
+
+    def head_distance_histogram(self):
+        indptr = self._array(HEAD_DISTANCE + '.indptr')
+        low = self.meta['head_distance_min']
+        return {low + n: int(count) for n, count in enumerate(np.diff(indptr)) if count}
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="columnar index over CoNLL-U files")
+    commands = arg_parser.add_subparsers(dest='command')
+    build_parser = commands.add_parser('build')
+    build_parser.add_argument('index')
+    build_parser.add_argument('files', nargs='+')
+    query_parser = commands.add_parser('query')
+    query_parser.add_argument('index')
+    query_parser.add_argument('--where', action='append', default=[], help="COLUMN=V1,V2 (all of them must hold)")
+    query_parser.add_argument('--show', default=None, help="a column to count over the matches")
+    query_parser.add_argument('--top', type=int, default=20)
+    query_parser.add_argument('--lengths', action='store_true', help="sentence length histogram")
+    args = arg_parser.parse_args(argv)
+
+    if args.command == 'build':
+        index = build(args.index, args.files)
+        print("{} tokens, {} sentences".format(len(index), index.meta['sentences']))
+        return
+
+    index = TreebankIndex(args.index)
+    if args.lengths:
+        for length, count in enumerate(index.length_histogram().tolist()):
+            if count:
+                print("{}\t{}".format(length, count))
+        return
+
+    conditions = {}
+    for condition in args.where:
+        column, values = condition.split('=', 1)
+        conditions[column] = [int(v) for v in values.split(',')] if column == HEAD_DISTANCE else values.split(',')
+    positions = index.where(**conditions)
+    print("{} matches".format(len(positions)))
+    if args.show:
+        for value, count in index.counter(args.show, positions).most_common(args.top):
+            sys.stdout.write("{}\t{}\n".format(value, count))
+
+
+if __name__ == '__main__':
+    main()